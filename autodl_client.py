@@ -1,10 +1,21 @@
-import requests
+import contextvars
 import hashlib
 import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Callable, Tuple
 
-from models import Instance
+from models import Instance, MarketMachine, PowerResult
+from metrics import REQUESTS_TOTAL, REQUEST_LATENCY, LOGINS_TOTAL
+from profiling import PROFILER, traced
+from transport import create_transport
+
+# 请求超时（连接, 读取），避免抢卡线程永久阻塞在网络调用上
+DEFAULT_TIMEOUT = (5.0, 15.0)
+# 实例列表最多拉取的页数（每页10个）
+MAX_INSTANCE_PAGES = 20
 
 class AutoDLClient:
     BASE_URL = "https://www.autodl.com/api/v1"
@@ -14,12 +25,31 @@ class AutoDLClient:
     POWER_ON_PATH = "/instance/power_on"
     POWER_OFF_PATH = "/instance/power_off"
     BALANCE_PATH = "/wallet"
+    MARKET_PATH = "/user/machine/list"
     
-    def __init__(self, username: str, password: str):
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        base_url: Optional[str] = None,
+        session=None,
+        on_write: Optional[Callable[["AutoDLClient"], None]] = None,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        # base_url可指向本地模拟服务（见 fake_server.py）
+        if base_url:
+            self.BASE_URL = base_url.rstrip("/")
+        # 开关机后回调，用于使查询缓存失效
+        self.on_write = on_write
+        self.timeout = timeout
         self.username = username
         self.password = self._hash_password(password)
         self.token = ""
-        self.client = requests.Session()
+        # 多线程共用同一客户端时，避免并发重复登录
+        self._login_lock = threading.Lock()
+        # session可替换为录制/回放会话（见 cassette.py），需提供 request() 和 headers；
+        # 多个客户端可共用同一会话（见 ClientPool）
+        self.client = session if session is not None else create_transport()
         self.client.headers.update({
             "accept": "*/*",
             "accept-language": "zh-CN,zh;q=0.9",
@@ -36,6 +66,62 @@ class AutoDLClient:
         sha1.update(password.encode('utf-8'))
         return sha1.hexdigest()
     
+    def _send(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None, auth: bool = True) -> Dict[str, Any]:
+        """发送请求并记录各接口的耗时与结果"""
+        headers = {"authorization": self.token} if auth else None
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            with PROFILER.span(f"http {method} {path}"):
+                response = self.client.request(
+                    method, f"{self.BASE_URL}{path}", json=payload, headers=headers, timeout=self.timeout
+                )
+                resp = response.json()
+            outcome = resp.get("code") or "unknown"
+            return resp
+        except Exception:
+            latency_ms = round((time.perf_counter() - start) * 1000, 1)
+            logging.warning(f"请求{path}失败", extra={"endpoint": path, "latency_ms": latency_ms})
+            raise
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - start, path, outcome)
+            REQUESTS_TOTAL.inc(path, outcome)
+    
+    def _ensure_login(self, stale_token: str = "") -> bool:
+        """确保有可用token；其他线程已刷新过token时直接复用"""
+        with self._login_lock:
+            if self.token and self.token != stale_token:
+                return True
+            return self.login()
+    
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """带token请求，token过期时重新登录并重试一次"""
+        if not self.token:
+            if not self._ensure_login():
+                return None
+        
+        token = self.token
+        resp = self._send(method, path, payload)
+        
+        # 检查token是否过期
+        if resp.get("code") == "AuthorizeFailed":
+            # 重新登录
+            if not self._ensure_login(token):
+                return None
+            
+            # 重新请求
+            resp = self._send(method, path, payload)
+        
+        return resp
+    
+    def _notify_write(self) -> None:
+        if self.on_write is not None:
+            try:
+                self.on_write(self)
+            except Exception as e:
+                logging.error(f"开关机回调出错: {str(e)}")
+    
+    @traced("client.login")
     def login(self) -> bool:
         """登录AutoDL获取token"""
         try:
@@ -48,168 +134,214 @@ class AutoDLClient:
                 "picture_id": None
             }
             
-            response = self.client.post(f"{self.BASE_URL}{self.LOGIN_PATH}", json=login_data)
-            login_resp = response.json()
+            login_resp = self._send("POST", self.LOGIN_PATH, login_data, auth=False)
             
             if login_resp.get("code") != "Success":
-                logging.error(f"登录失败: {login_resp.get('msg')}")
+                logging.error(f"登录失败: {login_resp.get('msg')}", extra={"endpoint": self.LOGIN_PATH})
+                LOGINS_TOTAL.inc("failure")
                 return False
                 
             ticket = login_resp["data"]["ticket"]
             
             # 获取token
             passport_data = {"ticket": ticket}
-            response = self.client.post(f"{self.BASE_URL}{self.PASSPORT_PATH}", json=passport_data)
-            passport_resp = response.json()
+            passport_resp = self._send("POST", self.PASSPORT_PATH, passport_data, auth=False)
             
             if passport_resp.get("code") != "Success":
-                logging.error(f"获取token失败: {passport_resp.get('msg')}")
+                logging.error(f"获取token失败: {passport_resp.get('msg')}", extra={"endpoint": self.PASSPORT_PATH})
+                LOGINS_TOTAL.inc("failure")
                 return False
                 
             self.token = passport_resp["data"]["token"]
+            LOGINS_TOTAL.inc("success")
             logging.info(f"用户{self.username}登录成功，获取到token")
             return True
             
         except Exception as e:
-            logging.error(f"登录出错: {str(e)}")
+            logging.error(f"登录出错: {str(e)}", extra={"endpoint": self.LOGIN_PATH})
+            LOGINS_TOTAL.inc("failure")
             return False
     
-    def get_instances(self) -> List[Instance]:
-        """获取实例列表"""
-        if not self.token:
-            if not self.login():
-                return []
-        
+    @traced("client.get_instances")
+    def get_instances(self) -> Optional[List[Instance]]:
+        """获取实例列表（所有分页）；请求失败时返回None，账号没有实例时返回空列表"""
         try:
-            instance_data = {
-                "date_from": "",
-                "date_to": "",
-                "page_index": 1,
-                "page_size": 10,
-                "status": [],
-                "charge_type": []
-            }
-            
-            response = self.client.post(
-                f"{self.BASE_URL}{self.INSTANCE_PATH}",
-                json=instance_data,
-                headers={"authorization": self.token}
-            )
-            resp = response.json()
-            
-            # 检查token是否过期
-            if resp.get("code") == "AuthorizeFailed":
-                # 重新登录
-                if not self.login():
-                    return []
+            instances: List[Instance] = []
+            page_index, max_page = 1, 1
+            while page_index <= min(max_page, MAX_INSTANCE_PAGES):
+                instance_data = {
+                    "date_from": "",
+                    "date_to": "",
+                    "page_index": page_index,
+                    "page_size": 10,
+                    "status": [],
+                    "charge_type": []
+                }
                 
-                # 重新请求
-                response = self.client.post(
-                    f"{self.BASE_URL}{self.INSTANCE_PATH}",
-                    json=instance_data,
-                    headers={"authorization": self.token}
-                )
-                resp = response.json()
-            
-            if resp.get("code") != "Success":
-                logging.error(f"获取实例失败: {resp.get('msg')}")
-                return []
-            
-            instances = [Instance(**inst) for inst in resp["data"]["list"]]
+                resp = self._request("POST", self.INSTANCE_PATH, instance_data)
+                if resp is None:
+                    return None
+                
+                if resp.get("code") != "Success":
+                    logging.error(f"获取实例失败: {resp.get('msg')}", extra={"endpoint": self.INSTANCE_PATH})
+                    return None
+                
+                data = resp["data"]
+                with PROFILER.span("client.parse_instances"):
+                    instances.extend(Instance(**inst) for inst in data["list"])
+                max_page = int(data.get("max_page") or 1)
+                page_index += 1
             return instances
             
         except Exception as e:
-            logging.error(f"获取实例出错: {str(e)}")
-            return []
+            logging.error(f"获取实例出错: {str(e)}", extra={"endpoint": self.INSTANCE_PATH})
+            return None
 
+    @traced("client.power_on")
     def power_on(self, uuid: str, use_cpu: bool = False) -> bool:
         """启动实例"""
-        if not self.token:
-            if not self.login():
-                return False
-        
         try:
             power_data = {"instance_uuid": uuid}
             if use_cpu:
                 power_data["restart_type"] = "cpu"
             
-            response = self.client.post(
-                f"{self.BASE_URL}{self.POWER_ON_PATH}",
-                json=power_data,
-                headers={"authorization": self.token}
-            )
-            
-            resp = response.json()
-            # 处理token过期
-            if resp.get("code") == "AuthorizeFailed":
-                if not self.login():
-                    return False
-                response = self.client.post(
-                    f"{self.BASE_URL}{self.POWER_ON_PATH}",
-                    json=power_data,
-                    headers={"authorization": self.token}
-                )
-                resp = response.json()
+            resp = self._request("POST", self.POWER_ON_PATH, power_data)
+            if resp is None:
+                return False
             
             return resp.get("code") == "Success"
             
         except Exception as e:
-            logging.error(f"启动实例出错: {str(e)}")
+            logging.error(f"启动实例出错: {str(e)}", extra={"endpoint": self.POWER_ON_PATH, "uuid": uuid})
             return False
+        finally:
+            self._notify_write()
             
+    @traced("client.power_off")
     def power_off(self, uuid: str) -> bool:
         """关闭实例"""
-        if not self.token:
-            if not self.login():
-                return False
-        
         try:
             power_data = {"instance_uuid": uuid}
-            response = self.client.post(
-                f"{self.BASE_URL}{self.POWER_OFF_PATH}",
-                json=power_data,
-                headers={"authorization": self.token}
-            )
-            
-            resp = response.json()
-            # 处理token过期
-            if resp.get("code") == "AuthorizeFailed":
-                if not self.login():
-                    return False
-                response = self.client.post(
-                    f"{self.BASE_URL}{self.POWER_OFF_PATH}",
-                    json=power_data,
-                    headers={"authorization": self.token}
-                )
-                resp = response.json()
+            resp = self._request("POST", self.POWER_OFF_PATH, power_data)
+            if resp is None:
+                return False
             
             return resp.get("code") == "Success"
             
         except Exception as e:
-            logging.error(f"关闭实例出错: {str(e)}")
+            logging.error(f"关闭实例出错: {str(e)}", extra={"endpoint": self.POWER_OFF_PATH, "uuid": uuid})
             return False
+        finally:
+            self._notify_write()
+    
+    def _power_one(self, path: str, uuid: str, use_cpu: bool = False) -> PowerResult:
+        """开关单个实例并记录耗时和失败原因"""
+        start = time.perf_counter()
+        power_data = {"instance_uuid": uuid}
+        if use_cpu:
+            power_data["restart_type"] = "cpu"
+        
+        try:
+            resp = self._request("POST", path, power_data)
+            if resp is None:
+                success, error = False, "登录失败"
+            else:
+                success = resp.get("code") == "Success"
+                error = "" if success else (resp.get("msg") or resp.get("code") or "")
+        except Exception as e:
+            logging.error(f"批量操作实例出错: {str(e)}", extra={"endpoint": path, "uuid": uuid})
+            success, error = False, str(e)
+        
+        return PowerResult(
+            uuid=uuid,
+            success=success,
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 1),
+            error=error,
+        )
     
+    def _power_many(self, path: str, uuids: Iterable[str], use_cpu: bool, max_workers: int) -> List[PowerResult]:
+        uuids = list(dict.fromkeys(uuids))
+        if not uuids:
+            return []
+        
+        # 先登录一次，所有并发请求共用同一token和会话
+        if not self.token and not self._ensure_login():
+            return [PowerResult(uuid=uuid, success=False, elapsed_ms=0, error="登录失败") for uuid in uuids]
+        
+        try:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(uuids))) as executor:
+                # 每个请求复制一份调用方的上下文（日志字段 user_id 等）
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._power_one, path, uuid, use_cpu)
+                    for uuid in uuids
+                ]
+                return [future.result() for future in futures]
+        finally:
+            self._notify_write()
+    
+    @traced("client.power_on_many")
+    def power_on_many(self, uuids: Iterable[str], use_cpu: bool = False, max_workers: int = 8) -> List[PowerResult]:
+        """并发启动多个实例，按输入顺序返回每个实例的结果"""
+        return self._power_many(self.POWER_ON_PATH, uuids, use_cpu, max_workers)
+    
+    @traced("client.power_off_many")
+    def power_off_many(self, uuids: Iterable[str], max_workers: int = 8) -> List[PowerResult]:
+        """并发关闭多个实例，按输入顺序返回每个实例的结果"""
+        return self._power_many(self.POWER_OFF_PATH, uuids, False, max_workers)
+    
+    @traced("client.get_market_page")
+    def get_market_page(
+        self,
+        page_index: int = 1,
+        page_size: int = 100,
+        gpu_types: Optional[List[str]] = None,
+        idle_only: bool = False,
+    ) -> Optional[Tuple[List[MarketMachine], int]]:
+        """获取算力市场的一页机器及总页数，失败时返回None"""
+        try:
+            market_data = {
+                "charge_type": "payg",
+                "region_sign": "",
+                "gpu_type_name": gpu_types or [],
+                "machine_tag_name": [],
+                "gpu_idle_num": 1 if idle_only else 0,
+                "mount_net_disk": False,
+                "instance_disk_size_order": "",
+                "date_range": "",
+                "date_from": "",
+                "date_to": "",
+                "page_index": page_index,
+                "page_size": page_size,
+                "pay_price_order": "",
+                "gpu_idle_type": "",
+                "default_order": True,
+                "region_tag": "",
+            }
+            
+            resp = self._request("POST", self.MARKET_PATH, market_data)
+            if resp is None:
+                return None
+            
+            if resp.get("code") != "Success":
+                logging.error(f"获取算力市场失败: {resp.get('msg')}", extra={"endpoint": self.MARKET_PATH})
+                return None
+            
+            data = resp["data"]
+            with PROFILER.span("client.parse_market"):
+                machines = [MarketMachine(**item) for item in data.get("list") or []]
+            return machines, int(data.get("max_page") or 1)
+            
+        except Exception as e:
+            logging.error(f"获取算力市场出错: {str(e)}", extra={"endpoint": self.MARKET_PATH})
+            return None
+    
+    @traced("client.get_balance")
     def get_balance(self) -> float:
         """获取余额"""
-        if not self.token:
-            if not self.login():
-                return -1
-                
         try:
-            response = self.client.get(
-                f"{self.BASE_URL}{self.BALANCE_PATH}",
-                headers={"authorization": self.token}
-            )
-            
-            resp = response.json()
-            if resp.get("code") == "AuthorizeFailed":
-                if not self.login():
-                    return -1
-                response = self.client.get(
-                    f"{self.BASE_URL}{self.BALANCE_PATH}",
-                    headers={"authorization": self.token}
-                )
-                resp = response.json()
+            resp = self._request("GET", self.BALANCE_PATH)
+            if resp is None:
+                return -1
                 
             if resp.get("code") != "Success":
                 return -1
@@ -217,5 +349,42 @@ class AutoDLClient:
             return float(resp["data"]["assets"]) / 100
             
         except Exception as e:
-            logging.error(f"获取余额出错: {str(e)}")
-            return -1
\ No newline at end of file
+            logging.error(f"获取余额出错: {str(e)}", extra={"endpoint": self.BALANCE_PATH})
+            return -1
+
+class ClientPool:
+    """按账号复用客户端，多个任务共用同一token；所有账号共用一个HTTP会话"""
+    
+    def __init__(self, max_size: int = 256, on_write: Optional[Callable[[AutoDLClient], None]] = None, session=None):
+        self.max_size = max_size
+        self.on_write = on_write
+        # 共用的连接池，见 transport.create_transport
+        self.session = session if session is not None else create_transport()
+        self._clients: "OrderedDict[tuple, AutoDLClient]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, username: str, password: str, base_url: Optional[str] = None) -> AutoDLClient:
+        # 密码变化后使用新的客户端
+        key = (username, password, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+            
+            client = AutoDLClient(username, password, base_url=base_url, session=self.session, on_write=self.on_write)
+            self._clients[key] = client
+            if len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            return client
+    
+    def discard(self, client: AutoDLClient) -> None:
+        """移除客户端（例如其token或状态异常时），下次获取时重新创建"""
+        with self._lock:
+            for key, pooled in list(self._clients.items()):
+                if pooled is client:
+                    del self._clients[key]
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from autodl_client import AutoDLClient
+
+
+class _Entry:
+    __slots__ = ("balance", "fetched_at", "history")
+
+    def __init__(self, history_size: int):
+        self.balance: Optional[float] = None
+        self.fetched_at = 0.0
+        # (时间戳, 余额)
+        self.history: Deque[Tuple[float, float]] = deque(maxlen=history_size)
+
+
+class BalanceCache:
+    """按账号缓存余额：新鲜期内直接返回，过期后先返回旧值再后台刷新，并记录历史用于估算消耗速度"""
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        stale_ttl: float = 600.0,
+        history_size: int = 120,
+        burn_window: float = 6 * 3600,
+        workers: int = 2,
+    ):
+        # ttl: 新鲜期; stale_ttl: 超过该时长的旧值不再返回，改为同步查询
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.history_size = history_size
+        self.burn_window = burn_window
+
+        self._entries: Dict[str, _Entry] = {}
+        self._refreshing: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="balance")
+
+    def get(self, client: AutoDLClient, wait: bool = True) -> Optional[float]:
+        """获取账号余额，查询失败或无可用值时返回None"""
+        # wait=False 时从不阻塞，只返回已缓存的值（可能为None），需要时触发后台刷新
+        key = client.username
+        with self._lock:
+            entry = self._entries.get(key)
+            balance = entry.balance if entry else None
+            age = time.time() - entry.fetched_at if balance is not None else None
+
+        if age is not None and age < self.ttl:
+            return balance
+
+        if not wait or (age is not None and age < self.stale_ttl):
+            self._refresh_async(client)
+            return balance
+
+        return self._fetch(client)
+
+    def peek(self, username: str) -> Optional[float]:
+        """只读缓存，不发起请求"""
+        with self._lock:
+            entry = self._entries.get(username)
+            return entry.balance if entry else None
+
+    def record(self, username: str, balance: float, at: Optional[float] = None) -> None:
+        """记录一次余额（也可由其他查询顺带写入）"""
+        at = time.time() if at is None else at
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                entry = self._entries[username] = _Entry(self.history_size)
+            if at >= entry.fetched_at:
+                entry.balance = balance
+                entry.fetched_at = at
+            entry.history.append((at, balance))
+
+    def invalidate(self, username: str) -> None:
+        """标记为过期（例如开机后），下一次读取会刷新"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry:
+                entry.fetched_at = 0.0
+
+    def history(self, username: str) -> List[Tuple[float, float]]:
+        with self._lock:
+            entry = self._entries.get(username)
+            return list(entry.history) if entry else []
+
+    def burn_rate(self, username: str) -> Optional[float]:
+        """最近窗口内的消耗速度（元/小时），充值带来的增加不计入；数据不足时返回None"""
+        cutoff = time.time() - self.burn_window
+        points = [p for p in self.history(username) if p[0] >= cutoff]
+        if len(points) < 2:
+            return None
+
+        elapsed = points[-1][0] - points[0][0]
+        if elapsed <= 0:
+            return None
+
+        spent = sum(
+            max(0.0, prev_balance - balance)
+            for (_, prev_balance), (_, balance) in zip(points, points[1:])
+        )
+        return spent / (elapsed / 3600)
+
+    def time_to_zero(self, username: str) -> Optional[float]:
+        """按当前消耗速度预计余额耗尽的秒数，不在消耗时返回None"""
+        balance = self.peek(username)
+        rate = self.burn_rate(username)
+        if balance is None or not rate:
+            return None
+        return max(0.0, balance) / rate * 3600
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def _fetch(self, client: AutoDLClient) -> Optional[float]:
+        balance = client.get_balance()
+        if balance < 0:
+            return None
+        self.record(client.username, balance)
+        return balance
+
+    def _refresh_async(self, client: AutoDLClient) -> None:
+        key = client.username
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._fetch(client)
+            except Exception as e:
+                logging.error(f"后台刷新余额出错: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self._executor.submit(refresh)
+        except RuntimeError:
+            # 已关闭
+            with self._lock:
+                self._refreshing.discard(key)
@@ -0,0 +1,376 @@
+# 热点路径基准测试
+#
+# 用法:
+#     python benchmark.py                                   # 运行全部基准并写入 bench_results.json
+#     python benchmark.py --only parse storage --sizes 10000 100000
+#     python benchmark.py --output new.json --compare benchmarks/baseline.json
+#     python benchmark.py --only parse --replay traffic.jsonl       # 附加回放录制流量
+#
+# 结果为JSON，可作为基线保存并在版本之间对比；--compare 发现退化超过阈值时以非零状态退出。
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# 各指标是否越大越好（用于对比时判断退化方向）
+HIGHER_IS_BETTER = ("per_sec", "grabbed")
+
+
+def _timeit(func: Callable[[], Any], repeat: int = 5) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _instance_payload(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    gpu_types = ["RTX 4090", "RTX 3090", "A100-SXM4-80GB", "V100-32GB", "RTX A5000"]
+    return [
+        {
+            "machine_alias": f"{i % 200 + 1}号机",
+            "region_name": rnd.choice(["西北B区", "北京A区", "内蒙A区"]),
+            "gpu_all_num": 8,
+            "gpu_idle_num": rnd.choice([0, 0, 0, 0, 1, 2]),
+            "uuid": f"bench-{i:08d}",
+            "snapshot_gpu_alias_name": rnd.choice(gpu_types),
+            "stopped_at": {"time": "2024-01-01T00:00:00Z", "valid": True},
+        }
+        for i in range(count)
+    ]
+
+
+class _CannedResponse:
+    def __init__(self, raw: bytes):
+        self._raw = raw
+
+    def json(self) -> Any:
+        return json.loads(self._raw)
+
+
+class _CannedSession:
+    """固定返回同一响应的会话，用于排除网络开销"""
+
+    def __init__(self, payload: Dict[str, Any]):
+        self._raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.headers: Dict[str, str] = {}
+
+    def request(self, method: str, url: str, **kwargs) -> _CannedResponse:
+        return _CannedResponse(self._raw)
+
+
+def bench_parse(sizes: List[int]) -> Dict[str, Any]:
+    """get_instances 解析吞吐（JSON解码 + pydantic校验）"""
+    from autodl_client import AutoDLClient
+
+    results = {}
+    for size in sizes:
+        client = AutoDLClient("bench", "bench")
+        client.token = "bench"
+        client.client = _CannedSession({"code": "Success", "data": {"list": _instance_payload(size)}})
+        repeat = max(3, min(20, 200000 // max(size, 1)))
+        timings = _timeit(client.get_instances, repeat)
+        best = min(timings)
+        results[f"instances_{size}"] = {
+            "best_sec": best,
+            "median_sec": statistics.median(timings),
+            "instances_per_sec": size / best if best else 0.0,
+        }
+    return results
+
+
+def bench_storage(sizes: List[int]) -> Dict[str, Any]:
+    """UserStorage 写入与全量/按需加载"""
+    from models import AutoDLConfig, GrabConfig
+    from storage import UserStorage
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = UserStorage(os.path.join(tmp, "bench.db"))
+            configs = {}
+            for user_id in range(size):
+                config = AutoDLConfig(username=f"1380{user_id:07d}", password="password")
+                if user_id % 100 == 0:
+                    config.grab_config = GrabConfig(enabled=True, gpu_types=["4090"], is_running=True)
+                configs[user_id] = config
+
+            # 单条保存（每次独立连接和事务），取样计算单次耗时
+            sample = min(size, 500)
+            start = time.perf_counter()
+            for user_id in range(sample):
+                storage.save_user(user_id, configs[user_id])
+            save_one = (time.perf_counter() - start) / sample
+
+            start = time.perf_counter()
+            storage.save_users(configs)
+            save_batch = time.perf_counter() - start
+
+            load_all = min(_timeit(storage.load_all_users, 3))
+            load_running = min(_timeit(storage.load_running_users, 3))
+            load_refresh_ids = min(_timeit(storage.load_auto_refresh_user_ids, 3))
+
+            results[f"users_{size}"] = {
+                "save_user_sec": save_one,
+                "save_users_batch_sec": save_batch,
+                "save_users_per_sec": size / save_batch if save_batch else 0.0,
+                "load_all_users_sec": load_all,
+                "load_running_users_sec": load_running,
+                "load_auto_refresh_user_ids_sec": load_refresh_ids,
+            }
+    return results
+
+
+def bench_matching(sizes: List[int]) -> Dict[str, Any]:
+    """每次轮询的抢卡匹配开销"""
+    from grab import find_grab_candidates
+    from models import GrabConfig, Instance
+
+    results = {}
+    by_type = GrabConfig(gpu_types=["4090", "A100"])
+    by_uuid = GrabConfig(instance_uuid="bench-00000007")
+    for size in sizes:
+        instances = [Instance(**item) for item in _instance_payload(size)]
+        loops = max(10, 100000 // max(size, 1))
+
+        def run_type():
+            for _ in range(loops):
+                find_grab_candidates(instances, by_type)
+
+        def run_uuid():
+            for _ in range(loops):
+                find_grab_candidates(instances, by_uuid)
+
+        best_type = min(_timeit(run_type, 3)) / loops
+        best_uuid = min(_timeit(run_uuid, 3)) / loops
+        results[f"instances_{size}"] = {
+            "gpu_type_tick_sec": best_type,
+            "uuid_tick_sec": best_uuid,
+            "gpu_type_ticks_per_sec": 1 / best_type if best_type else 0.0,
+        }
+    return results
+
+
+def bench_render(sizes: List[int]) -> Dict[str, Any]:
+    """实例列表渲染：首次渲染与按快照指纹命中缓存"""
+    from models import Instance
+    from views import ViewCache
+
+    results = {}
+    for size in sizes:
+        instances = [Instance(**item) for item in _instance_payload(size)]
+        loops = max(3, 10000 // max(size, 1))
+
+        def run_cold():
+            for _ in range(loops):
+                list(ViewCache().render("gpuvalid", instances))
+
+        cache = ViewCache()
+        list(cache.render("gpuvalid", instances))
+
+        def run_cached():
+            for _ in range(loops):
+                list(cache.render("gpuvalid", instances))
+
+        best_cold = min(_timeit(run_cold, 3)) / loops
+        best_cached = min(_timeit(run_cached, 3)) / loops
+        results[f"instances_{size}"] = {
+            "render_sec": best_cold,
+            "cached_sec": best_cached,
+            "renders_per_sec": 1 / best_cold if best_cold else 0.0,
+        }
+    return results
+
+
+def bench_e2e(jobs: int, duration: float, interval: float, latency: float) -> Dict[str, Any]:
+    """对本地模拟服务运行N个并发抢卡任务，测量吞吐与空闲出现到启动成功的延迟"""
+    from autodl_client import AutoDLClient
+    from fake_server import FakeAutoDL, FakeAutoDLServer, FakeInstance
+    from grab import GrabJob
+    from models import GrabConfig
+    from notifier import CallbackNotifier
+
+    app = FakeAutoDL(latency=(latency, latency), seed=1)
+    idle_from: Dict[str, float] = {}
+    rnd = random.Random(1)
+    for n in range(jobs):
+        phone = f"1390{n:07d}"
+        app.add_user(phone, "password")
+        offset = rnd.uniform(duration * 0.2, duration * 0.7)
+        uuid = f"{phone}-0"
+        idle_from[uuid] = offset
+        app.add_instance(phone, FakeInstance(uuid, "1号机", "西北B区", "RTX 4090", schedule=[(0, 0), (offset, 1)]))
+
+    polls = [0]
+    errors = [0]
+    latencies: List[float] = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    with FakeAutoDLServer(app) as server:
+        started_at = app.started_at
+
+        def job(phone: str) -> None:
+            client = AutoDLClient(phone, "password", base_url=server.base_url)
+            notifier = CallbackNotifier(lambda *args: None)
+            grab_job = GrabJob(0, GrabConfig(enabled=True, gpu_types=["4090"]), client, notifier)
+            while not stop.is_set():
+                try:
+                    grabbed = grab_job.tick()
+                    with lock:
+                        polls[0] += 1
+                    if grabbed:
+                        done = time.time()
+                        with lock:
+                            latencies.append(done - (started_at + idle_from[f"{phone}-0"]))
+                        return
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                stop.wait(interval)
+
+        threads = [threading.Thread(target=job, args=(f"1390{n:07d}",), daemon=True) for n in range(jobs)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=max(0.0, duration - (time.perf_counter() - start)))
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        elapsed = time.perf_counter() - start
+
+    return {
+        f"jobs_{jobs}": {
+            "polls_per_sec": polls[0] / elapsed if elapsed else 0.0,
+            "grabbed": len(latencies),
+            "errors": errors[0],
+            "detect_to_power_on_p50_ms": _percentile(latencies, 0.5) * 1000,
+            "detect_to_power_on_p95_ms": _percentile(latencies, 0.95) * 1000,
+            "detect_to_power_on_max_ms": max(latencies) * 1000 if latencies else 0.0,
+        }
+    }
+
+
+def bench_replay(path: str, calls: int) -> Dict[str, Any]:
+    """用录制的真实流量（cassette.py）回放 get_instances，测量解析与轮询开销"""
+    from autodl_client import AutoDLClient
+    from cassette import ReplaySession
+
+    client = AutoDLClient("replay", "replay", session=ReplaySession(path, loop=True))
+    start = time.perf_counter()
+    for _ in range(calls):
+        client.get_instances()
+    elapsed = time.perf_counter() - start
+    return {
+        os.path.basename(path): {
+            "calls": calls,
+            "total_sec": elapsed,
+            "calls_per_sec": calls / elapsed if elapsed else 0.0,
+        }
+    }
+
+
+def _metadata() -> Dict[str, Any]:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        revision = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": revision,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """对比两次结果，返回超过阈值的退化项"""
+    regressions = []
+    for bench, cases in current["results"].items():
+        for case, metrics in cases.items():
+            base_metrics = baseline.get("results", {}).get(bench, {}).get(case)
+            if not base_metrics:
+                continue
+            for name, value in metrics.items():
+                base = base_metrics.get(name)
+                if not isinstance(base, (int, float)) or not isinstance(value, (int, float)) or not base:
+                    continue
+                change = (value - base) / base
+                worse = -change if any(name.endswith(s) for s in HIGHER_IS_BETTER) else change
+                marker = ""
+                if worse > threshold:
+                    marker = "  <-- 退化"
+                    regressions.append(f"{bench}.{case}.{name}")
+                print(f"{bench}.{case}.{name}: {base:.6g} -> {value:.6g} ({change:+.1%}){marker}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="AutoDL机器人热点路径基准测试")
+    parser.add_argument("--only", nargs="+", choices=["parse", "storage", "matching", "render", "e2e"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000, 100000], help="存储基准的用户数")
+    parser.add_argument("--payload-sizes", nargs="+", type=int, default=[10, 1000, 10000])
+    parser.add_argument("--jobs", type=int, default=200, help="端到端基准的并发抢卡任务数")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务注入的延迟（秒）")
+    parser.add_argument("--replay", help="录制文件，额外运行回放基准")
+    parser.add_argument("--replay-calls", type=int, default=10000)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="基线JSON文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定退化的相对变化阈值")
+    args = parser.parse_args(argv)
+
+    selected = args.only or ["parse", "storage", "matching", "render", "e2e"]
+    results: Dict[str, Any] = {}
+    if "parse" in selected:
+        results["parse"] = bench_parse(args.payload_sizes)
+    if "storage" in selected:
+        results["storage"] = bench_storage(args.sizes)
+    if "matching" in selected:
+        results["matching"] = bench_matching(args.payload_sizes)
+    if "render" in selected:
+        results["render"] = bench_render(args.payload_sizes)
+    if "e2e" in selected:
+        results["e2e"] = bench_e2e(args.jobs, args.duration, args.interval, args.latency)
+    if args.replay:
+        results["replay"] = bench_replay(args.replay, args.replay_calls)
+
+    report = {"meta": _metadata(), "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 项退化")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# AutoDLClient流量录制与回放
+#
+# 录制: client.client = RecordingSession(client.client, "traffic.jsonl")
+# 回放: client = AutoDLClient(user, pwd, session=ReplaySession("traffic.jsonl", realtime=True))
+#
+# 录制文件每行一条JSON记录，只追加写入；token、ticket、手机号和密码在写入前脱敏。
+# 抛出异常的请求也会录制（异常类型、消息和耗时），回放时在相同耗时后抛出同类型异常。
+import importlib
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+REDACTED = "***"
+SENSITIVE_KEYS = {"phone", "password", "token", "ticket", "authorization", "v_code"}
+PHONE_PATTERN = re.compile(r"(?<!\d)1\d{10}(?!\d)")
+
+
+def redact(value: Any) -> Any:
+    """递归脱敏：敏感字段整体替换，字符串中的手机号打码"""
+    if isinstance(value, dict):
+        return {k: REDACTED if k in SENSITIVE_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return PHONE_PATTERN.sub(lambda m: m.group(0)[:3] + "****" + m.group(0)[-4:], value)
+    return value
+
+
+def _endpoint(url: str) -> str:
+    """去掉域名和API前缀，只保留接口路径"""
+    path = urlsplit(url).path
+    marker = "/api/v1"
+    index = path.find(marker)
+    return path[index + len(marker):] if index >= 0 else path
+
+
+class RecordingSession:
+    """包装真实会话，把每次请求和响应追加写入录制文件"""
+
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    @property
+    def headers(self):
+        return self.inner.headers
+
+    def request(self, method: str, url: str, json: Optional[Dict[str, Any]] = None, headers=None, **kwargs):
+        offset = time.monotonic() - self._started
+        start = time.perf_counter()
+        record = {
+            "t": round(offset, 4),
+            "method": method,
+            "path": _endpoint(url),
+            "auth": bool(headers and headers.get("authorization")),
+            "req": redact(json),
+        }
+        try:
+            response = self.inner.request(method, url, json=json, headers=headers, **kwargs)
+        except Exception as e:
+            # 超时、连接失败等也是真实流量的一部分，录制后原样抛出
+            record["elapsed"] = round(time.perf_counter() - start, 4)
+            record["error"] = {"type": _type_name(type(e)), "message": redact(str(e))}
+            self._write(record)
+            raise
+        record["elapsed"] = round(time.perf_counter() - start, 4)
+
+        try:
+            body: Any = response.json()
+        except ValueError:
+            body = {"_raw": response.text}
+
+        record["status"] = getattr(response, "status_code", 200)
+        record["resp"] = redact(body)
+        self._write(record)
+        return response
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = _dumps(record)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _dumps(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+class RecordedError(Exception):
+    """回放时无法导入录制的异常类型，用它代替"""
+
+
+def _type_name(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def _load_exception(name: str, message: str) -> BaseException:
+    """按录制的类型名重建异常"""
+    module_name, _, qualname = name.rpartition(".")
+    try:
+        cls: Any = importlib.import_module(module_name)
+        for part in qualname.split("."):
+            cls = getattr(cls, part)
+        if isinstance(cls, type) and issubclass(cls, BaseException):
+            return cls(message)
+    except Exception:
+        pass
+    return RecordedError(f"{name}: {message}")
+
+
+class ReplayResponse:
+    def __init__(self, status_code: int, body: Any):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self) -> Any:
+        if isinstance(self._body, dict) and "_raw" in self._body:
+            raise ValueError("录制的响应不是JSON")
+        return self._body
+
+    @property
+    def text(self) -> str:
+        if isinstance(self._body, dict) and "_raw" in self._body:
+            return self._body["_raw"]
+        return _dumps(self._body)
+
+
+class ReplaySession:
+    """按录制文件回放响应；realtime为True时按原始时间间隔和耗时回放，否则尽快返回"""
+
+    def __init__(self, path: str, realtime: bool = False, speed: float = 1.0, loop: bool = False):
+        self.realtime = realtime
+        self.speed = speed
+        self.loop = loop
+        self.headers: Dict[str, str] = {}
+
+        self._records: Dict[Tuple[str, str], list] = defaultdict(list)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    self._records[(record["method"], record["path"])].append(record)
+
+        self._queues: Dict[Tuple[str, str], Deque[dict]] = {
+            key: deque(records) for key, records in self._records.items()
+        }
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def request(self, method: str, url: str, **kwargs) -> ReplayResponse:
+        key = (method, _endpoint(url))
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue and self.loop and key in self._records:
+                queue = self._queues[key] = deque(self._records[key])
+            if not queue:
+                raise LookupError(f"录制文件中没有更多 {method} {key[1]} 的响应")
+            record = queue.popleft()
+
+        if self.realtime:
+            # 等到原始请求发出的时刻，再模拟原始耗时
+            wait = record["t"] / self.speed - (time.monotonic() - self._started)
+            if wait > 0:
+                time.sleep(wait)
+            time.sleep(record["elapsed"] / self.speed)
+
+        error = record.get("error")
+        if error is not None:
+            raise _load_exception(error["type"], error.get("message", ""))
+        return ReplayResponse(record.get("status", 200), record["resp"])
+
+    def remaining(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
@@ -0,0 +1,173 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Set
+
+from storage import UserStorage
+
+if TYPE_CHECKING:
+    from models import AutoDLConfig
+
+
+class ConfigCache:
+    """用户配置缓存：容量有限的LRU，首次访问时加载，修改后由后台线程批量写回"""
+
+    def __init__(self, storage: UserStorage, max_size: int = 1000, flush_interval: float = 2.0):
+        self.storage = storage
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+
+        self._entries: "OrderedDict[int, AutoDLConfig]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        # 被淘汰但尚未写回的配置
+        self._evicted: Dict[int, "AutoDLConfig"] = {}
+        # 正在写回、尚未提交的配置；提交前数据库中仍是旧值，读取时以这里为准
+        self._inflight: Dict[int, "AutoDLConfig"] = {}
+        # 每次修改或写回提交时递增，锁外加载期间有变化时重新加载
+        self._version = 0
+        # 有运行中任务的用户不会被淘汰
+        self._pinned: Set[int] = set()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="config-flusher", daemon=True)
+        self._thread.start()
+
+    def get(self, user_id: int, fresh: bool = False) -> "AutoDLConfig":
+        """获取用户配置，未缓存时从数据库加载（在锁外读取数据库）"""
+        # fresh: 没有未写回的修改时重新从数据库读取（其他进程也会修改配置时使用）
+        if fresh:
+            with self._lock:
+                if user_id not in self._dirty and user_id not in self._evicted and user_id not in self._inflight:
+                    self._entries.pop(user_id, None)
+        while True:
+            with self._lock:
+                config = self._cached(user_id)
+                if config is not None:
+                    return config
+                version = self._version
+
+            loaded = self.storage.load_user(user_id)
+            if loaded is None:
+                from models import AutoDLConfig
+                loaded = AutoDLConfig()
+
+            with self._lock:
+                config = self._cached(user_id)
+                if config is not None:
+                    return config
+                if self._version == version:
+                    self._insert(user_id, loaded)
+                    return loaded
+            # 加载期间有写回提交，读到的可能是旧值，重新加载
+
+    def _cached(self, user_id: int) -> Optional["AutoDLConfig"]:
+        """缓存中的配置，包括已淘汰或正在写回的（调用方持有锁）"""
+        config = self._entries.get(user_id)
+        if config is not None:
+            self._entries.move_to_end(user_id)
+            return config
+
+        config = self._evicted.pop(user_id, None)
+        if config is not None:
+            # 尚未写回的配置重新放回缓存，保持脏标记
+            self._insert(user_id, config)
+            self._dirty.add(user_id)
+            return config
+
+        config = self._inflight.get(user_id)
+        if config is not None:
+            # 正在写回，写回失败时会重新标记为脏
+            self._insert(user_id, config)
+        return config
+
+    def put(self, user_id: int, config: "AutoDLConfig") -> None:
+        """更新用户配置并标记为待写回"""
+        with self._lock:
+            self._evicted.pop(user_id, None)
+            self._insert(user_id, config)
+            self._dirty.add(user_id)
+            self._version += 1
+
+    def preload(self, configs: Dict[int, "AutoDLConfig"]) -> None:
+        """放入已从数据库读出的配置（不标记为待写回）"""
+        with self._lock:
+            for user_id, config in configs.items():
+                if user_id not in self._entries:
+                    self._insert(user_id, config)
+
+    def pin(self, user_id: int) -> None:
+        with self._lock:
+            self._pinned.add(user_id)
+
+    def unpin(self, user_id: int) -> None:
+        with self._lock:
+            self._pinned.discard(user_id)
+            self._evict()
+
+    def __contains__(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _insert(self, user_id: int, config: "AutoDLConfig") -> None:
+        self._entries[user_id] = config
+        self._entries.move_to_end(user_id)
+        self._evict()
+
+    def _evict(self) -> None:
+        if len(self._entries) <= self.max_size:
+            return
+        for user_id in list(self._entries.keys()):
+            if len(self._entries) <= self.max_size:
+                break
+            if user_id in self._pinned:
+                continue
+            config = self._entries.pop(user_id)
+            if user_id in self._dirty:
+                self._dirty.discard(user_id)
+                self._evicted[user_id] = config
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """批量写回所有待写回的配置，返回写入条数"""
+        with self._flush_lock:
+            with self._lock:
+                batch = dict(self._evicted)
+                for user_id in self._dirty:
+                    batch[user_id] = self._entries[user_id]
+                self._evicted.clear()
+                self._dirty.clear()
+                self._inflight = batch
+
+            if not batch:
+                return 0
+
+            saved = self.storage.save_users(batch)
+            with self._lock:
+                self._inflight = {}
+                self._version += 1
+                if not saved:
+                    # 写入失败，重新标记等待下一次写回
+                    for user_id, config in batch.items():
+                        if user_id in self._entries:
+                            self._dirty.add(user_id)
+                        else:
+                            self._evicted.setdefault(user_id, config)
+            if not saved:
+                logging.error(f"批量写回用户配置失败，{len(batch)}条待重试")
+                return 0
+            return len(batch)
+
+    def close(self) -> None:
+        """停止后台写回线程并写回全部修改"""
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
@@ -0,0 +1,138 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics import GRAB_SCHEDULER_WAIT
+from ratelimit import TokenBucket
+
+# 优先级档位 -> 权重，权重越大分到的请求预算越多
+TIERS: Dict[str, float] = {
+    "low": 0.5,
+    "normal": 1.0,
+    "high": 2.0,
+    "vip": 4.0,
+}
+DEFAULT_TIER = "normal"
+
+
+class _Waiter:
+    __slots__ = ("user_id", "tier", "cost", "start_tag", "enqueued_at", "granted")
+
+    def __init__(self, user_id: int, tier: str, cost: float, start_tag: float, enqueued_at: float):
+        self.user_id = user_id
+        self.tier = tier
+        self.cost = cost
+        self.start_tag = start_tag
+        self.enqueued_at = enqueued_at
+        self.granted = threading.Event()
+
+
+# 每个用户按权重分配预算，检查间隔短的用户不会挤占其他用户；
+# 设置了最低轮询频率的用户到期后优先放行；排队越久优先级越高，避免低权重用户饿死
+class PollScheduler:
+    """所有抢卡轮询共用的请求预算，按用户权重公平排队（起始时间标记的加权公平队列）"""
+
+    def __init__(self, rate: float = 20.0, burst: float = 20.0, aging: float = 0.5):
+        # rate: 全局每秒请求数; aging: 每排队1秒，虚拟时间标记提前多少
+        self.bucket = TokenBucket(rate, burst)
+        self.aging = aging
+
+        self._virtual_time = 0.0
+        # 用户 -> 上一个请求的结束标记
+        self._finish: Dict[int, float] = {}
+        self._last_grant: Dict[int, float] = {}
+        self._min_rates: Dict[int, float] = {}
+        self._waiting: List[_Waiter] = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def set_min_rate(self, user_id: int, polls_per_minute: float) -> None:
+        """保证用户每分钟至少获得的轮询次数，0表示不保证"""
+        with self._cond:
+            if polls_per_minute > 0:
+                self._min_rates[user_id] = polls_per_minute / 60
+            else:
+                self._min_rates.pop(user_id, None)
+
+    def acquire(
+        self,
+        user_id: int,
+        stop_signal: threading.Event,
+        tier: str = DEFAULT_TIER,
+        cost: float = 1.0,
+    ) -> bool:
+        """排队等待轮询许可，收到停止信号时返回False"""
+        weight = TIERS.get(tier, TIERS[DEFAULT_TIER])
+        cost = min(cost, self.bucket.capacity)
+        now = time.monotonic()
+        with self._cond:
+            start_tag = max(self._virtual_time, self._finish.get(user_id, 0.0))
+            self._finish[user_id] = start_tag + cost / weight
+            waiter = _Waiter(user_id, tier, cost, start_tag, now)
+            self._waiting.append(waiter)
+            self._cond.notify()
+
+        self._ensure_started()
+        while not waiter.granted.wait(0.5):
+            if stop_signal.is_set() or self._stop.is_set():
+                with self._cond:
+                    if waiter.granted.is_set():
+                        break
+                    self._waiting.remove(waiter)
+                    # 未使用的份额退还，避免该用户之后被多算
+                    if self._finish.get(user_id) == start_tag + cost / weight:
+                        self._finish[user_id] = start_tag
+                return False
+
+        GRAB_SCHEDULER_WAIT.observe(time.monotonic() - now, tier)
+        return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _ensure_started(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="poll-scheduler", daemon=True)
+            self._thread.start()
+
+    def _priority(self, waiter: _Waiter, now: float) -> Tuple[int, float]:
+        # 最低频率到期的用户优先，按逾期时长排序
+        min_rate = self._min_rates.get(waiter.user_id)
+        if min_rate:
+            overdue = now - self._last_grant.get(waiter.user_id, waiter.enqueued_at) - 1 / min_rate
+            if overdue >= 0:
+                return 0, -overdue
+        return 1, waiter.start_tag - self.aging * (now - waiter.enqueued_at)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._waiting and not self._stop.is_set():
+                    self._cond.wait()
+                if self._stop.is_set():
+                    return
+                now = time.monotonic()
+                waiter = min(self._waiting, key=lambda w: self._priority(w, now))
+
+            # 在锁外等待预算，期间新加入的更高优先级请求下一轮再选
+            if not self.bucket.acquire(waiter.cost, timeout=0.5):
+                continue
+
+            with self._cond:
+                if waiter not in self._waiting:
+                    # 已取消，退还令牌
+                    self.bucket.refund(waiter.cost)
+                    continue
+                self._waiting.remove(waiter)
+                self._virtual_time = max(self._virtual_time, waiter.start_tag)
+                self._last_grant[waiter.user_id] = time.monotonic()
+                waiter.granted.set()
@@ -0,0 +1,446 @@
+# 本地AutoDL模拟服务，用于离线压测和延迟测试
+#
+# 用法:
+#     python fake_server.py --port 8900 --users 1000 --latency 0.05 --error-rate 0.01
+#     python fake_server.py --scenario scenario.json
+#
+# 客户端通过 AutoDLClient(username, password, base_url="http://127.0.0.1:8900/api/v1") 连接。
+import argparse
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from ratelimit import TokenBucket
+
+API_PREFIX = "/api/v1"
+
+
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeInstance:
+    """模拟实例；空闲GPU数可按时间表变化"""
+
+    def __init__(
+        self,
+        uuid: str,
+        machine_alias: str,
+        region_name: str,
+        gpu_name: str,
+        gpu_all_num: int = 8,
+        gpu_idle_num: int = 0,
+        schedule: Optional[List[Tuple[float, int]]] = None,
+        period: Optional[float] = None,
+        stopped_at: Optional[float] = None,
+    ):
+        self.uuid = uuid
+        self.machine_alias = machine_alias
+        self.region_name = region_name
+        self.gpu_name = gpu_name
+        self.gpu_all_num = gpu_all_num
+        self.gpu_idle_num = gpu_idle_num
+        # 时间表: [(距服务启动秒数, 空闲GPU数), ...]，阶梯变化；period不为空时循环
+        self.schedule = sorted(schedule or [])
+        self.period = period
+        self.status = "shutdown"
+        self.stopped_at = stopped_at if stopped_at is not None else time.time()
+        # 本实例占用的GPU数（启动后从空闲数中扣除）
+        self.occupied = 0
+
+    def idle_at(self, elapsed: float) -> int:
+        idle = self.gpu_idle_num
+        if self.schedule:
+            t = elapsed % self.period if self.period else elapsed
+            for offset, value in self.schedule:
+                if offset <= t:
+                    idle = value
+                else:
+                    break
+        return max(0, min(self.gpu_all_num, idle) - self.occupied)
+
+    def to_json(self, elapsed: float) -> Dict[str, Any]:
+        stopped = None
+        if self.status == "shutdown":
+            stopped = {"time": _iso(self.stopped_at), "valid": True}
+        return {
+            "machine_alias": self.machine_alias,
+            "region_name": self.region_name,
+            "gpu_all_num": self.gpu_all_num,
+            "gpu_idle_num": self.idle_at(elapsed),
+            "uuid": self.uuid,
+            "snapshot_gpu_alias_name": self.gpu_name,
+            "stopped_at": stopped,
+            "status": self.status,
+        }
+
+
+class FakeUser:
+    def __init__(self, phone: str, password: str, balance: float = 100.0):
+        self.phone = phone
+        self.password_hash = _sha1(password)
+        self.balance = balance
+        self.instances: Dict[str, FakeInstance] = {}
+
+
+class FakeAutoDL:
+    """模拟服务状态与接口逻辑"""
+
+    def __init__(
+        self,
+        latency: Tuple[float, float] = (0.0, 0.0),
+        error_rate: float = 0.0,
+        token_ttl: float = 3600.0,
+        rate_limit: Optional[float] = None,
+        rate_burst: Optional[float] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst or (rate_limit * 2 if rate_limit else None)
+
+        self.users: Dict[str, FakeUser] = {}
+        # 算力市场中的机器，machine_id -> 接口返回的字段
+        self.market: Dict[str, Dict[str, Any]] = {}
+        self._tickets: Dict[str, str] = {}
+        # token -> (手机号, 过期时间)
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.stats: Dict[str, int] = {}
+
+    # ---- 场景配置 ----
+
+    def add_user(self, phone: str, password: str, balance: float = 100.0) -> FakeUser:
+        user = FakeUser(phone, password, balance)
+        with self._lock:
+            self.users[phone] = user
+        return user
+
+    def add_instance(self, phone: str, instance: FakeInstance) -> None:
+        with self._lock:
+            self.users[phone].instances[instance.uuid] = instance
+
+    def add_market_machine(self, machine_id: str, gpu_name: str, region_name: str = "西北B区",
+                           gpu_number: int = 8, gpu_idle_num: int = 0, payg_price: int = 2000) -> None:
+        with self._lock:
+            self.market[machine_id] = {
+                "machine_id": machine_id,
+                "machine_alias": f"{len(self.market) + 1}号机",
+                "region_name": region_name,
+                "region_sign": "",
+                "gpu_name": gpu_name,
+                "gpu_number": gpu_number,
+                "gpu_idle_num": gpu_idle_num,
+                "payg_price": payg_price,
+            }
+
+    def expire_tokens(self) -> None:
+        """让所有token立即失效，模拟AuthorizeFailed"""
+        with self._lock:
+            self._tokens.clear()
+
+    def load_scenario(self, scenario: Dict[str, Any]) -> None:
+        """从场景字典加载用户与实例"""
+        for u in scenario.get("users", []):
+            self.add_user(u["phone"], u["password"], u.get("balance", 100.0))
+            for i, inst in enumerate(u.get("instances", [])):
+                self.add_instance(u["phone"], FakeInstance(
+                    uuid=inst.get("uuid", f"{u['phone']}-{i}"),
+                    machine_alias=inst.get("machine_alias", f"{i + 1}号机"),
+                    region_name=inst.get("region_name", "西北B区"),
+                    gpu_name=inst.get("gpu", "RTX 4090"),
+                    gpu_all_num=inst.get("gpu_all_num", 8),
+                    gpu_idle_num=inst.get("gpu_idle_num", 0),
+                    schedule=[tuple(x) for x in inst.get("schedule", [])],
+                    period=inst.get("period"),
+                ))
+        for i, machine in enumerate(scenario.get("market", [])):
+            self.add_market_machine(
+                machine.get("machine_id", f"m{i}"),
+                machine.get("gpu", "RTX 4090"),
+                machine.get("region_name", "西北B区"),
+                machine.get("gpu_number", 8),
+                machine.get("gpu_idle_num", 0),
+                machine.get("payg_price", 2000),
+            )
+
+    def populate(self, users: int, instances_per_user: int = 3, gpu_types: Optional[List[str]] = None,
+                 idle_probability: float = 0.3, period: float = 60.0) -> None:
+        """批量生成用户；约idle_probability比例的实例每个周期会短暂出现空闲GPU"""
+        gpu_types = gpu_types or ["RTX 4090", "RTX 3090", "A100-SXM4-80GB", "V100-32GB"]
+        for n in range(users):
+            phone = f"1380{n:07d}"
+            self.add_user(phone, "password")
+            for i in range(instances_per_user):
+                schedule = []
+                if self._random.random() < idle_probability:
+                    start = self._random.uniform(0, period)
+                    schedule = [(0, 0), (start, self._random.randint(1, 4)), (min(period, start + 5), 0)]
+                self.add_instance(phone, FakeInstance(
+                    uuid=f"{phone}-{i}",
+                    machine_alias=f"{i + 1}号机",
+                    region_name=self._random.choice(["西北B区", "北京A区", "内蒙A区"]),
+                    gpu_name=self._random.choice(gpu_types),
+                    schedule=schedule,
+                    period=period,
+                    stopped_at=time.time() - self._random.uniform(0, 20 * 3600),
+                ))
+
+    def populate_market(self, machines: int, gpu_types: Optional[List[str]] = None,
+                        idle_probability: float = 0.2) -> None:
+        """生成算力市场机器；约idle_probability比例的机器有空闲GPU"""
+        gpu_types = gpu_types or ["RTX 4090", "RTX 3090", "A100-SXM4-80GB", "V100-32GB"]
+        for n in range(machines):
+            idle = self._random.randint(1, 8) if self._random.random() < idle_probability else 0
+            self.add_market_machine(
+                f"m{n:06d}",
+                self._random.choice(gpu_types),
+                self._random.choice(["西北B区", "北京A区", "内蒙A区"]),
+                gpu_idle_num=idle,
+                payg_price=self._random.choice([880, 1320, 1580, 1980, 2580]),
+            )
+
+    # ---- 请求处理 ----
+
+    def _count(self, key: str) -> None:
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def throttled(self, client_key: str) -> bool:
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            bucket = self._buckets.get(client_key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_limit, self.rate_burst)
+                self._buckets[client_key] = bucket
+        return not bucket.try_acquire()
+
+    def inject_delay(self) -> None:
+        low, high = self.latency
+        if high > 0:
+            time.sleep(self._random.uniform(low, high))
+
+    def inject_error(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _auth(self, token: str) -> Optional[FakeUser]:
+        entry = self._tokens.get(token)
+        if entry is None or entry[1] < time.time():
+            return None
+        return self.users.get(entry[0])
+
+    def handle(self, method: str, path: str, token: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._count(path)
+            elapsed = time.time() - self.started_at
+
+            if path == "/new_login":
+                user = self.users.get(body.get("phone", ""))
+                if user is None or user.password_hash != body.get("password"):
+                    return {"code": "LoginFailed", "msg": "账号或密码错误"}
+                ticket = secrets.token_hex(8)
+                self._tickets[ticket] = user.phone
+                return {"code": "Success", "data": {"ticket": ticket}}
+
+            if path == "/passport":
+                phone = self._tickets.pop(body.get("ticket", ""), None)
+                if phone is None:
+                    return {"code": "TicketInvalid", "msg": "ticket无效"}
+                new_token = secrets.token_hex(16)
+                self._tokens[new_token] = (phone, time.time() + self.token_ttl)
+                return {"code": "Success", "data": {"token": new_token}}
+
+            user = self._auth(token)
+            if user is None:
+                return {"code": "AuthorizeFailed", "msg": "登录已失效"}
+
+            if path == "/instance":
+                page_index = max(1, int(body.get("page_index", 1)))
+                page_size = max(1, int(body.get("page_size", 10)))
+                items = list(user.instances.values())
+                page = items[(page_index - 1) * page_size: page_index * page_size]
+                return {"code": "Success", "data": {
+                    "list": [inst.to_json(elapsed) for inst in page],
+                    "page_index": page_index,
+                    "page_size": page_size,
+                    "result_total": len(items),
+                    "max_page": (len(items) + page_size - 1) // page_size,
+                }}
+
+            if path in ("/instance/power_on", "/instance/power_off"):
+                instance = user.instances.get(body.get("instance_uuid", ""))
+                if instance is None:
+                    return {"code": "InstanceNotFound", "msg": "实例不存在"}
+
+                if path == "/instance/power_off":
+                    if instance.status != "running":
+                        return {"code": "InstanceStatusError", "msg": "实例未运行"}
+                    instance.status = "shutdown"
+                    instance.occupied = 0
+                    instance.stopped_at = time.time()
+                    return {"code": "Success", "data": None}
+
+                if instance.status == "running":
+                    return {"code": "InstanceStatusError", "msg": "实例已在运行"}
+                if body.get("restart_type") != "cpu":
+                    if instance.idle_at(elapsed) <= 0:
+                        return {"code": "NoAvailableGpu", "msg": "GPU不足"}
+                    instance.occupied = 1
+                instance.status = "running"
+                return {"code": "Success", "data": None}
+
+            if path == "/wallet":
+                return {"code": "Success", "data": {"assets": int(user.balance * 100)}}
+
+            if path == "/user/machine/list":
+                page_index = max(1, int(body.get("page_index", 1)))
+                page_size = max(1, int(body.get("page_size", 10)))
+                gpu_types = body.get("gpu_type_name") or []
+                min_idle = int(body.get("gpu_idle_num") or 0)
+                items = [
+                    m for m in self.market.values()
+                    if (not gpu_types or m["gpu_name"] in gpu_types) and m["gpu_idle_num"] >= min_idle
+                ]
+                page = items[(page_index - 1) * page_size: page_index * page_size]
+                return {"code": "Success", "data": {
+                    "list": [dict(m) for m in page],
+                    "page_index": page_index,
+                    "page_size": page_size,
+                    "result_total": len(items),
+                    "max_page": max(1, (len(items) + page_size - 1) // page_size),
+                }}
+
+            return {"code": "NotFound", "msg": f"未知接口 {method} {path}"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    app: FakeAutoDL
+
+    def _dispatch(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        path = self.path.split("?")[0]
+        if not path.startswith(API_PREFIX):
+            self._reply(404, {"code": "NotFound", "msg": "not found"})
+            return
+        path = path[len(API_PREFIX):]
+
+        token = self.headers.get("authorization", "")
+        if self.app.throttled(token or self.client_address[0]):
+            self._reply(429, {"code": "TooManyRequests", "msg": "请求过于频繁"})
+            return
+
+        self.app.inject_delay()
+        if self.app.inject_error():
+            self._reply(500, {"code": "InternalError", "msg": "服务异常"})
+            return
+
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            self._reply(400, {"code": "BadRequest", "msg": "请求体不是JSON"})
+            return
+        self._reply(200, self.app.handle(method, path, token, body or {}))
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAutoDLServer:
+    """在后台线程运行模拟服务"""
+
+    def __init__(self, app: Optional[FakeAutoDL] = None, host: str = "127.0.0.1", port: int = 0):
+        self.app = app or FakeAutoDL()
+        handler = type("FakeAutoDLHandler", (_Handler,), {"app": self.app})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self) -> "FakeAutoDLServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-autodl", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeAutoDLServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地AutoDL模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--scenario", help="场景JSON文件")
+    parser.add_argument("--users", type=int, default=10, help="未指定场景时自动生成的用户数（密码均为password）")
+    parser.add_argument("--instances", type=int, default=3, help="每个用户的实例数")
+    parser.add_argument("--market", type=int, default=200, help="未指定场景时生成的算力市场机器数")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0], help="注入延迟秒数，可给出最小值和最大值")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-ttl", type=float, default=3600.0)
+    parser.add_argument("--rate-limit", type=float, help="每个token每秒允许的请求数，超出返回429")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    latency = (args.latency[0], args.latency[-1])
+    app = FakeAutoDL(latency=latency, error_rate=args.error_rate, token_ttl=args.token_ttl,
+                     rate_limit=args.rate_limit, seed=args.seed)
+    if args.scenario:
+        with open(args.scenario, encoding="utf-8") as f:
+            app.load_scenario(json.load(f))
+    else:
+        app.populate(args.users, args.instances)
+        app.populate_market(args.market)
+
+    server = FakeAutoDLServer(app, args.host, args.port)
+    print(f"模拟服务已启动: {server.base_url} ({len(app.users)} 个用户)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Deque, Dict, List, Optional, Tuple
+
+from autodl_client import AutoDLClient, ClientPool
+from balance_cache import BalanceCache
+from fair_scheduler import PollScheduler
+from grab_analytics import GrabAnalytics
+from job_journal import RUNNING_STATUSES, JobJournal
+from log_pipeline import log_context
+from metrics import (
+    GRAB_JOBS_RUNNING, GRAB_POLLS_TOTAL, GRAB_POWER_ON_TOTAL, GRAB_DETECT_TO_POWER_ON, GRAB_TICK_LATENCY,
+    GRAB_POLL_TIER_TOTAL,
+)
+from models import AutoDLConfig, GrabConfig, Instance
+from notifier import Notifier
+from profiling import PROFILER
+
+# 最小检查间隔（秒）
+MIN_CHECK_INTERVAL = 3
+# 保留最近多少次轮询的耗时和结果，供看门狗计算SLO
+TICK_HISTORY = 50
+# 崩溃前已发出、尚未看到结果的开机请求在多少秒内视为仍在处理中，不重复开机
+PENDING_GRACE = 60.0
+
+# 轮询档位 -> 相对检查间隔的倍数；cold即设置的检查间隔，任何档位都不慢于它
+POLL_TIERS: Dict[str, float] = {
+    "cold": 1.0,
+    "warm": 0.5,
+    "hot": 0.25,
+}
+# 从慢到快的档位顺序
+TIER_ORDER = ("cold", "warm", "hot")
+# warm/hot档位的最小间隔（秒）；只在容量变化后短时间使用，总请求量仍受共享请求预算限制
+FAST_MIN_INTERVAL = 1.0
+
+
+def find_grab_candidates(instances: List[Instance], grab_config: GrabConfig) -> List[Instance]:
+    """按抢卡配置筛选出有空闲GPU、可以尝试启动的实例（按列表顺序）"""
+    # 按UUID抢卡
+    if grab_config.instance_uuid:
+        target_uuid = grab_config.instance_uuid
+        return [
+            instance for instance in instances
+            if instance.uuid == target_uuid and instance.gpu_idle_num > 0
+        ]
+
+    # 按GPU型号抢卡
+    if grab_config.gpu_types:
+        target_types = grab_config.gpu_types
+        return [
+            instance for instance in instances
+            if instance.gpu_idle_num > 0 and (
+                instance.snapshot_gpu_alias_name in target_types or
+                any(t in instance.snapshot_gpu_alias_name for t in target_types)
+            )
+        ]
+
+    return []
+
+
+def _matches_target(instance: Instance, grab_config: GrabConfig) -> bool:
+    """实例是否是抢卡目标（不看当前是否有空闲GPU）"""
+    if grab_config.instance_uuid:
+        return instance.uuid == grab_config.instance_uuid
+    return any(t in instance.snapshot_gpu_alias_name for t in grab_config.gpu_types)
+
+
+# 容量有变化（空闲数变动、同一机器上的实例停止）时往往紧跟着一波释放，
+# 此时直接升到hot；之后每连续 quiet_polls 次没有变化的轮询回落一档，直到cold（设置的间隔）
+class PollTempo:
+    """根据目标机器上的容量变化在 cold/warm/hot 三档之间调整轮询间隔"""
+
+    def __init__(self, grab_config: GrabConfig, quiet_polls: int = 20):
+        # quiet_polls: 连续多少次无变化的轮询后回落一档（多账号时每个账号的一次拉取算一次）
+        self.grab_config = grab_config
+        self.quiet_polls = quiet_polls
+        self.last_churn_at: Optional[float] = None
+        self._level = 0
+        self._quiet = 0
+        # (账号, 实例UUID) -> (空闲GPU数, 状态)
+        self._snapshot: Dict[Tuple[str, str], Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def tier(self) -> str:
+        if not self.grab_config.adaptive_interval:
+            return "cold"
+        return TIER_ORDER[self._level]
+
+    def interval(self, base: float) -> float:
+        tier = self.tier()
+        if tier == "cold":
+            return base
+        return min(base, max(base * POLL_TIERS[tier], FAST_MIN_INTERVAL))
+
+    def heat(self) -> None:
+        """立即进入hot（例如开机时GPU刚被别人抢走）"""
+        with self._lock:
+            self._heat_locked()
+
+    def _heat_locked(self) -> None:
+        self.last_churn_at = time.monotonic()
+        self._level = len(TIER_ORDER) - 1
+        self._quiet = 0
+
+    def _cool_locked(self) -> None:
+        """记录一次无变化的轮询，连续 quiet_polls 次后回落一档"""
+        if self._level == 0:
+            return
+        self._quiet += 1
+        if self._quiet >= self.quiet_polls:
+            self._level -= 1
+            self._quiet = 0
+
+    def observe(self, instances: List[Instance], account: str = "") -> bool:
+        """对比上一次轮询，目标机器上有容量变化时进入hot并返回True"""
+        if not instances:
+            return False
+
+        # 目标实例所在的机器；同一机器上的其他实例停止也意味着可能空出GPU
+        machines = {
+            (instance.region_name, instance.machine_alias)
+            for instance in instances
+            if _matches_target(instance, self.grab_config)
+        }
+        churn = False
+        with self._lock:
+            for instance in instances:
+                key = (account, instance.uuid)
+                current = (instance.gpu_idle_num, instance.status)
+                previous = self._snapshot.get(key)
+                self._snapshot[key] = current
+                if previous is None or previous == current:
+                    continue
+                if (instance.region_name, instance.machine_alias) in machines:
+                    churn = True
+            if churn:
+                self._heat_locked()
+            else:
+                self._cool_locked()
+        return churn
+
+
+class GrabJob:
+    """单个用户的抢卡任务：轮询实例，发现空闲GPU时启动"""
+
+    def __init__(
+        self,
+        user_id: int,
+        grab_config: GrabConfig,
+        client: AutoDLClient,
+        notifier: Notifier,
+        stop_signal: Optional[threading.Event] = None,
+        balance_cache: Optional[BalanceCache] = None,
+        scheduler: Optional[PollScheduler] = None,
+        journal: Optional[JobJournal] = None,
+        analytics: Optional[GrabAnalytics] = None,
+    ):
+        self.user_id = user_id
+        self.grab_config = grab_config
+        self.client = client
+        self.notifier = notifier
+        self.stop_signal = stop_signal or threading.Event()
+        self.balance_cache = balance_cache
+        self.scheduler = scheduler
+        self.journal = journal
+        self.analytics = analytics
+
+        # 运行状况（time.monotonic()），由看门狗读取
+        self.started_at = time.monotonic()
+        self.last_tick_at: Optional[float] = None
+        self.finished = False
+        self.last_poll_ok = False
+        # 正在排队等待共享请求预算，此时不算卡住
+        self.waiting_budget = False
+        self._ticks: Deque[Tuple[float, bool]] = deque(maxlen=TICK_HISTORY)
+        self.tempo = PollTempo(grab_config)
+
+    @property
+    def interval(self) -> float:
+        """当前档位下的检查间隔（秒）"""
+        return self.tempo.interval(max(self.grab_config.check_interval, MIN_CHECK_INTERVAL))
+
+    def stop(self) -> None:
+        self.stop_signal.set()
+
+    def recent_ticks(self) -> List[Tuple[float, bool]]:
+        """最近的 (耗时秒, 是否成功拉取到实例)"""
+        return list(self._ticks)
+
+    def _acquire_budget(self) -> bool:
+        """向共享调度器申请本轮请求预算，每个账号算一次请求"""
+        if self.scheduler is None:
+            return True
+        self.waiting_budget = True
+        try:
+            return self.scheduler.acquire(
+                self.user_id,
+                self.stop_signal,
+                tier=self.grab_config.priority,
+                cost=len(self.account_clients()),
+            )
+        finally:
+            self.waiting_budget = False
+
+    def _record_tick(self, started: float, ok: bool) -> None:
+        now = time.monotonic()
+        self.last_tick_at = now
+        self._ticks.append((now - started, ok))
+        GRAB_TICK_LATENCY.observe(now - started)
+        if self.journal is not None:
+            self.journal.record_poll(self.user_id)
+
+    def _record_outcome(self, instance: Instance, outcome: str, account: str = "",
+                        power_on_latency: Optional[float] = None) -> None:
+        if self.analytics is None:
+            return
+        self.analytics.record(
+            self.user_id,
+            instance.snapshot_gpu_alias_name,
+            outcome,
+            region=instance.region_name,
+            account=account,
+            check_interval=self.interval,
+            tier=self.tempo.tier(),
+            ttg=time.monotonic() - self.started_at,
+            power_on_latency=power_on_latency,
+        )
+
+    def _resolve_pending(self, instances: List[Instance], account: str = "") -> bool:
+        """崩溃前已发出开机请求的实例如果已经启动，直接视为抢卡成功，不再重复开机"""
+        # 已被停止（如看门狗重启后由新任务接管）的任务不再处理
+        if self.journal is None or self.stop_signal.is_set():
+            return False
+        pending = set(self.journal.pending_uuids(self.user_id))
+        if not pending:
+            return False
+
+        for instance in instances:
+            if instance.uuid in pending and instance.status in RUNNING_STATUSES:
+                self.journal.record_result(self.user_id, instance.uuid, True)
+                GRAB_POWER_ON_TOTAL.inc("recovered")
+                self._record_outcome(instance, "recovered", account)
+                where = f"账号 {account} 的" if account else ""
+                self.notifier.notify(
+                    self.user_id,
+                    f"抢卡成功: {where}实例 {instance.uuid} ({instance.snapshot_gpu_alias_name}) 已启动",
+                )
+                return True
+        return False
+
+    def _in_flight(self, instance: Instance) -> bool:
+        """崩溃前刚发出开机请求、实例可能尚未进入启动状态，宽限期内不重复开机"""
+        if self.journal is None:
+            return False
+        sent_at = self.journal.pending_attempt(self.user_id, instance.uuid)
+        return sent_at is not None and time.time() - sent_at < PENDING_GRACE
+
+    def tick(self) -> bool:
+        """执行一次轮询，抢卡成功返回True"""
+        instances = self.client.get_instances()
+        self.last_poll_ok = bool(instances)
+        GRAB_POLLS_TOTAL.inc("ok" if instances else "empty")
+        if not instances:
+            return False
+        self.tempo.observe(instances)
+
+        if self._resolve_pending(instances):
+            return True
+
+        for instance in find_grab_candidates(instances, self.grab_config):
+            if self._in_flight(instance):
+                continue
+            if self._try_power_on(self.client, instance):
+                return True
+        return False
+
+    def account_clients(self) -> Dict[str, AutoDLClient]:
+        return {"": self.client}
+
+    def _balance_ok(self, client: AutoDLClient, account: str = "") -> bool:
+        """余额是否足够开机；只读缓存，不在发现空闲GPU后额外请求"""
+        if self.balance_cache is None or self.grab_config.min_balance <= 0:
+            return True
+
+        balance = self.balance_cache.get(client, wait=False)
+        # 余额未知时不阻止开机
+        if balance is None or balance >= self.grab_config.min_balance:
+            return True
+
+        name = f"账号 {account} " if account else ""
+        self.notifier.notify(
+            self.user_id,
+            f"{name}余额 {balance:.2f} 元低于设置的 {self.grab_config.min_balance:.2f} 元，已跳过开机",
+            dedup_key=f"grab_low_balance:{client.username}",
+        )
+        return False
+
+    def _try_power_on(self, client: AutoDLClient, instance: Instance, account: str = "") -> bool:
+        """有匹配的GPU且有空闲，启动实例并通知结果"""
+        if not self._balance_ok(client, account):
+            GRAB_POWER_ON_TOTAL.inc("low_balance")
+            self._record_outcome(instance, "low_balance", account)
+            return False
+
+        # 卡住的请求返回时任务可能已被看门狗停止并由新任务接管，不能再开机
+        if self.stop_signal.is_set():
+            return False
+
+        detected_at = time.perf_counter()
+        if self.journal is not None:
+            self.journal.record_attempt(self.user_id, instance.uuid, account)
+        success = client.power_on(instance.uuid)
+        if self.journal is not None:
+            self.journal.record_result(self.user_id, instance.uuid, success)
+        GRAB_POWER_ON_TOTAL.inc("success" if success else "failure")
+        self._record_outcome(instance, "success" if success else "failure", account, time.perf_counter() - detected_at)
+
+        where = f"账号 {account} 的" if account else ""
+        if success:
+            if self.balance_cache is not None:
+                # 开机后开始计费
+                self.balance_cache.invalidate(client.username)
+            GRAB_DETECT_TO_POWER_ON.observe(time.perf_counter() - detected_at)
+            self.notifier.notify(
+                self.user_id,
+                f"抢卡成功: {where}实例 {instance.uuid} ({instance.snapshot_gpu_alias_name}) 已启动",
+            )
+            return True
+
+        # 空闲GPU被别人抢先占用，说明正有一波释放
+        self.tempo.heat()
+        self.notifier.notify(
+            self.user_id,
+            f"抢卡失败: {where}实例 {instance.uuid} 启动失败",
+            dedup_key=f"grab_fail:{instance.uuid}",
+        )
+        return False
+
+    def run(self) -> bool:
+        """循环轮询直到抢卡成功或收到停止信号，抢卡成功返回True"""
+        GRAB_JOBS_RUNNING.inc()
+        if self.balance_cache is not None and self.grab_config.min_balance > 0:
+            # 提前在后台拉取余额，发现空闲GPU时直接使用缓存
+            for client in self.account_clients().values():
+                self.balance_cache.get(client, wait=False)
+        if self.scheduler is not None:
+            self.scheduler.set_min_rate(self.user_id, self.grab_config.min_polls_per_minute)
+        if self.journal is not None:
+            self.journal.record_start(self.user_id, self.grab_config.model_dump())
+        try:
+            while not self.stop_signal.is_set():
+                if not self._acquire_budget():
+                    break
+                started = time.monotonic()
+                try:
+                    with log_context(user_id=self.user_id), PROFILER.context(self.user_id, "grab"):
+                        grabbed = self.tick()
+                    self._record_tick(started, self.last_poll_ok)
+                    if grabbed:
+                        if self.journal is not None:
+                            self.journal.record_stop(self.user_id, "grabbed")
+                        return True
+                except Exception as e:
+                    self._record_tick(started, False)
+                    GRAB_POLLS_TOTAL.inc("error")
+                    logging.error(f"抢卡过程出错: {str(e)}", extra={"user_id": self.user_id})
+
+                # 等待下一次检查，间隔随档位变化
+                GRAB_POLL_TIER_TOTAL.inc(self.tempo.tier())
+                self.stop_signal.wait(self.interval)
+            return False
+        finally:
+            self.finished = True
+            GRAB_JOBS_RUNNING.dec()
+
+
+class MultiAccountGrabJob(GrabJob):
+    """同一用户的多个账号并行轮询，任一账号发现空闲GPU即启动，其余轮询随即取消"""
+
+    def __init__(
+        self,
+        user_id: int,
+        grab_config: GrabConfig,
+        clients: Dict[str, AutoDLClient],
+        notifier: Notifier,
+        stop_signal: Optional[threading.Event] = None,
+        balance_cache: Optional[BalanceCache] = None,
+        scheduler: Optional[PollScheduler] = None,
+        journal: Optional[JobJournal] = None,
+        analytics: Optional[GrabAnalytics] = None,
+    ):
+        super().__init__(
+            user_id, grab_config, next(iter(clients.values())), notifier, stop_signal,
+            balance_cache, scheduler, journal, analytics,
+        )
+        self.clients = clients
+        self._executor = ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix=f"grab-{user_id}")
+        # 同一轮中只允许一个账号执行开机
+        self._claim_lock = threading.Lock()
+
+    def account_clients(self) -> Dict[str, AutoDLClient]:
+        return self.clients
+
+    def tick(self) -> bool:
+        self.last_poll_ok = False
+        won = threading.Event()
+        # 每个任务复制一份当前上下文，账号线程中的日志带上 user_id 等字段
+        futures = {
+            self._executor.submit(contextvars.copy_context().run, self._poll, name, client, won): name
+            for name, client in self.clients.items()
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        return True
+                except Exception as e:
+                    # 单个账号出错不影响其他账号
+                    GRAB_POLLS_TOTAL.inc("error")
+                    logging.error(f"账号 {futures[future]} 抢卡轮询出错: {str(e)}", extra={"user_id": self.user_id})
+            return False
+        finally:
+            # 已抢到或出错时取消尚未开始的轮询，正在进行的轮询在开机前检查 won 后退出
+            won.set()
+            for future in futures:
+                future.cancel()
+
+    def _poll(self, account: str, client: AutoDLClient, won: threading.Event) -> bool:
+        if won.is_set() or self.stop_signal.is_set():
+            return False
+
+        instances = client.get_instances()
+        GRAB_POLLS_TOTAL.inc("ok" if instances else "empty")
+        if not instances:
+            return False
+        # 任一账号拉取成功即视为本轮正常
+        self.last_poll_ok = True
+        self.tempo.observe(instances, account)
+
+        with self._claim_lock:
+            if won.is_set():
+                return False
+            if self._resolve_pending(instances, account):
+                won.set()
+                return True
+
+        for instance in find_grab_candidates(instances, self.grab_config):
+            if self._in_flight(instance):
+                continue
+            with self._claim_lock:
+                if won.is_set():
+                    return False
+                if self._try_power_on(client, instance, account):
+                    won.set()
+                    return True
+        return False
+
+    def run(self) -> bool:
+        try:
+            return super().run()
+        finally:
+            self._executor.shutdown(wait=False)
+
+
+def create_grab_job(
+    user_id: int,
+    config: AutoDLConfig,
+    notifier: Notifier,
+    pool: ClientPool,
+    stop_signal: Optional[threading.Event] = None,
+    base_url: Optional[str] = None,
+    balance_cache: Optional[BalanceCache] = None,
+    scheduler: Optional[PollScheduler] = None,
+    journal: Optional[JobJournal] = None,
+    analytics: Optional[GrabAnalytics] = None,
+) -> Optional[GrabJob]:
+    """按用户的账号数量创建抢卡任务，未设置任何账号时返回None"""
+    accounts = config.all_accounts()
+    if not accounts or not config.grab_config:
+        return None
+
+    clients = {
+        account.name: pool.get(account.username, account.password, base_url)
+        for account in accounts
+    }
+    if len(clients) == 1:
+        return GrabJob(
+            user_id, config.grab_config, next(iter(clients.values())), notifier, stop_signal,
+            balance_cache, scheduler, journal, analytics,
+        )
+    return MultiAccountGrabJob(
+        user_id, config.grab_config, clients, notifier, stop_signal, balance_cache, scheduler, journal,
+        analytics,
+    )
@@ -0,0 +1,284 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# 抢卡耗时分桶：从 TTG_BASE_MS 起按 TTG_FACTOR 等比增长，误差不超过一个桶宽（约12%）
+TTG_BASE_MS = 50.0
+TTG_FACTOR = 1.25
+TTG_BUCKETS = 80
+
+# 抢卡结果
+OUTCOMES = ("success", "failure", "low_balance", "recovered")
+
+
+def ttg_bucket(ms: float) -> int:
+    """抢卡耗时所在的桶序号"""
+    if ms <= TTG_BASE_MS:
+        return 0
+    return min(TTG_BUCKETS - 1, math.ceil(math.log(ms / TTG_BASE_MS, TTG_FACTOR)))
+
+
+def _bucket_upper(bucket: int) -> float:
+    return TTG_BASE_MS * TTG_FACTOR ** bucket
+
+
+def _percentile(counts: Dict[int, int], q: float) -> Optional[float]:
+    """按分桶计数估算分位数（桶内按等比插值）"""
+    total = sum(counts.values())
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket in sorted(counts):
+        count = counts[bucket]
+        if seen + count >= rank:
+            lower = _bucket_upper(bucket - 1) if bucket > 0 else 0.0
+            upper = _bucket_upper(bucket)
+            fraction = (rank - seen) / count
+            if lower <= 0:
+                return upper * fraction
+            return lower * (upper / lower) ** fraction
+        seen += count
+    return _bucket_upper(max(counts))
+
+
+class GrabReportRow:
+    __slots__ = ("gpu_type", "attempts", "successes", "failures", "p50_ms", "p95_ms")
+
+    def __init__(self, gpu_type: str, attempts: int, successes: int, failures: int,
+                 p50_ms: Optional[float], p95_ms: Optional[float]):
+        self.gpu_type = gpu_type
+        self.attempts = attempts
+        self.successes = successes
+        self.failures = failures
+        self.p50_ms = p50_ms
+        self.p95_ms = p95_ms
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.attempts if self.attempts else 0.0
+
+
+# 原始记录只追加写入，按小时汇总的计数和耗时分桶在同一事务中累加，
+# 报表只读汇总表，耗时与原始记录条数无关
+class GrabAnalytics:
+    """记录每次抢卡开机尝试的结果，并提供按GPU型号的成功率和抢卡耗时统计"""
+
+    def __init__(
+        self,
+        db_path: str = "autodl_analytics.db",
+        flush_interval: float = 2.0,
+        retention_days: float = 30.0,
+        max_pending: int = 100000,
+    ):
+        # retention_days: 原始记录保留天数（汇总数据永久保留）; max_pending: 待写入记录上限，超出时丢弃最旧的
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+
+        self._pending: Deque[tuple] = deque(maxlen=max_pending)
+        # 因队列已满而丢弃的写入失败记录数
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._init_db()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="grab-analytics", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 插件和守护进程可能同时写入
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        conn.executescript('''
+        CREATE TABLE IF NOT EXISTS grab_attempts (
+            id INTEGER PRIMARY KEY,
+            at REAL NOT NULL,
+            user_id INTEGER NOT NULL,
+            account TEXT,
+            gpu_type TEXT NOT NULL,
+            region TEXT,
+            check_interval REAL,
+            tier TEXT,
+            outcome TEXT NOT NULL,
+            ttg_ms REAL,
+            power_on_ms REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_grab_attempts_at ON grab_attempts(at);
+        CREATE INDEX IF NOT EXISTS idx_grab_attempts_gpu_at ON grab_attempts(gpu_type, at);
+
+        CREATE TABLE IF NOT EXISTS grab_rollup (
+            hour INTEGER NOT NULL,
+            gpu_type TEXT NOT NULL,
+            region TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (hour, gpu_type, region, outcome)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS grab_ttg_rollup (
+            hour INTEGER NOT NULL,
+            gpu_type TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (hour, gpu_type, bucket)
+        ) WITHOUT ROWID;
+        ''')
+        conn.commit()
+        conn.close()
+
+    # ---- 记录 ----
+
+    def record(
+        self,
+        user_id: int,
+        gpu_type: str,
+        outcome: str,
+        region: str = "",
+        account: str = "",
+        check_interval: Optional[float] = None,
+        tier: str = "",
+        ttg: Optional[float] = None,
+        power_on_latency: Optional[float] = None,
+    ) -> None:
+        """记录一次开机尝试（只入队，由后台线程批量写入）；ttg 为从开始抢卡到本次结果的秒数"""
+        row = (
+            time.time(), user_id, account, gpu_type, region, check_interval, tier, outcome,
+            ttg * 1000 if ttg is not None else None,
+            power_on_latency * 1000 if power_on_latency is not None else None,
+        )
+        with self._lock:
+            self._pending.append(row)
+
+    def flush(self) -> int:
+        """写入所有待写入的记录，返回条数"""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._pending)
+                self._pending.clear()
+            if not rows:
+                self._prune()
+                return 0
+
+            counts: Dict[Tuple[int, str, str, str], int] = {}
+            ttg_counts: Dict[Tuple[int, str, int], int] = {}
+            for at, _, _, gpu_type, region, _, _, outcome, ttg_ms, _ in rows:
+                hour = int(at // 3600)
+                key = (hour, gpu_type, region or "", outcome)
+                counts[key] = counts.get(key, 0) + 1
+                if outcome == "success" and ttg_ms is not None:
+                    ttg_key = (hour, gpu_type, ttg_bucket(ttg_ms))
+                    ttg_counts[ttg_key] = ttg_counts.get(ttg_key, 0) + 1
+
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO grab_attempts (at, user_id, account, gpu_type, region, check_interval, "
+                        "tier, outcome, ttg_ms, power_on_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    conn.executemany(
+                        "INSERT INTO grab_rollup (hour, gpu_type, region, outcome, count) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (hour, gpu_type, region, outcome) DO UPDATE SET count = count + excluded.count",
+                        [(*key, count) for key, count in counts.items()],
+                    )
+                    conn.executemany(
+                        "INSERT INTO grab_ttg_rollup (hour, gpu_type, bucket, count) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (hour, gpu_type, bucket) DO UPDATE SET count = count + excluded.count",
+                        [(*key, count) for key, count in ttg_counts.items()],
+                    )
+                conn.close()
+            except sqlite3.Error as e:
+                # 写入失败时放回队列等待下一次写入；只用队列剩余空间，不挤掉期间新产生的记录，
+                # 放不下时丢弃失败记录中最旧的
+                with self._lock:
+                    free = self._pending.maxlen - len(self._pending)
+                    retry = rows[-free:] if free > 0 else []
+                    self._pending.extendleft(reversed(retry))
+                    self.dropped += len(rows) - len(retry)
+                logging.error(
+                    f"写入抢卡统计失败，{len(retry)}条待重试，{len(rows) - len(retry)}条已丢弃: {str(e)}"
+                )
+                return 0
+
+            self._prune()
+            return len(rows)
+
+    def _prune(self) -> None:
+        """每小时删除一次超过保留期的原始记录（调用方持有 _flush_lock）"""
+        now = time.time()
+        if self.retention_days <= 0 or now - self._pruned_at < 3600:
+            return
+        self._pruned_at = now
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM grab_attempts WHERE at < ?", (now - self.retention_days * 86400,))
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"清理抢卡统计失败: {str(e)}")
+
+    # ---- 报表 ----
+
+    def report(self, days: float = 7.0, gpu_type: str = "") -> List[GrabReportRow]:
+        """最近 days 天各GPU型号的开机尝试次数、成功率和抢卡耗时分位数，按尝试次数降序"""
+        since_hour = int((time.time() - days * 86400) // 3600)
+        type_filter = " AND gpu_type LIKE ?" if gpu_type else ""
+        params: tuple = (since_hour, f"%{gpu_type}%") if gpu_type else (since_hour,)
+
+        conn = self._connect()
+        try:
+            outcome_rows = conn.execute(
+                "SELECT gpu_type, outcome, SUM(count) FROM grab_rollup "
+                f"WHERE hour >= ?{type_filter} GROUP BY gpu_type, outcome",
+                params,
+            ).fetchall()
+            ttg_rows = conn.execute(
+                "SELECT gpu_type, bucket, SUM(count) FROM grab_ttg_rollup "
+                f"WHERE hour >= ?{type_filter} GROUP BY gpu_type, bucket",
+                params,
+            ).fetchall()
+        finally:
+            conn.close()
+
+        outcomes: Dict[str, Dict[str, int]] = {}
+        for name, outcome, count in outcome_rows:
+            outcomes.setdefault(name, {})[outcome] = count
+        buckets: Dict[str, Dict[int, int]] = {}
+        for name, bucket, count in ttg_rows:
+            buckets.setdefault(name, {})[bucket] = count
+
+        rows = []
+        for name, by_outcome in outcomes.items():
+            # 余额不足跳过的不算开机尝试；崩溃后恢复的按成功计
+            successes = by_outcome.get("success", 0) + by_outcome.get("recovered", 0)
+            failures = by_outcome.get("failure", 0)
+            hist = buckets.get(name, {})
+            rows.append(GrabReportRow(
+                name, successes + failures, successes, failures,
+                _percentile(hist, 0.5), _percentile(hist, 0.95),
+            ))
+        rows.sort(key=lambda r: -r.attempts)
+        return rows
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """停止后台线程并写入剩余记录"""
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
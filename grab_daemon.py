@@ -0,0 +1,314 @@
+# 独立抢卡守护进程，不依赖聊天宿主
+#
+# 用法:
+#     python -m grab_daemon --db autodl_users.db
+#     python -m grab_daemon --db autodl_users.db --notifier webhook --webhook-url http://frontend/notify --shard 0/4
+#
+# 从 UserStorage 读取运行中的抢卡任务并执行，定期同步数据库中的启停变化。
+# 聊天前端设置 AUTODL_EXTERNAL_GRAB=1 后只写入配置，由守护进程负责执行。
+# 重依赖（requests、pydantic）在参数解析之后才导入，保证启动和 --help 足够快。
+import argparse
+import logging
+import signal
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class GrabDaemon:
+    """按数据库中的抢卡配置运行和同步抢卡任务"""
+
+    def __init__(
+        self,
+        storage,
+        notifier,
+        base_url: Optional[str] = None,
+        sync_interval: float = 10.0,
+        shard: Tuple[int, int] = (0, 1),
+        watchdog=None,
+        scheduler=None,
+        journal=None,
+        transport: Optional[dict] = None,
+        analytics=None,
+    ):
+        self.storage = storage
+        self.notifier = notifier
+        self.base_url = base_url
+        self.sync_interval = sync_interval
+        self.shard = shard
+        # 可选的 GrabWatchdog，重启卡住的任务
+        self.watchdog = watchdog
+        # 可选的 PollScheduler，所有任务共用请求预算
+        self.scheduler = scheduler
+        # 可选的 JobJournal，记录开机尝试并加快重启后的恢复
+        self.journal = journal
+        # create_transport 的参数，所有账号共用一个连接池
+        self.transport = transport or {}
+        # 可选的 GrabAnalytics，记录每次开机尝试的结果
+        self.analytics = analytics
+
+        # user_id -> (任务, 线程, 启动时的抢卡配置和账号)
+        self.jobs: Dict[int, Tuple[object, threading.Thread, dict]] = {}
+        # 同一账号的多个任务共用客户端和余额缓存
+        self.client_pool = None
+        self.balance_cache = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _owns(self, user_id: int) -> bool:
+        index, total = self.shard
+        return user_id % total == index
+
+    def sync(self) -> None:
+        """按数据库启动新任务、停止已取消或配置已变化的任务"""
+        # 在锁内读取，避免读到任务结束前的运行状态后把刚抢到卡的任务重新启动
+        with self._lock:
+            running = {
+                user_id: config
+                for user_id, config in self.storage.load_running_users().items()
+                if self._owns(user_id)
+            }
+
+            for user_id, (job, thread, grab_config) in list(self.jobs.items()):
+                config = running.get(user_id)
+                if config is None or _job_signature(config) != grab_config:
+                    logging.info("停止抢卡任务", extra={"user_id": user_id})
+                    job.stop()
+                    del self.jobs[user_id]
+                    if self.journal is not None and config is None:
+                        self.journal.record_stop(user_id, "stopped")
+
+            for user_id, config in running.items():
+                if user_id not in self.jobs and config.grab_config.enabled:
+                    self._start_job(user_id, config)
+
+    def _start_job(self, user_id: int, config) -> None:
+        from autodl_client import ClientPool
+        from balance_cache import BalanceCache
+        from grab import create_grab_job
+        from transport import create_transport
+
+        if self.client_pool is None:
+            self.client_pool = ClientPool(session=create_transport(**self.transport))
+            self.balance_cache = BalanceCache()
+
+        job = create_grab_job(
+            user_id, config, self.notifier, self.client_pool,
+            base_url=self.base_url, balance_cache=self.balance_cache, scheduler=self.scheduler,
+            journal=self.journal, analytics=self.analytics,
+        )
+        if job is None:
+            logging.error("抢卡失败: 未设置用户名或密码", extra={"user_id": user_id})
+            return
+
+        thread = threading.Thread(
+            target=self._run_job, args=(user_id, job), name=f"grab-{user_id}", daemon=True
+        )
+        self.jobs[user_id] = (job, thread, _job_signature(config))
+        thread.start()
+        if self.watchdog is not None:
+            self.watchdog.watch(user_id, job, thread, lambda: self._restart_job(user_id, job))
+        logging.info("启动抢卡任务", extra={"user_id": user_id})
+
+    def _restart_job(self, user_id: int, job) -> None:
+        """停止卡住的任务并用新客户端重新启动"""
+        with self._lock:
+            current = self.jobs.get(user_id)
+            if current is None or current[0] is not job:
+                return
+            job.stop()
+            del self.jobs[user_id]
+            for client in job.account_clients().values():
+                self.client_pool.discard(client)
+
+            config = self.storage.load_user(user_id)
+            if config and config.grab_config and config.grab_config.enabled and config.grab_config.is_running:
+                self._start_job(user_id, config)
+
+    def _run_job(self, user_id: int, job) -> None:
+        try:
+            grabbed = job.run()
+        except Exception as e:
+            logging.error(f"抢卡任务异常: {str(e)}", extra={"user_id": user_id})
+            grabbed = False
+
+        if self.watchdog is not None:
+            self.watchdog.unwatch(user_id, job)
+
+        with self._lock:
+            current = self.jobs.get(user_id)
+            if grabbed:
+                # 先标记为已停止再移除任务，避免同步在两步之间重新启动已抢到卡的任务
+                config = self.storage.load_user(user_id)
+                if config and config.grab_config:
+                    config.grab_config.is_running = False
+                    self.storage.save_user(user_id, config)
+            if current is not None and (current[0] is job or grabbed):
+                if current[0] is not job:
+                    # 被看门狗替换的旧任务抢到了卡，替换任务也一并停止
+                    current[0].stop()
+                    if self.watchdog is not None:
+                        self.watchdog.unwatch(user_id, current[0])
+                del self.jobs[user_id]
+
+    def resume(self) -> int:
+        """按抢卡日志立即恢复崩溃前运行的任务，不等待首次全表同步"""
+        if self.journal is None:
+            return 0
+        resumed = 0
+        with self._lock:
+            for user_id in self.journal.active_jobs():
+                if not self._owns(user_id) or user_id in self.jobs:
+                    continue
+                config = self.storage.load_user(user_id)
+                if config and config.grab_config and config.grab_config.enabled and config.grab_config.is_running:
+                    self._start_job(user_id, config)
+                    resumed += 1
+                else:
+                    self.journal.record_stop(user_id, "stopped")
+        return resumed
+
+    def run_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logging.error(f"同步抢卡任务出错: {str(e)}")
+            self._stop.wait(self.sync_interval)
+
+    def stop(self) -> None:
+        """通知 run_forever 退出"""
+        self._stop.set()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """停止所有任务；数据库中的运行状态保持不变，重启后继续"""
+        self._stop.set()
+        with self._lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        for job, _, _ in jobs:
+            job.stop()
+        deadline = time.monotonic() + timeout
+        for _, thread, _ in jobs:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        if self.journal is not None:
+            self.journal.close()
+        if self.analytics is not None:
+            self.analytics.close()
+        if self.balance_cache is not None:
+            self.balance_cache.close()
+        self.notifier.close()
+
+
+def _job_signature(config) -> dict:
+    """抢卡配置或账号变化时需要重启任务"""
+    return {
+        "grab_config": config.grab_config.model_dump(),
+        "accounts": [account.model_dump() for account in config.all_accounts()],
+    }
+
+
+def _parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        index, total = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("格式应为 序号/总数，例如 0/4")
+    if total <= 0 or not 0 <= index < total:
+        raise argparse.ArgumentTypeError("序号应满足 0 <= 序号 < 总数")
+    return index, total
+
+
+def build_notifier(kind: str, webhook_url: Optional[str]):
+    from notifier import LogNotifier, WebhookNotifier
+
+    if kind == "webhook":
+        if not webhook_url:
+            raise SystemExit("使用webhook通知时必须提供 --webhook-url")
+        return WebhookNotifier(webhook_url)
+    return LogNotifier()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    started = time.perf_counter()
+
+    parser = argparse.ArgumentParser(prog="python -m grab_daemon", description="AutoDL独立抢卡守护进程")
+    parser.add_argument("--db", default="autodl_users.db", help="用户数据库路径")
+    parser.add_argument("--notifier", choices=["log", "webhook"], default="log")
+    parser.add_argument("--webhook-url")
+    parser.add_argument("--base-url", help="覆盖AutoDL接口地址，例如指向 fake_server.py")
+    parser.add_argument("--sync-interval", type=float, default=10.0, help="同步数据库的间隔（秒）")
+    parser.add_argument("--shard", type=_parse_shard, default=(0, 1), help="只运行 user_id %% 总数 == 序号 的任务")
+    parser.add_argument("--metrics-port", type=int, help="在该端口提供Prometheus /metrics")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="/metrics 监听地址，0.0.0.0 表示所有网卡")
+    parser.add_argument("--poll-budget", type=float, default=20.0, help="所有抢卡轮询共用的每秒请求数")
+    parser.add_argument("--journal", help="抢卡任务日志路径，默认 grab_journal_shard<序号>.jsonl")
+    parser.add_argument("--admin-ids", default="", help="接收看门狗告警的用户ID，逗号分隔")
+    parser.add_argument("--stall-intervals", type=float, default=5, help="超过多少个检查间隔未完成轮询视为卡住")
+    parser.add_argument("--http-pool-size", type=int, default=16, help="共用连接池的最大连接数")
+    parser.add_argument("--http2", action="store_true", help="使用HTTP/2多路复用（需要安装 httpx[http2]）")
+    parser.add_argument("--dns-ttl", type=float, default=300.0, help="DNS缓存秒数，0表示不缓存")
+    parser.add_argument("--analytics-db", default="autodl_analytics.db", help="抢卡结果统计数据库，与聊天前端共用以支持 /grabreport")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    from log_pipeline import setup_logging, stop_logging
+    from storage import UserStorage
+
+    setup_logging(getattr(logging, args.log_level.upper(), logging.INFO))
+
+    metrics_server = None
+    if args.metrics_port:
+        from metrics import start_metrics_server
+        metrics_server = start_metrics_server(args.metrics_port, args.metrics_host)
+
+    from fair_scheduler import PollScheduler
+    from grab_analytics import GrabAnalytics
+    from grab_watchdog import GrabWatchdog
+    from job_journal import JobJournal
+
+    notifier = build_notifier(args.notifier, args.webhook_url)
+    admin_ids = [int(x) for x in args.admin_ids.split(",") if x.strip()]
+    watchdog = GrabWatchdog(notifier, admin_ids, stall_intervals=args.stall_intervals)
+    daemon = GrabDaemon(
+        UserStorage(args.db),
+        notifier,
+        base_url=args.base_url,
+        sync_interval=args.sync_interval,
+        shard=args.shard,
+        watchdog=watchdog,
+        scheduler=PollScheduler(rate=args.poll_budget, burst=args.poll_budget),
+        journal=JobJournal(args.journal or f"grab_journal_shard{args.shard[0]}.jsonl"),
+        transport={"pool_size": args.http_pool_size, "http2": args.http2, "dns_ttl": args.dns_ttl},
+        analytics=GrabAnalytics(args.analytics_db),
+    )
+    watchdog.start()
+
+    def handle_signal(signum, frame):
+        logging.info(f"收到信号 {signum}，正在退出")
+        daemon.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    resumed = daemon.resume()
+    logging.info(
+        f"抢卡守护进程启动完成，耗时 {(time.perf_counter() - started) * 1000:.0f}ms，"
+        f"分片 {args.shard[0]}/{args.shard[1]}，从日志恢复 {resumed} 个任务"
+    )
+    try:
+        daemon.run_forever()
+    finally:
+        daemon.shutdown()
+        if metrics_server:
+            metrics_server.shutdown()
+        stop_logging()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from metrics import GRAB_WATCHDOG_TOTAL
+from notifier import Notifier
+
+
+class _Watched:
+    __slots__ = ("job", "thread", "restart", "restarts")
+
+    def __init__(self, job, thread: threading.Thread, restart: Callable[[], None]):
+        self.job = job
+        self.thread = thread
+        self.restart = restart
+        self.restarts = 0
+
+
+class GrabWatchdog:
+    """监控抢卡任务：轮询超时或线程意外退出时重启任务，轮询延迟或成功率不达标时告警"""
+
+    def __init__(
+        self,
+        notifier: Notifier,
+        admin_ids: Iterable[int] = (),
+        stall_intervals: float = 5,
+        min_stall: float = 60.0,
+        check_interval: float = 15.0,
+        slo_p95: float = 5.0,
+        slo_success_rate: float = 0.8,
+        slo_min_samples: int = 20,
+        alert_cooldown: float = 1800.0,
+    ):
+        # 超过 max(stall_intervals * 检查间隔, min_stall) 秒没有完成轮询视为卡住
+        self.notifier = notifier
+        self.admin_ids = set(admin_ids)
+        self.stall_intervals = stall_intervals
+        self.min_stall = min_stall
+        self.check_interval = check_interval
+        self.slo_p95 = slo_p95
+        self.slo_success_rate = slo_success_rate
+        self.slo_min_samples = slo_min_samples
+        self.alert_cooldown = alert_cooldown
+
+        self._watched: Dict[int, _Watched] = {}
+        # (用户ID, 告警类型) -> 上次告警时间
+        self._alerted: Dict[Tuple[int, str], float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, user_id: int, job, thread: threading.Thread, restart: Callable[[], None]) -> None:
+        """登记任务；restart 负责停止旧任务并以新客户端启动新任务（再次调用 watch）"""
+        with self._lock:
+            previous = self._watched.get(user_id)
+            entry = _Watched(job, thread, restart)
+            if previous is not None:
+                entry.restarts = previous.restarts
+            self._watched[user_id] = entry
+
+    def unwatch(self, user_id: int, job=None) -> None:
+        """取消监控；提供 job 时只在仍是该任务时取消"""
+        with self._lock:
+            entry = self._watched.get(user_id)
+            if entry is not None and (job is None or entry.job is job):
+                del self._watched[user_id]
+
+    def stall_threshold(self, job) -> float:
+        return max(self.stall_intervals * job.interval, self.min_stall)
+
+    def status(self, user_id: int) -> Optional[str]:
+        """供 /grabstatus 展示的运行状况，未监控时返回None"""
+        with self._lock:
+            entry = self._watched.get(user_id)
+        if entry is None:
+            return None
+
+        job = entry.job
+        now = time.monotonic()
+        if job.last_tick_at is None:
+            text = f"已运行 {int(now - job.started_at)} 秒，尚未完成轮询"
+        else:
+            text = f"最近一次轮询: {int(now - job.last_tick_at)} 秒前"
+        if self._stalled(entry, now):
+            text += "（已卡住，等待重启）"
+        text += f"\n轮询档位: {job.tempo.tier()}（间隔 {job.interval:.1f} 秒）"
+        if entry.restarts:
+            text += f"\n自动重启次数: {entry.restarts}"
+        return text
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="grab-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"看门狗检查出错: {str(e)}")
+
+    def _stalled(self, entry: _Watched, now: float) -> bool:
+        job = entry.job
+        if job.waiting_budget:
+            # 排队等待共享请求预算，由调度器保证最终放行
+            return False
+        last = job.last_tick_at if job.last_tick_at is not None else job.started_at
+        return now - last > self.stall_threshold(job)
+
+    def check(self) -> None:
+        """检查一遍所有任务"""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._watched.items())
+
+        for user_id, entry in entries:
+            job = entry.job
+            if job.finished or job.stop_signal.is_set():
+                # 已正常结束的任务等待宿主取消监控
+                if not entry.thread.is_alive():
+                    self.unwatch(user_id, job)
+                continue
+
+            if not entry.thread.is_alive():
+                self._restart(user_id, entry, "dead", "抢卡线程意外退出")
+            elif self._stalled(entry, now):
+                idle = int(now - (job.last_tick_at or job.started_at))
+                self._restart(user_id, entry, "stalled", f"抢卡任务已 {idle} 秒未完成轮询")
+            else:
+                self._check_slo(user_id, job)
+
+    def _restart(self, user_id: int, entry: _Watched, reason: str, description: str) -> None:
+        GRAB_WATCHDOG_TOTAL.inc(reason)
+        logging.warning(f"{description}，正在重启", extra={"user_id": user_id})
+        with self._lock:
+            entry.restarts += 1
+        self.unwatch(user_id, entry.job)
+
+        try:
+            entry.restart()
+        except Exception as e:
+            logging.error(f"重启抢卡任务失败: {str(e)}", extra={"user_id": user_id})
+            self._alert(user_id, "restart_failed", f"{description}，自动重启失败: {str(e)}", admins=True)
+            return
+
+        self._alert(user_id, reason, f"{description}，已自动重启（第{entry.restarts}次）", admins=entry.restarts > 1)
+
+    def _check_slo(self, user_id: int, job) -> None:
+        ticks = job.recent_ticks()
+        if len(ticks) < self.slo_min_samples:
+            return
+
+        latencies = sorted(latency for latency, _ in ticks)
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        success_rate = sum(1 for _, ok in ticks if ok) / len(ticks)
+
+        if p95 > self.slo_p95:
+            GRAB_WATCHDOG_TOTAL.inc("slo_latency")
+            self._alert(
+                user_id, "slo_latency",
+                f"抢卡轮询变慢: 最近{len(ticks)}次 p95 {p95:.1f}秒，超过目标 {self.slo_p95:.1f}秒",
+                admins=True,
+            )
+        if success_rate < self.slo_success_rate:
+            GRAB_WATCHDOG_TOTAL.inc("slo_success")
+            self._alert(
+                user_id, "slo_success",
+                f"抢卡轮询成功率下降: 最近{len(ticks)}次成功 {success_rate:.0%}，低于目标 {self.slo_success_rate:.0%}",
+                admins=True,
+            )
+
+    def _alert(self, user_id: int, kind: str, message: str, admins: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            last = self._alerted.get((user_id, kind))
+            if last is not None and now - last < self.alert_cooldown:
+                return
+            self._alerted[(user_id, kind)] = now
+
+        self.notifier.notify(user_id, message, f"watchdog:{kind}")
+        if admins:
+            for admin_id in self.admin_ids - {user_id}:
+                self.notifier.notify(admin_id, f"[用户 {user_id}] {message}", f"watchdog:{kind}:{user_id}")
@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 实例处于这些状态时说明开机请求已生效
+RUNNING_STATUSES = ("running", "starting")
+
+
+class JobState:
+    """从日志重放得到的单个抢卡任务状态"""
+
+    __slots__ = ("user_id", "grab_config", "started_at", "last_poll_at", "attempts", "pending")
+
+    def __init__(self, user_id: int, grab_config: Dict[str, Any], started_at: float):
+        self.user_id = user_id
+        self.grab_config = grab_config
+        self.started_at = started_at
+        self.last_poll_at = 0.0
+        self.attempts = 0
+        # 已发出开机请求但尚未记录结果的实例 -> 发出时间
+        self.pending: Dict[str, float] = {}
+
+
+# 每行一个JSON事件；写入超过 compact_every 行后用当前状态的快照重写文件。
+# 崩溃时最后一行可能不完整，重放时跳过无法解析的行。
+class JobJournal:
+    """抢卡任务的追加写日志：记录启动、停止、开机尝试和结果，重启后据此恢复任务"""
+
+    def __init__(self, path: str = "grab_journal.jsonl", compact_every: int = 1000, poll_interval: float = 60.0):
+        # poll_interval: 每个任务最多每隔多少秒记录一次轮询时间
+        self.path = path
+        self.compact_every = compact_every
+        self.poll_interval = poll_interval
+
+        self.jobs: Dict[int, JobState] = {}
+        self._lock = threading.Lock()
+        self._lines = 0
+        # 日志文件是否已存在（不存在时调用方应从数据库恢复）
+        self.loaded = os.path.exists(path)
+        if self.loaded:
+            self._replay()
+        self._file = open(path, "a", encoding="utf-8")
+        if self.loaded and not self._ends_with_newline():
+            # 补全崩溃时写了一半的行，避免与新事件连在同一行
+            self._file.write("\n")
+            self._file.flush()
+
+    # ---- 查询 ----
+
+    def active_jobs(self) -> Dict[int, JobState]:
+        with self._lock:
+            return dict(self.jobs)
+
+    def pending_attempt(self, user_id: int, uuid: str) -> Optional[float]:
+        """已发出开机请求但尚未记录结果的实例的发出时间，没有时返回None"""
+        with self._lock:
+            state = self.jobs.get(user_id)
+            return state.pending.get(uuid) if state else None
+
+    def pending_uuids(self, user_id: int) -> List[str]:
+        with self._lock:
+            state = self.jobs.get(user_id)
+            return list(state.pending) if state else []
+
+    # ---- 记录事件 ----
+
+    def record_start(self, user_id: int, grab_config: Dict[str, Any]) -> None:
+        self._append({"event": "start", "user_id": user_id, "grab_config": grab_config})
+
+    def record_stop(self, user_id: int, reason: str = "") -> None:
+        # 任务已自行结束（如抢到卡时已记录 grabbed）后的清理不再重复记录
+        self._append({"event": "stop", "user_id": user_id, "reason": reason}, if_active=True)
+
+    def record_poll(self, user_id: int) -> None:
+        now = time.time()
+        with self._lock:
+            state = self.jobs.get(user_id)
+            if state is None or now - state.last_poll_at < self.poll_interval:
+                return
+        self._append({"event": "poll", "user_id": user_id})
+
+    def record_attempt(self, user_id: int, uuid: str, account: str = "") -> None:
+        # 开机前写入系统缓冲区，进程崩溃后可知道哪些开机请求可能已经发出；
+        # 不在开机前fsync（会增加抢卡延迟），整机断电时可能丢失这一行，成功结果仍会落盘
+        self._append({"event": "attempt", "user_id": user_id, "uuid": uuid, "account": account})
+
+    def record_result(self, user_id: int, uuid: str, success: bool) -> None:
+        self._append({"event": "result", "user_id": user_id, "uuid": uuid, "success": success}, sync=success)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    # ---- 内部实现 ----
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        event = record.get("event")
+        user_id = record.get("user_id")
+        at = record.get("t", 0.0)
+        state = self.jobs.get(user_id)
+
+        if event == "start":
+            if state is None:
+                state = self.jobs[user_id] = JobState(user_id, record.get("grab_config") or {}, at)
+            else:
+                # 同一任务重新启动（如看门狗重启），保留未完成的开机尝试
+                state.grab_config = record.get("grab_config") or state.grab_config
+            state.attempts = max(state.attempts, record.get("attempts", 0))
+            state.last_poll_at = max(state.last_poll_at, record.get("last_poll_at", 0.0))
+        elif state is None:
+            return
+        elif event == "stop":
+            del self.jobs[user_id]
+        elif event == "poll":
+            state.last_poll_at = at
+        elif event == "attempt":
+            state.attempts += 1
+            state.pending[record["uuid"]] = at
+        elif event == "result":
+            state.pending.pop(record["uuid"], None)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _replay(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                self._lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时写了一半的行
+                    continue
+                self._apply(record)
+
+    def _append(self, record: Dict[str, Any], sync: bool = False, if_active: bool = False) -> None:
+        # if_active: 只在任务仍处于活动状态时写入
+        record["t"] = time.time()
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if if_active and record.get("user_id") not in self.jobs:
+                return
+            self._apply(record)
+            try:
+                self._file.write(line)
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+            except (OSError, ValueError) as e:
+                logging.error(f"写入抢卡日志失败: {str(e)}", extra={"user_id": record.get("user_id")})
+                return
+            self._lines += 1
+            if self._lines >= self.compact_every:
+                self._compact()
+
+    def _compact(self) -> None:
+        """用当前状态的快照替换日志（调用方持有锁）"""
+        tmp_path = f"{self.path}.tmp"
+        now = time.time()
+        records = []
+        for state in self.jobs.values():
+            records.append({
+                "event": "start",
+                "user_id": state.user_id,
+                "grab_config": state.grab_config,
+                "attempts": state.attempts - len(state.pending),
+                "last_poll_at": state.last_poll_at,
+                "t": state.started_at,
+            })
+            for uuid, at in state.pending.items():
+                records.append({"event": "attempt", "user_id": state.user_id, "uuid": uuid, "t": at})
+
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"压缩抢卡日志失败: {str(e)}")
+        finally:
+            if self._file.closed:
+                self._file = open(self.path, "a", encoding="utf-8")
+        self._lines = len(records)
+        logging.info(f"抢卡日志已压缩，保留 {len(self.jobs)} 个任务，耗时 {(time.time() - now) * 1000:.0f}ms")
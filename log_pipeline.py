@@ -0,0 +1,188 @@
+import contextvars
+import copy
+import logging
+import logging.handlers
+import queue
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 结构化字段，可通过 extra={...} 或 log_context(...) 附加到日志
+STRUCTURED_FIELDS = ("user_id", "uuid", "endpoint", "latency_ms")
+
+
+# 使用 contextvars 而不是线程局部变量：提交到线程池的任务通过 copy_context().run 继承调用方的字段
+_context: contextvars.ContextVar[Dict[str, object]] = contextvars.ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields) -> Iterator[None]:
+    """为当前上下文内产生的日志附加结构化字段"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """生产端只做最少的工作：合并消息参数、附加上下文字段，队列满时丢弃"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 复制后再修改，同一日志器上的其他输出仍看到原始记录
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # 异常栈在生产端格式化，避免跨线程持有traceback对象
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """相同内容的日志在窗口内只输出一次，被抑制的次数附加到下一条"""
+
+    def __init__(self, window: float = 60.0, max_keys: int = 10000):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        # (级别, 消息, 用户) -> [最近输出时间, 被抑制次数]；不同用户的相同错误分别输出
+        self._seen: Dict[Tuple[int, str, object], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # 同一条记录会经过多个输出，只判定一次
+        decision = getattr(record, "_rate_limit_decision", None)
+        if decision is not None:
+            return decision
+        decision = self._decide(record)
+        record._rate_limit_decision = decision
+        return decision
+
+    def _decide(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+
+        now = time.monotonic()
+        key = (record.levelno, record.getMessage(), getattr(record, "user_id", None))
+        entry = self._seen.get(key)
+        if entry is not None and now - entry[0] < self.window:
+            entry[1] += 1
+            return False
+
+        if entry is not None and entry[1]:
+            record.msg = f"{record.getMessage()} (已抑制{int(entry[1])}条重复日志)"
+            record.args = None
+
+        if len(self._seen) >= self.max_keys:
+            self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+        self._seen[key] = [now, 0]
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """在日志末尾追加 key=value 形式的结构化字段"""
+
+    def __init__(self, fmt: Optional[str] = None, datefmt: Optional[str] = None):
+        super().__init__(fmt or "%(asctime)s %(levelname)s %(threadName)s %(message)s", datefmt)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = [
+            f"{name}={getattr(record, name)}"
+            for name in STRUCTURED_FIELDS
+            if getattr(record, name, None) is not None
+        ]
+        if fields:
+            text = f"{text} | {' '.join(fields)}"
+        return text
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[_NonBlockingQueueHandler] = None
+# 接管前根日志器的输出和级别，以及对各输出所做的修改，停止时恢复
+_saved_root: Optional[Tuple[List[logging.Handler], int]] = None
+_patched: List[Tuple[logging.Handler, Optional[logging.Formatter], logging.Filter]] = []
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    handlers: Optional[List[logging.Handler]] = None,
+    rate_limit_window: float = 60.0,
+    queue_size: int = 10000,
+) -> None:
+    """将根日志器切换为队列模式，由后台线程写入实际的日志输出"""
+    global _listener, _queue_handler, _saved_root, _patched
+
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    _saved_root = (list(root.handlers), root.level)
+    if not handlers:
+        # 默认沿用宿主已配置的输出
+        handlers = list(root.handlers) or [logging.StreamHandler()]
+    formatter = StructuredFormatter()
+    rate_limit = RateLimitFilter(rate_limit_window)
+    _patched = []
+    for handler in handlers:
+        _patched.append((handler, handler.formatter, rate_limit))
+        if handler.formatter is None:
+            handler.setFormatter(formatter)
+        handler.addFilter(rate_limit)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = _NonBlockingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """停止后台写入线程并写出队列中剩余的日志，恢复根日志器原来的输出"""
+    global _listener, _queue_handler, _saved_root, _patched
+
+    if _listener is None:
+        return
+    _listener.stop()
+    if _queue_handler is not None and _queue_handler.dropped:
+        for handler in _listener.handlers:
+            handler.handle(logging.makeLogRecord({
+                "msg": f"日志队列已满，共丢弃{_queue_handler.dropped}条日志",
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+            }))
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+
+    for handler, formatter, rate_limit in _patched:
+        handler.removeFilter(rate_limit)
+        handler.setFormatter(formatter)
+    if _saved_root is not None:
+        handlers, level = _saved_root
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+    _listener = None
+    _queue_handler = None
+    _saved_root = None
+    _patched = []
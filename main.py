@@ -1,58 +1,257 @@
+# import os
 # import threading
 # import time
 # import logging
-# from typing import Dict, List, Optional, Any
+# from typing import TYPE_CHECKING, Dict, List, Optional, Any
 
 # from pkg.plugin.context import register, handler, content_func, BasePlugin, APIHost, EventContext
 # from pkg.plugin.events import *
 
-# from autodl_client import AutoDLClient
-# from models import AutoDLConfig, GrabConfig, GrabMenuData, Instance
+# from config_cache import ConfigCache
+# from grab_watchdog import GrabWatchdog
+# from job_journal import JobJournal
+# from fair_scheduler import TIERS, PollScheduler
+# from log_pipeline import log_context, setup_logging, stop_logging
+# from message_sender import MessageSender
+# from metrics import format_stats, start_metrics_server
+# from notifier import CallbackNotifier
+# from profiling import PROFILER
+# from read_cache import ReadCache
 # from storage import UserStorage
+# from views import ViewCache
+
+# if TYPE_CHECKING:
+#     from autodl_client import AutoDLClient, ClientPool
+#     from balance_cache import BalanceCache
+#     from grab_analytics import GrabAnalytics
+#     from market import MarketIndex
+#     from models import AutoDLConfig, Instance
+#     from refresh_scheduler import RefreshScheduler
+
+# # 依赖 requests 和连接池的组件（客户端池、余额缓存、算力市场、自动刷新、抢卡任务）
+# # 在首次使用时才导入和创建，pydantic模型在首次解析或创建配置时才导入，
+# # 插件启动耗时只与运行中的抢卡任务数有关
 
 # @register(name="AutoDLPlugin", description="AutoDL监控与抢卡助手", version="1.0.0", author="YourName")
 # class AutoDLPlugin(BasePlugin):
 #     def __init__(self, host: APIHost):
+#         boot_started = time.perf_counter()
 #         super().__init__(host)
 #         self.host = host
 #         self.ap = host.ap
         
+#         # 延迟创建的组件，见 _lazy
+#         self._lazy_lock = threading.Lock()
+        
+#         # 日志改为队列异步写入，避免慢输出阻塞抢卡线程
+#         setup_logging()
+        
 #         # 用户配置
 #         self.storage = UserStorage("autodl_users.db")
-#         self.user_configs: Dict[int, AutoDLConfig] = {}
+#         self.config_cache = ConfigCache(self.storage, max_size=1000)
         
 #         # 抢卡任务
 #         self.grab_tasks: Dict[int, threading.Event] = {}
 #         self.grab_threads: Dict[int, threading.Thread] = {}
         
-#         # 加载所有用户配置
-#         self.user_configs = self.storage.load_all_users()
+#         # 出站消息合并与限流
+#         self.sender = MessageSender()
+        
+#         # 按实例快照缓存渲染好的列表消息
+#         self.views = ViewCache()
+        
+#         # 查询类命令的短时缓存（环境变量 AUTODL_READ_CACHE_TTL，秒）
+#         self.read_cache = ReadCache(ttl=float(os.environ.get("AUTODL_READ_CACHE_TTL", "5")))
+        
+#         # 抢卡任务交给独立的 grab_daemon 运行时，插件只负责写入配置
+#         self.external_grab = os.environ.get("AUTODL_EXTERNAL_GRAB") == "1"
+        
+#         # 管理员用户ID（环境变量 AUTODL_ADMIN_IDS，逗号分隔）
+#         self.admin_ids = {int(x) for x in os.environ.get("AUTODL_ADMIN_IDS", "").split(",") if x.strip()}
+        
+#         # Prometheus指标端点（环境变量 AUTODL_METRICS_PORT，监听地址 AUTODL_METRICS_HOST 默认只限本机）
+#         self.metrics_server = None
+#         metrics_port = os.environ.get("AUTODL_METRICS_PORT")
+#         if metrics_port:
+#             self.metrics_server = start_metrics_server(int(metrics_port), os.environ.get("AUTODL_METRICS_HOST", "127.0.0.1"))
+        
+#         # 抢卡任务日志（由守护进程运行任务时不使用，避免两个进程写同一文件）
+#         self.journal = None if self.external_grab else JobJournal("grab_journal.jsonl")
+        
+#         # 从抢卡日志得到需要恢复的任务；首次启动没有日志时只加载有运行中抢卡任务的用户
+#         if self.journal is not None and self.journal.loaded:
+#             self.resume_user_ids: List[int] = list(self.journal.active_jobs())
+#         else:
+#             running_configs = self.storage.load_running_users()
+#             self.config_cache.preload(running_configs)
+#             self.resume_user_ids = list(running_configs.keys())
+        
+#         # 算力市场索引专用的查询账号（环境变量 AUTODL_MARKET_USERNAME、AUTODL_MARKET_PASSWORD），不借用用户的账号
+#         self.market_account = (os.environ.get("AUTODL_MARKET_USERNAME", ""), os.environ.get("AUTODL_MARKET_PASSWORD", ""))
+        
+#         # 所有抢卡轮询共用的请求预算（环境变量 AUTODL_POLL_BUDGET，每秒请求数），按用户公平分配
+#         poll_budget = float(os.environ.get("AUTODL_POLL_BUDGET", "20"))
+#         self.poll_scheduler = PollScheduler(rate=poll_budget, burst=poll_budget)
+        
+#         # 抢卡任务看门狗：卡住或意外退出时重启，轮询SLO不达标时告警
+#         self.watchdog = GrabWatchdog(CallbackNotifier(self._notify_user), self.admin_ids)
+#         self.watchdog.start()
+        
+#         # 延迟加载模式（默认，AUTODL_LAZY_INIT=0 关闭）下其余组件在后台线程中预热，不阻塞启动
+#         if os.environ.get("AUTODL_LAZY_INIT", "1") == "0":
+#             self._warm_up()
+#         else:
+#             threading.Thread(target=self._warm_up, name="autodl-warm-up", daemon=True).start()
         
-#         self.host.logger.info("AutoDL插件初始化完成")
+#         self.boot_ms = (time.perf_counter() - boot_started) * 1000
+#         self.host.logger.info(f"AutoDL插件初始化完成，耗时 {self.boot_ms:.0f}ms，待恢复抢卡任务 {len(self.resume_user_ids)} 个")
+    
+#     def _lazy(self, name: str, factory):
+#         """首次访问时创建组件，之后直接返回"""
+#         value = self.__dict__.get(name)
+#         if value is None:
+#             with self._lazy_lock:
+#                 value = self.__dict__.get(name)
+#                 if value is None:
+#                     value = self.__dict__[name] = factory()
+#         return value
+    
+#     @property
+#     def client_pool(self) -> "ClientPool":
+#         """按账号复用客户端，避免每条命令都重新登录；开关机后使该账号的查询缓存失效"""
+#         def create():
+#             from autodl_client import ClientPool
+#             from transport import create_transport
+            
+#             # 所有账号共用的HTTP连接池（环境变量 AUTODL_HTTP_POOL_SIZE、AUTODL_HTTP2=1、AUTODL_DNS_TTL）
+#             session = create_transport(
+#                 pool_size=int(os.environ.get("AUTODL_HTTP_POOL_SIZE", "16")),
+#                 dns_ttl=float(os.environ.get("AUTODL_DNS_TTL", "300")),
+#                 http2=os.environ.get("AUTODL_HTTP2") == "1",
+#             )
+#             return ClientPool(on_write=self._on_account_write, session=session)
+#         return self._lazy("_client_pool", create)
+    
+#     @property
+#     def balance_cache(self) -> "BalanceCache":
+#         """余额缓存，过期后后台刷新"""
+#         def create():
+#             from balance_cache import BalanceCache
+#             return BalanceCache()
+#         return self._lazy("_balance_cache", create)
+    
+#     @property
+#     def market_index(self) -> "MarketIndex":
+#         """算力市场本地索引，使用专用查询账号在后台刷新，无人查询时停止"""
+#         def create():
+#             from market import MarketIndex
+#             return MarketIndex(self._market_client)
+#         return self._lazy("_market_index", create)
+    
+#     def _market_client(self) -> Optional["AutoDLClient"]:
+#         username, password = self.market_account
+#         if not username or not password:
+#             return None
+#         return self.client_pool.get(username, password)
+    
+#     @property
+#     def analytics(self) -> "GrabAnalytics":
+#         """抢卡结果统计（与 grab_daemon 共用数据库，/grabreport 读取）"""
+#         def create():
+#             from grab_analytics import GrabAnalytics
+#             return GrabAnalytics("autodl_analytics.db")
+#         return self._lazy("_analytics", create)
+    
+#     @property
+#     def refresh_scheduler(self) -> "RefreshScheduler":
+#         """按释放时间自动刷新实例时长"""
+#         def create():
+#             from refresh_scheduler import RefreshScheduler
+#             scheduler = RefreshScheduler(self._account_clients, CallbackNotifier(self._notify_user))
+#             for user_id in self.storage.load_auto_refresh_user_ids():
+#                 scheduler.add_user(user_id)
+#             scheduler.start()
+#             return scheduler
+#         return self._lazy("_refresh_scheduler", create)
+    
+#     def _warm_up(self) -> None:
+#         """创建常驻组件；有开启自动刷新的用户时自动刷新需要立即运行"""
+#         started = time.perf_counter()
+#         try:
+#             self.client_pool
+#             self.balance_cache
+#             self.refresh_scheduler
+#         except Exception as e:
+#             logging.error(f"AutoDL插件组件初始化出错: {str(e)}")
+#             return
+#         logging.info(f"AutoDL插件组件预热完成，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
     
 #     # 异步初始化
 #     async def initialize(self):
 #         pass
     
     
-#     def _get_user_config(self, user_id: int) -> AutoDLConfig:
+#     def _get_user_config(self, user_id: int) -> "AutoDLConfig":
 #         """获取用户配置"""
-#         if user_id not in self.user_configs:
-#             self.user_configs[user_id] = AutoDLConfig()
-#         return self.user_configs[user_id]
+#         # 由守护进程运行抢卡时，抢卡状态由守护进程写入数据库，没有本地未写回修改时以数据库为准
+#         return self.config_cache.get(user_id, fresh=self.external_grab)
     
-#     def _save_user_config(self, user_id: int, config: AutoDLConfig) -> None:
-#         """保存用户配置"""
-#         self.user_configs[user_id] = config
-#         self.storage.save_user(user_id, config)
+#     def _save_user_config(self, user_id: int, config: "AutoDLConfig") -> None:
+#         """保存用户配置（由缓存批量写回数据库）"""
+#         self.config_cache.put(user_id, config)
     
-#     def _init_autodl_client(self, user_id: int) -> Optional[AutoDLClient]:
+#     def _init_autodl_client(self, user_id: int) -> Optional["AutoDLClient"]:
 #         """初始化AutoDL客户端"""
 #         config = self._get_user_config(user_id)
 #         if not config.username or not config.password:
 #             return None
         
-#         return AutoDLClient(config.username, config.password)
+#         return self.client_pool.get(config.username, config.password)
+    
+#     def _account_clients(self, user_id: int) -> Dict[str, "AutoDLClient"]:
+#         """用户所有账号（主账号和附加账号）的客户端，按用户名索引"""
+#         config = self._get_user_config(user_id)
+#         return {
+#             account.username: self.client_pool.get(account.username, account.password)
+#             for account in config.all_accounts()
+#         }
+    
+#     def _on_account_write(self, client: "AutoDLClient") -> None:
+#         """账号有开关机操作后丢弃缓存的实例列表和余额"""
+#         self.read_cache.invalidate(client.username)
+#         self.balance_cache.invalidate(client.username)
+    
+#     def _get_instances(self, user_id: int, client: "AutoDLClient") -> Optional[List["Instance"]]:
+#         """读取实例列表，新鲜期内和并发的相同查询共用一次请求"""
+#         return self.read_cache.get((client.username, user_id, "instances"), client.get_instances, cache_if=bool)
+    
+#     def _get_balance(self, user_id: int, client: "AutoDLClient") -> Optional[float]:
+#         return self.read_cache.get(
+#             (client.username, user_id, "balance"),
+#             lambda: self.balance_cache.get(client),
+#             cache_if=lambda balance: balance is not None,
+#         )
+    
+#     def _is_admin(self, user_id: int) -> bool:
+#         """是否为管理员"""
+#         return user_id in self.admin_ids
+    
+#     @staticmethod
+#     def _target(query):
+#         """回复所在的会话（私聊或群），不同会话的消息不会合并"""
+#         return (getattr(query, "launcher_type", None), getattr(query, "launcher_id", None))
+    
+#     def _respond(self, query, message: str, dedup_key: Optional[str] = None) -> None:
+#         """通过出站消息层回复用户"""
+#         self.sender.send(query.sender.id, query.respond, message, dedup_key, target=self._target(query))
+    
+#     def _notify_user(self, user_id: int, message: str, dedup_key: Optional[str] = None) -> None:
+#         """主动向用户发送消息（无当前会话时使用）"""
+#         self.sender.send(user_id, lambda text: self.host.send_message(user_id, text), message, dedup_key)
+    
+#     def _progress(self, query, key: str, message: str) -> None:
+#         """回复进度消息，窗口内只保留最新进度"""
+#         self.sender.progress(query.sender.id, query.respond, key, message, target=self._target(query))
     
 #     # 命令处理
 #     @handler(on=EventContext.HANDLE_MESSAGE)
@@ -61,6 +260,12 @@
 #         msg = query.message
 #         user_id = query.sender.id
         
+#         # 性能追踪上下文（未开启时无开销）
+#         command = msg.split(" ", 1)[0] if msg.startswith("/") else None
+#         with log_context(user_id=user_id), PROFILER.context(user_id, command):
+#             self._dispatch_command(query, msg)
+    
+#     def _dispatch_command(self, query, msg: str):
 #         # 命令处理
 #         if msg.startswith("/help"):
 #             self._send_help(query)
@@ -78,14 +283,26 @@
 #             self._handle_startcpu_command(query, msg[10:])
 #         elif msg.startswith("/stop "):
 #             self._handle_stop_command(query, msg[6:])
+#         elif msg.startswith("/stopall"):
+#             self._handle_stopall_command(query)
+#         elif msg.startswith("/startall"):
+#             self._handle_startall_command(query, msg[9:].strip())
 #         elif msg.startswith("/refresh "):
 #             self._handle_refresh_command(query, msg[9:])
 #         elif msg.startswith("/refreshall"):
 #             self._handle_refreshall_command(query)
+#         elif msg.startswith("/autorefresh"):
+#             self._handle_autorefresh_command(query, msg[12:].strip())
+#         elif msg.startswith("/account"):
+#             self._handle_account_command(query, msg[8:].strip())
 #         elif msg.startswith("/getuser"):
 #             self._handle_getuser_command(query)
 #         elif msg.startswith("/balance"):
 #             self._handle_balance_command(query)
+#         elif msg.startswith("/minbalance "):
+#             self._handle_minbalance_command(query, msg[12:].strip())
+#         elif msg.startswith("/market"):
+#             self._handle_market_command(query, msg[7:].strip())
 #         elif msg.startswith("/grabmenu"):
 #             self._handle_grabmenu_command(query)
 #         elif msg.startswith("/grabgpu "):
@@ -96,6 +313,14 @@
 #             self._handle_stopgrab_command(query)
 #         elif msg.startswith("/grabstatus"):
 #             self._handle_grabstatus_command(query)
+#         elif msg.startswith("/grabreport"):
+#             self._handle_grabreport_command(query, msg[11:].strip())
+#         elif msg.startswith("/autodlstats"):
+#             self._handle_autodlstats_command(query)
+#         elif msg.startswith("/grabtier"):
+#             self._handle_grabtier_command(query, msg[9:].strip())
+#         elif msg.startswith("/profile"):
+#             self._handle_profile_command(query, msg[8:].strip())
     
 #     # 帮助信息
 #     def _send_help(self, query):
@@ -109,17 +334,26 @@
 # /start <uuid> - 启动GPU实例
 # /startcpu <uuid> - 启动GPU实例(无卡模式)
 # /stop <uuid> - 关闭GPU实例
+# /startall [GPU型号] - 并发启动所有有空闲GPU的实例（可按型号筛选）
+# /stopall - 并发关闭所有运行中的实例
 # /refresh <uuid> - 无卡模式重置实例时长
 # /refreshall - 重置所有实例时长
+# /autorefresh on|off - 实例即将释放时自动刷新时长
+# /account add <名称> <用户名> <密码> - 添加抢卡用的附加账号
+# /account del <名称> - 删除附加账号
+# /account list - 查看所有账号
 # /getuser - 查看当前设置的用户
 # /balance - 查看账户余额
+# /minbalance <元> - 余额低于该值时抢卡不开机
+# /market [GPU型号] [地区] - 查看算力市场有空闲GPU的机器（按价格排序）
 # /grabmenu - 显示抢卡菜单
 # /grabgpu <gpu类型> - 设置抢卡GPU型号并启动
 # /grabuuid <uuid> - 按实例UUID抢卡
 # /stopgrab - 停止抢卡任务
 # /grabstatus - 查看抢卡状态
+# /grabreport [天数] [GPU型号] - 各GPU型号的抢卡成功率和耗时
 # """
-#         query.respond(help_text)
+#         self._respond(query, help_text)
     
 #     # 用户名设置
 #     def _handle_user_command(self, query, username):
@@ -127,7 +361,7 @@
 #         config = self._get_user_config(user_id)
 #         config.username = username
 #         self._save_user_config(user_id, config)
-#         query.respond(f"用户名已设置为: {username}")
+#         self._respond(query, f"用户名已设置为: {username}")
     
 #     # 密码设置
 #     def _handle_password_command(self, query, password):
@@ -135,7 +369,7 @@
 #         config = self._get_user_config(user_id)
 #         config.password = password
 #         self._save_user_config(user_id, config)
-#         query.respond("密码已设置")
+#         self._respond(query, "密码已设置")
     
 #     # 查看GPU状态
 #     def _handle_gpuvalid_command(self, query):
@@ -143,46 +377,21 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
         
-#         query.respond("正在查询GPU状态...")
-#         instances = client.get_instances()
+#         self._respond(query, "正在查询GPU状态...")
+#         instances = self._get_instances(user_id, client)
         
 #         if not instances:
-#             query.respond("获取实例信息失败")
+#             self._respond(query, "获取实例信息失败")
 #             return
         
-#         result = "GPU状态:\n\n"
-#         for i, instance in enumerate(instances):
-#             result += f"机器: {instance.region_name}-{instance.machine_alias}\n"
-#             result += f"显卡: {instance.snapshot_gpu_alias_name}\n"
-#             result += f"UUID: {instance.uuid}\n"
-#             result += f"GPU数量: {instance.gpu_idle_num}/{instance.gpu_all_num}\n"
-            
-#             # 显示释放时间
-#             stopped_at = instance.stopped_at
-#             if stopped_at and "time" in stopped_at:
-#                 import datetime
-#                 stop_time = stopped_at["time"]
-#                 if stop_time:
-#                     # 计算剩余释放时间
-#                     try:
-#                         stop_datetime = datetime.datetime.fromisoformat(stop_time.replace('Z', '+00:00'))
-#                         release_time = stop_datetime + datetime.timedelta(hours=24)
-#                         now = datetime.datetime.now(datetime.timezone.utc)
-#                         if release_time > now:
-#                             remaining = release_time - now
-#                             hours = remaining.seconds // 3600
-#                             minutes = (remaining.seconds % 3600) // 60
-#                             result += f"释放时间: 还剩{hours}小时{minutes}分钟\n"
-#                     except:
-#                         pass
-            
-#             if i < len(instances)-1:
-#                 result += "----------------\n"
-        
-#         query.respond(result)
+#         # 顺带更新自动刷新的释放时间
+#         self.refresh_scheduler.track(user_id, instances, client.username)
+        
+#         for chunk in self.views.render("gpuvalid", instances):
+#             self._respond(query, chunk)
     
 #     # 查看实例详情
 #     def _handle_instances_command(self, query):
@@ -190,26 +399,18 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
         
-#         query.respond("正在查询实例...")
-#         instances = client.get_instances()
+#         self._respond(query, "正在查询实例...")
+#         instances = self._get_instances(user_id, client)
         
 #         if not instances:
-#             query.respond("获取实例信息失败")
+#             self._respond(query, "获取实例信息失败")
 #             return
         
-#         result = "实例列表:\n\n"
-#         for i, instance in enumerate(instances):
-#             result += f"{i+1}. {instance.region_name}-{instance.machine_alias}\n"
-#             result += f"显卡: {instance.snapshot_gpu_alias_name}\n"
-#             result += f"UUID: {instance.uuid}\n"
-#             result += f"GPU: {instance.gpu_idle_num}/{instance.gpu_all_num}\n"
-#             if i < len(instances)-1:
-#                 result += "----------------\n"
-        
-#         query.respond(result)
+#         for chunk in self.views.render("instances", instances):
+#             self._respond(query, chunk)
     
 #     # 启动实例
 #     def _handle_start_command(self, query, uuid):
@@ -217,20 +418,20 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
             
 #         if not uuid:
-#             query.respond("请提供实例UUID")
+#             self._respond(query, "请提供实例UUID")
 #             return
         
-#         query.respond(f"正在启动实例 {uuid}...")
+#         self._respond(query, f"正在启动实例 {uuid}...")
 #         success = client.power_on(uuid, use_cpu=False)
         
 #         if success:
-#             query.respond("实例启动成功")
+#             self._respond(query, "实例启动成功")
 #         else:
-#             query.respond("实例启动失败")
+#             self._respond(query, "实例启动失败")
     
 #     # 无卡模式启动实例
 #     def _handle_startcpu_command(self, query, uuid):
@@ -238,20 +439,20 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
             
 #         if not uuid:
-#             query.respond("请提供实例UUID")
+#             self._respond(query, "请提供实例UUID")
 #             return
         
-#         query.respond(f"正在启动实例(无卡模式) {uuid}...")
+#         self._respond(query, f"正在启动实例(无卡模式) {uuid}...")
 #         success = client.power_on(uuid, use_cpu=True)
         
 #         if success:
-#             query.respond("实例无卡启动成功")
+#             self._respond(query, "实例无卡启动成功")
 #         else:
-#             query.respond("实例无卡启动失败")
+#             self._respond(query, "实例无卡启动失败")
     
 #     # 关闭实例
 #     def _handle_stop_command(self, query, uuid):
@@ -259,20 +460,84 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
             
 #         if not uuid:
-#             query.respond("请提供实例UUID")
+#             self._respond(query, "请提供实例UUID")
 #             return
         
-#         query.respond(f"正在关闭实例 {uuid}...")
+#         self._respond(query, f"正在关闭实例 {uuid}...")
 #         success = client.power_off(uuid)
         
 #         if success:
-#             query.respond("实例关闭成功")
+#             self._respond(query, "实例关闭成功")
 #         else:
-#             query.respond("实例关闭失败")
+#             self._respond(query, "实例关闭失败")
+    
+#     # 批量操作结果汇总
+#     def _format_power_results(self, title: str, results, elapsed: float) -> str:
+#         succeeded = sum(1 for r in results if r.success)
+#         lines = [f"{title}: 成功 {succeeded}/{len(results)}，耗时 {elapsed:.1f} 秒"]
+#         for r in results:
+#             if r.success:
+#                 lines.append(f"✅ {r.uuid} ({r.elapsed_ms:.0f}ms)")
+#             else:
+#                 lines.append(f"❌ {r.uuid}: {r.error or '失败'}")
+#         return "\n".join(lines)
+    
+#     # 关闭所有实例
+#     def _handle_stopall_command(self, query):
+#         user_id = query.sender.id
+#         client = self._init_autodl_client(user_id)
+        
+#         if not client:
+#             self._respond(query, "请先设置用户名和密码")
+#             return
+        
+#         instances = client.get_instances()
+#         if not instances:
+#             self._respond(query, "获取实例信息失败")
+#             return
+        
+#         # 状态未知时也尝试关闭
+#         uuids = [i.uuid for i in instances if i.status != "shutdown"]
+#         if not uuids:
+#             self._respond(query, "没有运行中的实例")
+#             return
+        
+#         self._respond(query, f"正在关闭 {len(uuids)} 个实例...")
+#         start = time.time()
+#         results = client.power_off_many(uuids)
+#         self._respond(query, self._format_power_results("批量关机完成", results, time.time() - start))
+    
+#     # 启动所有有空闲GPU的实例
+#     def _handle_startall_command(self, query, gpu_type: str):
+#         user_id = query.sender.id
+#         client = self._init_autodl_client(user_id)
+        
+#         if not client:
+#             self._respond(query, "请先设置用户名和密码")
+#             return
+        
+#         instances = client.get_instances()
+#         if not instances:
+#             self._respond(query, "获取实例信息失败")
+#             return
+        
+#         uuids = [
+#             i.uuid for i in instances
+#             if i.status != "running" and i.gpu_idle_num > 0
+#             and (not gpu_type or gpu_type in i.snapshot_gpu_alias_name)
+#         ]
+#         if not uuids:
+#             self._respond(query, "没有可启动的实例（无空闲GPU或型号不匹配）")
+#             return
+        
+#         self._respond(query, f"正在启动 {len(uuids)} 个实例...")
+#         start = time.time()
+#         results = client.power_on_many(uuids)
+#         self._respond(query, self._format_power_results("批量启动完成", results, time.time() - start))
     
 #     # 刷新实例时长
 #     def _handle_refresh_command(self, query, uuid):
@@ -280,19 +545,19 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
             
 #         if not uuid:
-#             query.respond("请提供实例UUID")
+#             self._respond(query, "请提供实例UUID")
 #             return
         
-#         query.respond(f"正在刷新实例时长 {uuid}...")
+#         self._respond(query, f"正在刷新实例时长 {uuid}...")
         
 #         # 先开启实例(无卡模式)
 #         start_success = client.power_on(uuid, use_cpu=True)
 #         if not start_success:
-#             query.respond("启动实例失败，无法刷新时长")
+#             self._respond(query, "启动实例失败，无法刷新时长")
 #             return
         
 #         # 等待实例启动
@@ -301,10 +566,10 @@
 #         # 关闭实例
 #         stop_success = client.power_off(uuid)
 #         if not stop_success:
-#             query.respond("关闭实例失败，请手动关闭")
+#             self._respond(query, "关闭实例失败，请手动关闭")
 #             return
             
-#         query.respond("实例时长刷新成功")
+#         self._respond(query, "实例时长刷新成功")
     
 #     # 刷新所有实例时长
 #     def _handle_refreshall_command(self, query):
@@ -312,26 +577,26 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
 #             return
         
-#         query.respond("正在获取实例列表...")
+#         self._respond(query, "正在获取实例列表...")
 #         instances = client.get_instances()
         
 #         if not instances:
-#             query.respond("获取实例信息失败")
+#             self._respond(query, "获取实例信息失败")
 #             return
         
-#         query.respond(f"开始刷新 {len(instances)} 个实例的时长...")
+#         self._respond(query, f"开始刷新 {len(instances)} 个实例的时长...")
         
-#         for instance in instances:
+#         for i, instance in enumerate(instances):
 #             uuid = instance.uuid
-#             query.respond(f"正在刷新实例 {instance.machine_alias} ({uuid})...")
+#             self._progress(query, "refreshall", f"正在刷新实例 {i+1}/{len(instances)}: {instance.machine_alias} ({uuid})...")
             
 #             # 开启实例(无卡模式)
 #             start_success = client.power_on(uuid, use_cpu=True)
 #             if not start_success:
-#                 query.respond(f"启动实例 {uuid} 失败，跳过")
+#                 self._respond(query, f"启动实例 {uuid} 失败，跳过")
 #                 continue
                 
 #             # 等待实例启动
@@ -340,15 +605,87 @@
 #             # 关闭实例
 #             stop_success = client.power_off(uuid)
 #             if not stop_success:
-#                 query.respond(f"关闭实例 {uuid} 失败，请手动关闭")
+#                 self._respond(query, f"关闭实例 {uuid} 失败，请手动关闭")
 #                 continue
                 
-#             query.respond(f"实例 {instance.machine_alias} 时长刷新成功")
+#             self._progress(query, "refreshall", f"实例 {instance.machine_alias} 时长刷新成功 ({i+1}/{len(instances)})")
             
 #             # 防止请求过快被限流
 #             time.sleep(3)
         
-#         query.respond("所有实例时长刷新完成")
+#         self._respond(query, "所有实例时长刷新完成")
+    
+#     # 自动刷新实例时长
+#     def _handle_autorefresh_command(self, query, action: str):
+#         user_id = query.sender.id
+#         config = self._get_user_config(user_id)
+        
+#         if action == "on":
+#             if not config.username or not config.password:
+#                 self._respond(query, "请先设置用户名和密码")
+#                 return
+#             config.auto_refresh = True
+#             self._save_user_config(user_id, config)
+#             self.refresh_scheduler.add_user(user_id)
+#             self._respond(query, "已开启自动刷新，实例释放前会自动刷新时长")
+#         elif action == "off":
+#             config.auto_refresh = False
+#             self._save_user_config(user_id, config)
+#             self.refresh_scheduler.remove_user(user_id)
+#             self._respond(query, "已关闭自动刷新")
+#         else:
+#             if not config.auto_refresh:
+#                 self._respond(query, "自动刷新未开启，使用 /autorefresh on 开启")
+#                 return
+#             pending = self.refresh_scheduler.pending(user_id)
+#             if not pending:
+#                 self._respond(query, "自动刷新已开启，暂无需要刷新的关机实例")
+#                 return
+#             lines = ["自动刷新已开启，即将释放的实例:"]
+#             for uuid, deadline in pending:
+#                 remaining = max(0, int(deadline - time.time()))
+#                 lines.append(f"{uuid}: 还剩{remaining // 3600}小时{remaining % 3600 // 60}分钟")
+#             self._respond(query, "\n".join(lines))
+    
+#     # 附加账号管理，抢卡时所有账号并行轮询
+#     def _handle_account_command(self, query, args: str):
+#         from models import Account
+#         user_id = query.sender.id
+#         config = self._get_user_config(user_id)
+#         parts = args.split()
+#         action = parts[0] if parts else "list"
+        
+#         if action == "add":
+#             if len(parts) != 4:
+#                 self._respond(query, "用法: /account add <名称> <用户名> <密码>")
+#                 return
+#             name, username, password = parts[1:]
+#             if name == "默认":
+#                 self._respond(query, "名称\"默认\"保留给主账号，请使用 /user 和 /password 设置")
+#                 return
+#             config.accounts = [a for a in config.accounts if a.name != name]
+#             config.accounts.append(Account(name=name, username=username, password=password))
+#             self._save_user_config(user_id, config)
+#             self._respond(query, f"已添加账号 {name}，正在运行的抢卡任务需重新启动后生效")
+#         elif action == "del":
+#             if len(parts) != 2:
+#                 self._respond(query, "用法: /account del <名称>")
+#                 return
+#             remaining = [a for a in config.accounts if a.name != parts[1]]
+#             if len(remaining) == len(config.accounts):
+#                 self._respond(query, f"没有名为 {parts[1]} 的账号")
+#                 return
+#             config.accounts = remaining
+#             self._save_user_config(user_id, config)
+#             self._respond(query, f"已删除账号 {parts[1]}")
+#         else:
+#             accounts = config.all_accounts()
+#             if not accounts:
+#                 self._respond(query, "当前未设置任何账号")
+#                 return
+#             lines = [f"共 {len(accounts)} 个账号:"]
+#             lines.extend(f"{a.name}: {a.username}" for a in accounts)
+#             self._respond(query, "\n".join(lines))
     
 #     # 查看当前用户
 #     def _handle_getuser_command(self, query):
@@ -356,9 +693,9 @@
 #         config = self._get_user_config(user_id)
         
 #         if config.username:
-#             query.respond(f"当前设置的用户名: {config.username}")
+#             self._respond(query, f"当前设置的用户名: {config.username}")
 #         else:
-#             query.respond("当前未设置用户名")
+#             self._respond(query, "当前未设置用户名")
     
 #     # 查看余额
 #     def _handle_balance_command(self, query):
@@ -366,14 +703,79 @@
 #         client = self._init_autodl_client(user_id)
         
 #         if not client:
-#             query.respond("请先设置用户名和密码")
+#             self._respond(query, "请先设置用户名和密码")
+#             return
+        
+#         balance = self._get_balance(user_id, client)
+#         if balance is None:
+#             self._respond(query, "获取余额失败")
 #             return
         
-#         balance = client.get_balance()
-#         if balance < 0:
-#             query.respond("获取余额失败")
+#         result = f"账户余额: {balance} 元"
+#         rate = self.balance_cache.burn_rate(client.username)
+#         if rate:
+#             result += f"\n近期消耗: {rate:.2f} 元/小时"
+#             remaining = self.balance_cache.time_to_zero(client.username)
+#             if remaining is not None:
+#                 result += f"\n预计可用: {int(remaining // 3600)}小时{int(remaining % 3600 // 60)}分钟"
+#         self._respond(query, result)
+    
+#     # 设置抢卡最低余额
+#     def _handle_minbalance_command(self, query, amount: str):
+#         from models import GrabConfig
+#         user_id = query.sender.id
+        
+#         try:
+#             min_balance = float(amount)
+#         except ValueError:
+#             self._respond(query, "用法: /minbalance <元>，0表示不检查")
+#             return
+        
+#         config = self._get_user_config(user_id)
+#         if not config.grab_config:
+#             config.grab_config = GrabConfig()
+#         config.grab_config.min_balance = max(0.0, min_balance)
+#         self._save_user_config(user_id, config)
+        
+#         if min_balance > 0:
+#             self._respond(query, f"余额低于 {min_balance} 元时抢卡将跳过开机，下次启动抢卡任务时生效")
 #         else:
-#             query.respond(f"账户余额: {balance} 元")
+#             self._respond(query, "已关闭抢卡余额检查")
+    
+#     # 算力市场空闲机器
+#     def _handle_market_command(self, query, args: str):
+#         if not all(self.market_account):
+#             self._respond(query, "管理员未配置算力市场查询账号（AUTODL_MARKET_USERNAME、AUTODL_MARKET_PASSWORD）")
+#             return
+        
+#         parts = args.split()
+#         gpu_type = parts[0] if parts else ""
+#         region = parts[1] if len(parts) > 1 else ""
+        
+#         if time.time() - self.market_index.updated_at > self.market_index.refresh_interval * 2:
+#             # 索引尚未建立或空闲停止后已过期，同步拉取一次空闲机器
+#             if not self.market_index.refresh():
+#                 self._respond(query, "获取算力市场失败")
+#                 return
+#         self.market_index.start()
+        
+#         machines = self.market_index.find(gpu_type, region)
+#         if not machines:
+#             summary = self.market_index.gpu_summary()
+#             result = "没有符合条件的空闲机器"
+#             if summary:
+#                 result += "\n\n当前空闲GPU:\n" + "\n".join(
+#                     f"{name}: {count}卡" for name, count in sorted(summary.items(), key=lambda x: -x[1])
+#                 )
+#             self._respond(query, result)
+#             return
+        
+#         age = int(time.time() - self.market_index.updated_at)
+#         result = f"算力市场空闲机器（{age}秒前更新）:\n\n"
+#         for i, machine in enumerate(machines):
+#             result += f"{i+1}. {machine.region_name}-{machine.machine_alias} {machine.gpu_name}\n"
+#             result += f"空闲: {machine.gpu_idle_num}/{machine.gpu_number}卡, {machine.price():.2f}元/卡/小时\n"
+#         self._respond(query, result.rstrip("\n"))
     
 #     # 抢卡菜单
 #     def _handle_grabmenu_command(self, query):
@@ -395,14 +797,15 @@
 # 4. 查看抢卡状态:
 #    /grabstatus
 # """
-#         query.respond(menu_text)
+#         self._respond(query, menu_text)
     
 #     # 按GPU型号抢卡
 #     def _handle_grabgpu_command(self, query, gpu_type):
+#         from models import GrabConfig
 #         user_id = query.sender.id
         
 #         if not gpu_type:
-#             query.respond("请提供GPU型号")
+#             self._respond(query, "请提供GPU型号")
 #             return
             
 #         # 停止可能存在的抢卡任务
@@ -424,14 +827,15 @@
 #         # 启动抢卡线程
 #         self._start_grab_task(user_id, query)
         
-#         query.respond(f"已启动对 {gpu_type} 的抢卡任务")
+#         self._respond(query, f"已启动对 {gpu_type} 的抢卡任务")
     
 #     # 按实例UUID抢卡
 #     def _handle_grabuuid_command(self, query, uuid):
+#         from models import GrabConfig
 #         user_id = query.sender.id
         
 #         if not uuid:
-#             query.respond("请提供实例UUID")
+#             self._respond(query, "请提供实例UUID")
 #             return
             
 #         # 停止可能存在的抢卡任务
@@ -453,16 +857,16 @@
 #         # 启动抢卡线程
 #         self._start_grab_task(user_id, query)
         
-#         query.respond(f"已启动对实例 {uuid} 的抢卡任务")
+#         self._respond(query, f"已启动对实例 {uuid} 的抢卡任务")
     
 #     # 停止抢卡
 #     def _handle_stopgrab_command(self, query):
 #         user_id = query.sender.id
         
 #         if self._stop_grab_task(user_id):
-#             query.respond("抢卡任务已停止")
+#             self._respond(query, "抢卡任务已停止")
 #         else:
-#             query.respond("当前没有正在运行的抢卡任务")
+#             self._respond(query, "当前没有正在运行的抢卡任务")
     
 #     # 抢卡状态
 #     def _handle_grabstatus_command(self, query):
@@ -470,7 +874,7 @@
 #         config = self._get_user_config(user_id)
         
 #         if not config.grab_config or not config.grab_config.enabled:
-#             query.respond("抢卡任务未启动")
+#             self._respond(query, "抢卡任务未启动")
 #             return
             
 #         status = "正在运行" if config.grab_config.is_running else "已停止"
@@ -482,15 +886,138 @@
 #         elif config.grab_config.gpu_types:
 #             status_text += f"抢卡GPU型号: {', '.join(config.grab_config.gpu_types)}\n"
             
-#         status_text += f"检查间隔: {config.grab_config.check_interval}秒"
+#         status_text += f"检查间隔: {config.grab_config.check_interval}秒\n"
+#         status_text += f"抢卡账号数: {len(config.all_accounts())}"
+#         health = self.watchdog.status(user_id)
+#         if health:
+#             status_text += f"\n{health}"
+#         if config.grab_config.min_balance > 0:
+#             status_text += f"\n最低余额: {config.grab_config.min_balance} 元"
+        
+#         self._respond(query, status_text)
+    
+#     # 抢卡结果统计
+#     def _handle_grabreport_command(self, query, args: str):
+#         parts = args.split()
+#         days = 7.0
+#         if parts:
+#             try:
+#                 days = max(float(parts[0]), 1 / 24)
+#                 parts = parts[1:]
+#             except ValueError:
+#                 pass
+#         gpu_type = parts[0] if parts else ""
+        
+#         # 先写入尚未落盘的记录
+#         self.analytics.flush()
+#         rows = self.analytics.report(days, gpu_type)
+#         if not rows:
+#             self._respond(query, f"最近 {days:g} 天没有抢卡记录")
+#             return
+        
+#         def ms(value):
+#             return f"{value:.0f}ms" if value is not None else "-"
+        
+#         result = f"抢卡统计（最近 {days:g} 天）:\n\n"
+#         for row in rows:
+#             result += f"{row.gpu_type}: 尝试 {row.attempts} 次, 成功率 {row.success_rate:.0%}\n"
+#             result += f"抢卡耗时: p50 {ms(row.p50_ms)}, p95 {ms(row.p95_ms)}\n"
+#         self._respond(query, result.rstrip("\n"))
+    
+#     # 运行统计（管理员）
+#     def _handle_autodlstats_command(self, query):
+#         user_id = query.sender.id
+        
+#         if not self._is_admin(user_id):
+#             self._respond(query, "该命令仅管理员可用")
+#             return
+        
+#         stats = format_stats()
+#         stats += f"\n\n查询缓存: 命中 {self.read_cache.hits} 次, 未命中 {self.read_cache.misses} 次"
+#         stats += f"\n插件启动耗时: {self.boot_ms:.0f}ms"
+#         self._respond(query, stats)
+    
+#     # 抢卡优先级（管理员）
+#     # /grabtier <用户ID> <low|normal|high|vip> [每分钟保底轮询次数]
+#     def _handle_grabtier_command(self, query, args: str):
+#         from models import GrabConfig
+#         user_id = query.sender.id
+        
+#         if not self._is_admin(user_id):
+#             self._respond(query, "该命令仅管理员可用")
+#             return
+        
+#         parts = args.split()
+#         try:
+#             target = int(parts[0])
+#             tier = parts[1]
+#             min_polls = float(parts[2]) if len(parts) > 2 else 0
+#         except (ValueError, IndexError):
+#             self._respond(query, f"用法: /grabtier <用户ID> <{'|'.join(TIERS)}> [每分钟保底轮询次数]")
+#             return
+        
+#         if tier not in TIERS:
+#             self._respond(query, f"优先级应为: {', '.join(TIERS)}")
+#             return
+        
+#         config = self._get_user_config(target)
+#         if not config.grab_config:
+#             config.grab_config = GrabConfig()
+#         config.grab_config.priority = tier
+#         config.grab_config.min_polls_per_minute = max(0.0, min_polls)
+#         self._save_user_config(target, config)
+#         self.poll_scheduler.set_min_rate(target, config.grab_config.min_polls_per_minute)
+        
+#         self._respond(query, f"用户 {target} 抢卡优先级已设为 {tier}，每分钟保底轮询 {min_polls:g} 次（优先级在下次启动抢卡时生效）")
+    
+#     # 性能追踪开关（管理员）
+#     # /profile on [阈值ms] [采样率] | off | user <用户ID> | command </命令> | dump | status
+#     def _handle_profile_command(self, query, args: str):
+#         user_id = query.sender.id
+        
+#         if not self._is_admin(user_id):
+#             self._respond(query, "该命令仅管理员可用")
+#             return
+        
+#         parts = args.split()
+#         action = parts[0] if parts else "status"
+        
+#         try:
+#             if action == "on":
+#                 threshold = float(parts[1]) if len(parts) > 1 else None
+#                 sample_rate = float(parts[2]) if len(parts) > 2 else None
+#                 PROFILER.configure(enabled=True, threshold_ms=threshold, sample_rate=sample_rate)
+#             elif action == "off":
+#                 PROFILER.configure(enabled=False, target_user=0, target_command="")
+#             elif action == "user":
+#                 PROFILER.configure(target_user=int(parts[1]) if len(parts) > 1 else 0)
+#             elif action == "command":
+#                 PROFILER.configure(target_command=parts[1] if len(parts) > 1 else "")
+#             elif action == "dump":
+#                 path = PROFILER.dump_folded()
+#                 self._respond(query, f"调用栈已导出: {path}")
+#                 return
+#         except (ValueError, IndexError):
+#             self._respond(query, "参数格式错误")
+#             return
         
-#         query.respond(status_text)
+#         self._respond(query, PROFILER.status())
     
 #     # 停止抢卡任务
 #     def _stop_grab_task(self, user_id: int) -> bool:
+#         if self.external_grab:
+#             # 由守护进程在下一次同步时停止
+#             config = self._get_user_config(user_id)
+#             if config.grab_config and config.grab_config.is_running:
+#                 config.grab_config.is_running = False
+#                 self._save_user_config(user_id, config)
+#                 return True
+#             return False
+        
 #         if user_id in self.grab_tasks and self.grab_tasks[user_id] is not None:
 #             # 设置停止信号
 #             self.grab_tasks[user_id].set()
+#             self.journal.record_stop(user_id, "stopped")
             
 #             # 更新用户配置
 #             config = self._get_user_config(user_id)
@@ -500,10 +1027,13 @@
                 
 #             # 清理资源
 #             if user_id in self.grab_threads:
-#                 self.grab_threads[user_id].join(timeout=1.0)
+#                 # 抢卡线程自己结束任务时不能join自身
+#                 if self.grab_threads[user_id] is not threading.current_thread():
+#                     self.grab_threads[user_id].join(timeout=1.0)
 #                 del self.grab_threads[user_id]
                 
 #             del self.grab_tasks[user_id]
+#             self.config_cache.unpin(user_id)
 #             return True
             
 #         return False
@@ -513,11 +1043,18 @@
 #         config = self._get_user_config(user_id)
 #         if not config.grab_config or not config.grab_config.enabled:
 #             return
+        
+#         # 配置已保存为运行中，守护进程会在下一次同步时启动任务
+#         if self.external_grab:
+#             return
             
 #         # 创建停止信号
 #         stop_signal = threading.Event()
 #         self.grab_tasks[user_id] = stop_signal
         
+#         # 任务运行期间配置常驻缓存
+#         self.config_cache.pin(user_id)
+        
 #         # 创建并启动抢卡线程
 #         thread = threading.Thread(
 #             target=self._grab_task_loop,
@@ -530,80 +1067,66 @@
     
 #     # 抢卡任务循环
 #     def _grab_task_loop(self, user_id: int, query, stop_signal: threading.Event) -> None:
+#         from grab import create_grab_job
+        
 #         config = self._get_user_config(user_id)
 #         if not config.grab_config:
 #             return
             
-#         client = self._init_autodl_client(user_id)
-#         if not client:
-#             query.respond("抢卡失败: 未设置用户名或密码")
+#         notifier = CallbackNotifier(lambda uid, message, dedup_key=None: self._respond(query, message, dedup_key))
+#         job = create_grab_job(user_id, config, notifier, self.client_pool, stop_signal, balance_cache=self.balance_cache, scheduler=self.poll_scheduler, journal=self.journal, analytics=self.analytics)
+#         if not job:
+#             self._respond(query, "抢卡失败: 未设置用户名或密码")
 #             self._stop_grab_task(user_id)
 #             return
-            
-#         # 获取检查间隔
-#         interval = config.grab_config.check_interval
-#         if interval < 3:
-#             interval = 3  # 最小间隔3秒
+        
+#         self.watchdog.watch(user_id, job, threading.current_thread(), lambda: self._restart_grab_task(user_id, query, job))
             
 #         try:
-#             # 抢卡循环
-#             while not stop_signal.is_set():
-#                 try:
-#                     # 按UUID抢卡
-#                     if config.grab_config.instance_uuid:
-#                         instances = client.get_instances()
-#                         target_uuid = config.grab_config.instance_uuid
-                        
-#                         for instance in instances:
-#                             if instance.uuid == target_uuid and instance.gpu_idle_num > 0:
-#                                 # 有空闲GPU，启动实例
-#                                 success = client.power_on(target_uuid)
-                                
-#                                 if success:
-#                                     query.respond(f"抢卡成功: 实例 {target_uuid} 已启动")
-#                                     self._stop_grab_task(user_id)
-#                                     return
-#                                 else:
-#                                     query.respond(f"抢卡失败: 实例 {target_uuid} 启动失败")
-                    
-#                     # 按GPU型号抢卡
-#                     elif config.grab_config.gpu_types:
-#                         instances = client.get_instances()
-#                         target_types = config.grab_config.gpu_types
-                        
-#                         for instance in instances:
-#                             if (instance.snapshot_gpu_alias_name in target_types or 
-#                                 any(t in instance.snapshot_gpu_alias_name for t in target_types)) and \
-#                                instance.gpu_idle_num > 0:
-#                                 # 有匹配的GPU且有空闲，启动实例
-#                                 success = client.power_on(instance.uuid)
-                                
-#                                 if success:
-#                                     query.respond(f"抢卡成功: 实例 {instance.uuid} ({instance.snapshot_gpu_alias_name}) 已启动")
-#                                     self._stop_grab_task(user_id)
-#                                     return
-#                                 else:
-#                                     query.respond(f"抢卡失败: 实例 {instance.uuid} 启动失败")
-                
-#                 except Exception as e:
-#                     self.host.logger.error(f"抢卡过程出错: {str(e)}")
-                
-#                 # 等待下一次检查
-#                 stop_signal.wait(interval)
+#             if job.run():
+#                 self._stop_grab_task(user_id)
                 
 #         except Exception as e:
 #             self.host.logger.error(f"抢卡任务异常: {str(e)}")
 #         finally:
-#             # 确保任务结束时更新状态
-#             config = self._get_user_config(user_id)
-#             if config.grab_config:
-#                 config.grab_config.is_running = False
-#                 self._save_user_config(user_id, config)
+#             self.watchdog.unwatch(user_id, job)
+#             # 确保任务结束时更新状态；已被看门狗重启的旧任务不改动新任务的状态
+#             if self.grab_tasks.get(user_id) in (None, stop_signal):
+#                 config = self._get_user_config(user_id)
+#                 if config.grab_config:
+#                     config.grab_config.is_running = False
+#                     self._save_user_config(user_id, config)
+#                 self.config_cache.unpin(user_id)
+    
+#     # 看门狗发现任务卡住时，换用新客户端重新启动
+#     def _restart_grab_task(self, user_id: int, query, job) -> None:
+#         if self.grab_tasks.get(user_id) is not job.stop_signal:
+#             # 任务已停止或已被替换
+#             return
+        
+#         job.stop()
+#         for client in job.account_clients().values():
+#             self.client_pool.discard(client)
+#         self._start_grab_task(user_id, query)
     
 #     # 插件初始化时重新启动之前的抢卡任务
 #     @handler(on=EventContext.INIT)
 #     def on_init(self, ctx: EventContext):
-#         for user_id, config in self.user_configs.items():
+#         from models import GrabConfig
+#         if self.external_grab:
+#             return
+        
+#         active_jobs = self.journal.active_jobs() if self.journal is not None else {}
+#         for user_id in self.resume_user_ids:
+#             config = self._get_user_config(user_id)
+            
+#             # 崩溃前配置可能尚未写回，以日志中的抢卡配置为准
+#             state = active_jobs.get(user_id)
+#             if state is not None and not (config.grab_config and config.grab_config.is_running):
+#                 config.grab_config = GrabConfig(**state.grab_config)
+#                 config.grab_config.is_running = True
+#                 self._save_user_config(user_id, config)
+            
 #             if config.grab_config and config.grab_config.enabled and config.grab_config.is_running:
 #                 # 创建一个简单的查询对象用于发送消息
 #                 class SimpleQuery:
@@ -617,7 +1140,7 @@
 #                 query = SimpleQuery(user_id, self.host)
 #                 self.host.logger.info(f"为用户 {user_id} 重启抢卡任务")
 #                 self._start_grab_task(user_id, query)
-#                 query.respond("系统重启，抢卡任务已自动恢复")
+#                 self._respond(query, "系统重启，抢卡任务已自动恢复")
 
 #     # 内容函数：查询GPU状态
 #     @content_func("check_autodl_gpu", 
@@ -631,32 +1154,11 @@
 #             return "请先设置您的AutoDL账户。使用 /user 和 /password 命令设置用户名和密码。"
         
 #         try:
-#             instances = client.get_instances()
+#             instances = self._get_instances(user_id, client)
 #             if not instances:
 #                 return "无法获取您的实例信息，请检查账号设置是否正确。"
             
-#             result = "🖥️ 您的AutoDL实例情况：\n\n"
-#             available_gpus = 0
-            
-#             for i, instance in enumerate(instances):
-#                 result += f"📊 {instance.region_name}-{instance.machine_alias}\n"
-#                 result += f"🔌 显卡: {instance.snapshot_gpu_alias_name}\n"
-#                 result += f"🆔 UUID: {instance.uuid}\n"
-#                 result += f"🎮 GPU状态: {instance.gpu_idle_num}/{instance.gpu_all_num} 可用\n"
-                
-#                 if instance.gpu_idle_num > 0:
-#                     available_gpus += 1
-                    
-#                 if i < len(instances)-1:
-#                     result += "----------------\n"
-            
-#             # 添加总结信息
-#             if available_gpus > 0:
-#                 result += f"\n✅ 总结: 您有 {available_gpus} 个实例有可用GPU"
-#             else:
-#                 result += "\n❌ 总结: 目前没有可用的GPU资源"
-                
-#             return result
+#             return "\n".join(self.views.render("gpu_summary", instances))
             
 #         except Exception as e:
 #             self.host.logger.error(f"查询GPU状态出错: {str(e)}")
@@ -737,6 +1239,7 @@
 #             {"name": "interval", "description": "检查间隔(秒)，最小3秒", "required": False}
 #         ])
 #     async def grab_autodl_gpu_func(self, gpu_type: str = "", uuid: str = "", interval: int = 5) -> str:
+#         from models import GrabConfig
 #         query_obj = getattr(self, "current_query", None)
 #         if not query_obj:
 #             return "操作失败：无法获取用户信息"
@@ -810,9 +1313,34 @@
 #         for user_id in list(self.grab_tasks.keys()):
 #             self._stop_grab_task(user_id)
         
-#         # 保存所有用户配置
-#         for user_id, config in self.user_configs.items():
-#             self.storage.save_user(user_id, config)
+#         self.watchdog.stop()
+#         self.poll_scheduler.stop()
+        
+#         # 只关闭已经创建的延迟组件
+#         for name, close in (
+#             ("_refresh_scheduler", "stop"),
+#             ("_market_index", "stop"),
+#             ("_balance_cache", "close"),
+#             ("_analytics", "close"),
+#         ):
+#             component = self.__dict__.get(name)
+#             if component is not None:
+#                 getattr(component, close)()
+        
+#         # 发出所有待发送消息
+#         self.sender.close()
+        
+#         if self.metrics_server:
+#             self.metrics_server.shutdown()
+        
+#         # 写回所有修改过的用户配置
+#         self.config_cache.close()
+        
+#         if self.journal is not None:
+#             self.journal.close()
+        
+#         # 写出剩余日志
+#         stop_logging()
 from pkg.plugin.context import register, handler, llm_func, BasePlugin, APIHost, EventContext
 from pkg.plugin.events import *  # 导入事件类
 
@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from autodl_client import AutoDLClient
+from models import MarketMachine
+
+
+class MarketIndex:
+    """算力市场的本地索引：按GPU型号、地区和价格查询有空闲GPU的机器，后台增量刷新"""
+
+    def __init__(
+        self,
+        client_provider: Callable[[], Optional[AutoDLClient]],
+        refresh_interval: float = 30.0,
+        full_refresh_interval: float = 600.0,
+        page_size: int = 100,
+        max_pages: int = 50,
+        idle_timeout: float = 600.0,
+    ):
+        # refresh_interval: 只拉取有空闲GPU的机器的间隔; full_refresh_interval: 全量拉取的间隔
+        # idle_timeout: 超过该秒数没有查询时停止后台刷新，下次 start 时重新启动
+        self.client_provider = client_provider
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.idle_timeout = idle_timeout
+
+        self._machines: Dict[str, MarketMachine] = {}
+        self._by_gpu: Dict[str, Set[str]] = {}
+        self._by_region: Dict[str, Set[str]] = {}
+        self._idle: Set[str] = set()
+        self._lock = threading.Lock()
+        self.updated_at = 0.0
+        self.full_updated_at = 0.0
+        self.last_query_at = 0.0
+
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 查询 ----
+
+    def find(
+        self,
+        gpu_type: str = "",
+        region: str = "",
+        max_price: Optional[float] = None,
+        min_idle: int = 1,
+        limit: int = 10,
+    ) -> List[MarketMachine]:
+        """按条件查询空闲机器，按价格从低到高排序；型号和地区按子串匹配"""
+        with self._lock:
+            self.last_query_at = time.time()
+            candidates = self._idle if min_idle > 0 else set(self._machines)
+            if gpu_type:
+                candidates = candidates & self._union(self._by_gpu, gpu_type)
+            if region:
+                candidates = candidates & self._union(self._by_region, region)
+            machines = [self._machines[machine_id] for machine_id in candidates]
+
+        machines = [
+            m for m in machines
+            if m.gpu_idle_num >= min_idle and (max_price is None or m.price() <= max_price)
+        ]
+        machines.sort(key=lambda m: (m.payg_price, -m.gpu_idle_num))
+        return machines[:limit]
+
+    def gpu_summary(self) -> Dict[str, int]:
+        """各GPU型号当前的空闲卡数"""
+        with self._lock:
+            self.last_query_at = time.time()
+            summary: Dict[str, int] = {}
+            for machine_id in self._idle:
+                machine = self._machines[machine_id]
+                summary[machine.gpu_name] = summary.get(machine.gpu_name, 0) + machine.gpu_idle_num
+        return summary
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._machines)
+
+    @staticmethod
+    def _union(index: Dict[str, Set[str]], term: str) -> Set[str]:
+        # 键的数量（型号、地区）很少，子串匹配只需遍历键
+        result: Set[str] = set()
+        for key, ids in index.items():
+            if term.lower() in key.lower():
+                result |= ids
+        return result
+
+    # ---- 刷新 ----
+
+    def refresh(self, full: bool = False) -> bool:
+        """拉取市场数据更新索引；非全量时只拉取有空闲GPU的机器"""
+        client = self.client_provider()
+        if client is None:
+            return False
+
+        seen: List[MarketMachine] = []
+        page_index, max_page = 1, 1
+        while page_index <= min(max_page, self.max_pages):
+            page = client.get_market_page(page_index, self.page_size, idle_only=not full)
+            if page is None:
+                return False
+            machines, max_page = page
+            seen.extend(machines)
+            page_index += 1
+
+        with self._lock:
+            for machine in seen:
+                self._upsert(machine)
+
+            # 本次没有出现在空闲列表中的机器已无空闲GPU
+            seen_ids = {m.machine_id for m in seen}
+            for machine_id in self._idle - seen_ids:
+                self._machines[machine_id].gpu_idle_num = 0
+            self._idle = {m.machine_id for m in seen if m.gpu_idle_num > 0}
+
+            if full:
+                # 全量列表中不存在的机器已下架
+                for machine_id in set(self._machines) - seen_ids:
+                    self._remove(machine_id)
+                self.full_updated_at = time.time()
+            self.updated_at = time.time()
+        return True
+
+    def _upsert(self, machine: MarketMachine) -> None:
+        previous = self._machines.get(machine.machine_id)
+        if previous is not None and (previous.gpu_name, previous.region_name) != (machine.gpu_name, machine.region_name):
+            self._remove(machine.machine_id)
+        self._machines[machine.machine_id] = machine
+        self._by_gpu.setdefault(machine.gpu_name, set()).add(machine.machine_id)
+        self._by_region.setdefault(machine.region_name, set()).add(machine.machine_id)
+
+    def _remove(self, machine_id: str) -> None:
+        machine = self._machines.pop(machine_id, None)
+        if machine is None:
+            return
+        self._idle.discard(machine_id)
+        for index, key in ((self._by_gpu, machine.gpu_name), (self._by_region, machine.region_name)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(machine_id)
+                if not ids:
+                    del index[key]
+
+    def start(self) -> None:
+        """启动后台刷新线程（重复调用无副作用），空闲停止后再次调用会重新启动"""
+        with self._lock:
+            self.last_query_at = time.time()
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="market-index", daemon=True)
+            self._thread.start()
+
+    def request_refresh(self) -> None:
+        """尽快执行一次刷新"""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                if time.time() - self.last_query_at >= self.idle_timeout:
+                    # 一段时间没有 /market 查询，停止刷新，不再占用账号的请求
+                    self._thread = None
+                    return
+            full = time.time() - self.full_updated_at >= self.full_refresh_interval
+            try:
+                self.refresh(full=full)
+            except Exception as e:
+                logging.error(f"刷新算力市场索引出错: {str(e)}")
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
@@ -0,0 +1,235 @@
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from ratelimit import TokenBucket
+
+# 单条消息的平台长度上限（字符）
+DEFAULT_MAX_LENGTH = 2000
+
+
+def split_message(text: str, max_length: int = DEFAULT_MAX_LENGTH) -> List[str]:
+    """按平台长度上限切分消息，优先在换行处切分"""
+    if len(text) <= max_length:
+        return [text]
+
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        # 单行超长时强制按长度切分
+        while len(line) > max_length:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_length])
+            line = line[max_length:]
+
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > max_length:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class _PendingMessage:
+    def __init__(self, text: str, key: Optional[str], count: int = 1, summary: bool = False):
+        self.text = text
+        self.key = key
+        self.count = count
+        # 去重窗口结束时补发的汇总，count 为窗口内被合并的条数
+        self.summary = summary
+
+    def render(self) -> str:
+        if self.summary:
+            return f"{self.text} (另有{self.count}条相同通知已合并)"
+        if self.count > 1:
+            return f"{self.text} (共{self.count}次)"
+        return self.text
+
+
+class _Outbox:
+    def __init__(self, respond: Callable[[str], None], bucket: TokenBucket):
+        self.respond = respond
+        self.bucket = bucket
+        self.pending: List[_PendingMessage] = []
+        self.chunks: Deque[str] = deque()
+        self.first_at = 0.0
+        # 去重键 -> 最近一次发出的时间 / 发出后被合并的 (次数, 最新内容)
+        self.last_sent: Dict[str, float] = {}
+        self.suppressed: Dict[str, Tuple[int, str]] = {}
+
+    def find(self, key: str) -> Optional[_PendingMessage]:
+        for item in self.pending:
+            if item.key == key:
+                return item
+        return None
+
+    def is_idle(self, now: float, dedup_window: float) -> bool:
+        if self.pending or self.chunks or self.suppressed:
+            return False
+        return all(now - ts >= dedup_window for ts in self.last_sent.values())
+
+
+# 发送目标：None 表示与用户的私聊，群聊等其他会话由调用方给出可哈希的标识
+Target = Optional[Hashable]
+
+
+class MessageSender:
+    """出站消息层：按用户和会话合并短时间内的消息，并按用户和全局速率限流发送"""
+
+    def __init__(
+        self,
+        merge_window: float = 1.5,
+        max_length: int = DEFAULT_MAX_LENGTH,
+        user_rate: float = 0.5,
+        user_burst: int = 3,
+        global_rate: float = 10.0,
+        global_burst: int = 20,
+        dedup_window: float = 60.0,
+        tick: float = 0.2,
+    ):
+        self.merge_window = merge_window
+        self.max_length = max_length
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.dedup_window = dedup_window
+        self.tick = tick
+
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        # 不同会话的消息不合并，避免私聊通知被发到群里
+        self._outboxes: Dict[Tuple[int, Target], _Outbox] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def send(
+        self,
+        user_id: int,
+        respond: Callable[[str], None],
+        text: str,
+        dedup_key: Optional[str] = None,
+        target: Target = None,
+    ) -> None:
+        """提交一条消息；相同dedup_key的消息在窗口内会被合并计数"""
+        self._enqueue(user_id, target, respond, text, dedup_key, replace=False)
+
+    def progress(
+        self,
+        user_id: int,
+        respond: Callable[[str], None],
+        key: str,
+        text: str,
+        target: Target = None,
+    ) -> None:
+        """提交进度消息；同一key只发送窗口内最新的一条"""
+        self._enqueue(user_id, target, respond, text, key, replace=True)
+
+    def _enqueue(
+        self,
+        user_id: int,
+        target: Target,
+        respond: Callable[[str], None],
+        text: str,
+        key: Optional[str],
+        replace: bool,
+    ) -> None:
+        now = time.monotonic()
+        with self._lock:
+            outbox = self._outboxes.get((user_id, target))
+            if outbox is None:
+                outbox = _Outbox(respond, TokenBucket(self.user_rate, self.user_burst))
+                self._outboxes[(user_id, target)] = outbox
+            # 同一会话的回复函数可能来自不同的消息对象，发送到的是同一处
+            outbox.respond = respond
+
+            if key is not None:
+                existing = outbox.find(key)
+                if existing is not None:
+                    existing.text = text
+                    if not replace:
+                        existing.count += 1
+                    return
+
+                # 刚发出过的重复通知只计数，合并到下一次发送中
+                if not replace and now - outbox.last_sent.get(key, float("-inf")) < self.dedup_window:
+                    count = outbox.suppressed.get(key, (0, text))[0]
+                    outbox.suppressed[key] = (count + 1, text)
+                    return
+
+            count = 1 + outbox.suppressed.pop(key, (0, text))[0] if key is not None else 1
+            if not outbox.pending:
+                outbox.first_at = now
+            outbox.pending.append(_PendingMessage(text, key, count))
+
+        self._ensure_thread()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="message-sender", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.flush()
+            self._stop.wait(self.tick)
+
+    def flush(self, force: bool = False) -> None:
+        """发送已到期的消息；force为True时忽略合并窗口和限流"""
+        now = time.monotonic()
+        deliveries: List[Tuple[Callable[[str], None], str]] = []
+
+        with self._lock:
+            for outbox_key, outbox in list(self._outboxes.items()):
+                # 去重窗口结束后补发被合并的通知汇总
+                for key, (count, text) in list(outbox.suppressed.items()):
+                    if force or now - outbox.last_sent.get(key, float("-inf")) >= self.dedup_window:
+                        del outbox.suppressed[key]
+                        if not outbox.pending:
+                            outbox.first_at = now
+                        outbox.pending.append(_PendingMessage(text, key, count, summary=True))
+
+                if outbox.pending and (force or now - outbox.first_at >= self.merge_window):
+                    text = "\n".join(item.render() for item in outbox.pending)
+                    for item in outbox.pending:
+                        if item.key is not None:
+                            outbox.last_sent[item.key] = now
+                    outbox.pending = []
+                    outbox.chunks.extend(split_message(text, self.max_length))
+
+                while outbox.chunks:
+                    if not force:
+                        if outbox.bucket.wait_time() > 0:
+                            break
+                        if not self._global_bucket.try_acquire():
+                            break
+                        outbox.bucket.try_acquire()
+                    deliveries.append((outbox.respond, outbox.chunks.popleft()))
+
+                if outbox.is_idle(now, self.dedup_window):
+                    del self._outboxes[outbox_key]
+
+        for respond, chunk in deliveries:
+            try:
+                respond(chunk)
+            except Exception as e:
+                logging.error(f"发送消息出错: {str(e)}")
+
+    def close(self) -> None:
+        """停止后台发送线程并发出所有剩余消息"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self.flush(force=True)
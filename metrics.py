@@ -0,0 +1,349 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 默认延迟分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+class _ShardedMetric(ABC):
+    """按线程分片聚合的指标基类，热路径上不加锁"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                # 注册新分片时顺带折叠已结束线程的分片，线程频繁新建时列表不会无限增长
+                self._prune_locked()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _prune_locked(self) -> None:
+        """把已结束线程的分片折叠进retired（调用方持有锁）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for labels, value in list(shard.items()):
+                    self._merge_value(self._retired, labels, value)
+        self._shards = alive
+
+    @abstractmethod
+    def _merge_value(self, target: dict, labels: Labels, value) -> None:
+        """把一个分片中的值合并进target"""
+
+    def collect(self) -> dict:
+        """合并所有线程分片，已结束线程的分片折叠进retired"""
+        with self._lock:
+            self._prune_locked()
+
+            merged: dict = {}
+            for labels, value in self._retired.items():
+                self._merge_value(merged, labels, value)
+            for _, shard in self._shards:
+                for labels, value in list(shard.items()):
+                    self._merge_value(merged, labels, value)
+            return merged
+
+
+class Counter(_ShardedMetric):
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge_value(self, target: dict, labels: Labels, value) -> None:
+        target[labels] = target.get(labels, 0) + value
+
+
+class Histogram(_ShardedMetric):
+    """分桶直方图"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # [各分桶计数..., +Inf计数, 总和]
+            entry = [0] * (len(self.buckets) + 1) + [0.0]
+            shard[labels] = entry
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        entry[index] += 1
+        entry[-1] += value
+
+    def _merge_value(self, target: dict, labels: Labels, value) -> None:
+        entry = target.get(labels)
+        if entry is None:
+            target[labels] = list(value)
+        else:
+            for i, v in enumerate(value):
+                entry[i] += v
+
+    def quantile(self, q: float, entry: List[float]) -> float:
+        """根据分桶估算分位数（线性插值）"""
+        counts = entry[:-1]
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+
+class Gauge:
+    """可增减的瞬时值，写入频率低，直接加锁"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def collect(self) -> Dict[Labels, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+def _format_labels(names: Tuple[str, ...], values: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render_prometheus(self) -> str:
+        """输出Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            values = metric.collect()
+            for labels, value in sorted(values.items()):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for i, bound in enumerate(metric.buckets):
+                        cumulative += value[i]
+                        le = _format_labels(metric.labelnames, labels, ("le", repr(bound)))
+                        lines.append(f"{metric.name}_bucket{le} {cumulative}")
+                    cumulative += value[len(metric.buckets)]
+                    le = _format_labels(metric.labelnames, labels, ("le", "+Inf"))
+                    lines.append(f"{metric.name}_bucket{le} {cumulative}")
+                    label_str = _format_labels(metric.labelnames, labels)
+                    lines.append(f"{metric.name}_sum{label_str} {value[-1]}")
+                    lines.append(f"{metric.name}_count{label_str} {cumulative}")
+                else:
+                    label_str = _format_labels(metric.labelnames, labels)
+                    lines.append(f"{metric.name}{label_str} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# AutoDL接口指标
+REQUESTS_TOTAL = REGISTRY.counter(
+    "autodl_requests_total", "AutoDL接口请求次数", ("endpoint", "outcome"))
+REQUEST_LATENCY = REGISTRY.histogram(
+    "autodl_request_latency_seconds", "AutoDL接口请求耗时", ("endpoint", "outcome"))
+LOGINS_TOTAL = REGISTRY.counter(
+    "autodl_logins_total", "登录次数", ("result",))
+HTTP_CONNECTIONS_TOTAL = REGISTRY.counter(
+    "autodl_http_connections_total", "请求使用的连接（新建或复用）", ("transport", "event"))
+DNS_LOOKUPS_TOTAL = REGISTRY.counter(
+    "autodl_dns_lookups_total", "DNS缓存查询结果", ("result",))
+
+# 抢卡指标
+GRAB_JOBS_RUNNING = REGISTRY.gauge(
+    "autodl_grab_jobs_running", "正在运行的抢卡任务数")
+GRAB_POLLS_TOTAL = REGISTRY.counter(
+    "autodl_grab_polls_total", "抢卡轮询次数", ("outcome",))
+GRAB_POWER_ON_TOTAL = REGISTRY.counter(
+    "autodl_grab_power_on_total", "抢卡启动实例次数", ("result",))
+GRAB_DETECT_TO_POWER_ON = REGISTRY.histogram(
+    "autodl_grab_detect_to_power_on_seconds", "从发现空闲GPU到启动成功的耗时")
+GRAB_TICK_LATENCY = REGISTRY.histogram(
+    "autodl_grab_tick_seconds", "单次抢卡轮询耗时")
+GRAB_POLL_TIER_TOTAL = REGISTRY.counter(
+    "autodl_grab_poll_tier_total", "各轮询档位下的轮询次数", ("tier",))
+GRAB_SCHEDULER_WAIT = REGISTRY.histogram(
+    "autodl_grab_scheduler_wait_seconds", "抢卡轮询等待请求预算的耗时", ("tier",))
+GRAB_WATCHDOG_TOTAL = REGISTRY.counter(
+    "autodl_grab_watchdog_total", "看门狗处理的异常任务次数", ("reason",))
+
+
+def format_stats(registry: MetricsRegistry = REGISTRY) -> str:
+    """生成 /autodlstats 的文本摘要"""
+    uptime = int(time.time() - registry.started_at)
+    lines = [f"AutoDL统计 (运行 {uptime // 3600}小时{uptime % 3600 // 60}分钟)", ""]
+
+    running = GRAB_JOBS_RUNNING.collect().get((), 0)
+    polls = sum(GRAB_POLLS_TOTAL.collect().values())
+    power_on = GRAB_POWER_ON_TOTAL.collect()
+    logins = LOGINS_TOTAL.collect()
+    lines.append(f"抢卡任务: {int(running)} 个运行中, 累计轮询 {int(polls)} 次")
+    lines.append(f"抢卡启动: 成功 {int(power_on.get(('success',), 0))} 次, 失败 {int(power_on.get(('failure',), 0))} 次")
+    lines.append(f"登录: 成功 {int(logins.get(('success',), 0))} 次, 失败 {int(logins.get(('failure',), 0))} 次")
+
+    opened = reused = 0
+    for (_, event), value in HTTP_CONNECTIONS_TOTAL.collect().items():
+        if event == "opened":
+            opened += value
+        else:
+            reused += value
+    if opened + reused:
+        lines.append(f"HTTP连接: 新建 {int(opened)} 次, 复用 {int(reused)} 次 (复用率 {reused / (opened + reused):.0%})")
+    dns = DNS_LOOKUPS_TOTAL.collect()
+    if dns:
+        lines.append(f"DNS缓存: 命中 {int(dns.get(('hit',), 0))} 次, 未命中 {int(dns.get(('miss',), 0))} 次")
+
+    detect = GRAB_DETECT_TO_POWER_ON.collect().get(())
+    if detect:
+        p50 = GRAB_DETECT_TO_POWER_ON.quantile(0.5, detect) * 1000
+        p95 = GRAB_DETECT_TO_POWER_ON.quantile(0.95, detect) * 1000
+        lines.append(f"发现到启动耗时: p50 {p50:.0f}ms, p95 {p95:.0f}ms")
+
+    # 按接口汇总
+    per_endpoint: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for (endpoint, outcome), entry in REQUEST_LATENCY.collect().items():
+        merged = per_endpoint.get(endpoint)
+        if merged is None:
+            per_endpoint[endpoint] = list(entry)
+        else:
+            for i, v in enumerate(entry):
+                merged[i] += v
+        if outcome != "Success":
+            errors[endpoint] = errors.get(endpoint, 0) + int(sum(entry[:-1]))
+
+    if per_endpoint:
+        lines.append("")
+        lines.append("接口延迟:")
+        for endpoint, entry in sorted(per_endpoint.items()):
+            count = int(sum(entry[:-1]))
+            p50 = REQUEST_LATENCY.quantile(0.5, entry) * 1000
+            p95 = REQUEST_LATENCY.quantile(0.95, entry) * 1000
+            lines.append(f"{endpoint}: {count}次 (失败{errors.get(endpoint, 0)}) p50 {p50:.0f}ms p95 {p95:.0f}ms")
+
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """在后台线程启动 /metrics 端点；默认只监听本机，需要远程抓取时显式指定 host"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server
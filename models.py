@@ -1,6 +1,10 @@
+from functools import lru_cache
 from typing import List, Optional
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+# 实例关机后保留的时长，超过后释放
+RELEASE_AFTER = timedelta(hours=24)
 
 # AutoDL接口数据模型
 class LoginRequest(BaseModel):
@@ -18,12 +22,70 @@ class Instance(BaseModel):
     uuid: str
     snapshot_gpu_alias_name: str
     stopped_at: Optional[dict] = None
+    status: str = ""
+    
+    def release_at(self) -> Optional[datetime]:
+        """关机实例的释放时间（UTC），无法计算时返回None"""
+        stop_time = self.stopped_at.get("time") if self.stopped_at else None
+        if not stop_time or not isinstance(stop_time, str):
+            return None
+        return _release_time(stop_time)
+
+# 同一关机时间在多次查询间重复出现，缓存解析结果
+@lru_cache(maxsize=4096)
+def _release_time(stop_time: str) -> Optional[datetime]:
+    try:
+        stop_datetime = datetime.fromisoformat(stop_time.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+    if stop_datetime.tzinfo is None:
+        stop_datetime = stop_datetime.replace(tzinfo=timezone.utc)
+    return stop_datetime + RELEASE_AFTER
+
+# 算力市场中的机器（/user/machine/list），只保留建立索引需要的字段
+class MarketMachine(BaseModel):
+    machine_id: str
+    machine_alias: str = ""
+    region_name: str = ""
+    region_sign: str = ""
+    gpu_name: str = ""
+    gpu_number: int = 0
+    gpu_idle_num: int = 0
+    # 按量计费价格，接口单位为0.001元/卡/小时
+    payg_price: int = 0
+    
+    def price(self) -> float:
+        """每卡每小时价格（元）"""
+        return self.payg_price / 1000
+
+# 批量开关机的单实例结果
+class PowerResult(BaseModel):
+    uuid: str
+    success: bool
+    elapsed_ms: float
+    error: str = ""
+
+# 附加的AutoDL账号
+class Account(BaseModel):
+    name: str
+    username: str
+    password: str
 
 # 用户配置模型
 class AutoDLConfig(BaseModel):
     username: str = ""
     password: str = ""
     grab_config: Optional["GrabConfig"] = None
+    auto_refresh: bool = False
+    accounts: List[Account] = []
+    
+    def all_accounts(self) -> List[Account]:
+        """主账号（如已设置）在前，其后为附加账号"""
+        accounts = []
+        if self.username and self.password:
+            accounts.append(Account(name="默认", username=self.username, password=self.password))
+        accounts.extend(self.accounts)
+        return accounts
 
 # 抢卡配置模型
 class GrabConfig(BaseModel):
@@ -32,6 +94,13 @@ class GrabConfig(BaseModel):
     instance_uuid: str = ""
     check_interval: int = 5
     is_running: bool = False
+    # 余额低于该值（元）时不开机，0表示不检查
+    min_balance: float = 0
+    # 共享请求预算紧张时的优先级档位（见 fair_scheduler.TIERS）和每分钟保底轮询次数
+    priority: str = "normal"
+    min_polls_per_minute: float = 0
+    # 容量变化后加快轮询、平静后逐级回落到 check_interval（见 grab.PollTempo），关闭后固定按 check_interval 轮询
+    adaptive_interval: bool = True
 
 # 抢卡菜单数据
 class GrabMenuData(BaseModel):
@@ -0,0 +1,84 @@
+import json
+import logging
+import queue
+import threading
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+
+class Notifier(ABC):
+    """抢卡结果通知接口"""
+
+    @abstractmethod
+    def notify(self, user_id: int, message: str, dedup_key: Optional[str] = None) -> None:
+        """向用户发送一条通知"""
+
+    def close(self) -> None:
+        pass
+
+
+class LogNotifier(Notifier):
+    """只写日志，适合无聊天前端的部署"""
+
+    def notify(self, user_id: int, message: str, dedup_key: Optional[str] = None) -> None:
+        logging.info(message, extra={"user_id": user_id})
+
+
+class CallbackNotifier(Notifier):
+    """把通知转交给回调函数，例如插件的 _respond"""
+
+    def __init__(self, callback: Callable[[int, str, Optional[str]], None]):
+        self.callback = callback
+
+    def notify(self, user_id: int, message: str, dedup_key: Optional[str] = None) -> None:
+        self.callback(user_id, message, dedup_key)
+
+
+class WebhookNotifier(Notifier):
+    """以JSON POST到webhook，由聊天前端负责投递给用户"""
+
+    def __init__(self, url: str, timeout: float = 5.0, max_pending: int = 1000):
+        # max_pending: 待发送通知上限，超出时丢弃新通知
+        self.url = url
+        self.timeout = timeout
+        self.dropped = 0
+        # 由单个后台线程依次发送，避免阻塞抢卡循环，突发大量通知时也不会无限新建线程
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="webhook-notifier", daemon=True)
+        self._thread.start()
+
+    def notify(self, user_id: int, message: str, dedup_key: Optional[str] = None) -> None:
+        payload = {"user_id": user_id, "message": message, "dedup_key": dedup_key}
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            self.dropped += 1
+            logging.warning("webhook通知队列已满，丢弃通知", extra={"user_id": user_id})
+
+    def close(self) -> None:
+        """发送完已排队的通知后停止后台线程"""
+        try:
+            self._queue.put(None, timeout=self.timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout=self.timeout)
+
+    def _run(self) -> None:
+        while True:
+            payload = self._queue.get()
+            if payload is None:
+                return
+            self._post(payload)
+
+    def _post(self, payload: dict) -> None:
+        try:
+            request = urllib.request.Request(
+                self.url,
+                data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                headers={"content-type": "application/json;charset=UTF-8"},
+                method="POST",
+            )
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except Exception as e:
+            logging.error(f"发送webhook通知出错: {str(e)}", extra={"user_id": payload["user_id"]})
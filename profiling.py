@@ -0,0 +1,190 @@
+import cProfile
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class _SpanState(threading.local):
+    def __init__(self):
+        self.user_id: Optional[int] = None
+        self.command: Optional[str] = None
+        self.stack: List[str] = []
+        self.depth = 0
+        self.child_time = 0.0
+        # 每个根span开始时决定是否采样
+        self.sampled = False
+
+
+class Profiler:
+    """可由管理员开关的调用追踪：采样记录span耗时，记录慢调用，按用户或命令抓取cProfile"""
+
+    def __init__(self, output_dir: str = "profiles"):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.threshold_ms = 500.0
+        self.target_user: Optional[int] = None
+        self.target_command: Optional[str] = None
+        self.output_dir = output_dir
+
+        self._state = _SpanState()
+        self._lock = threading.Lock()
+        # 折叠栈格式（flamegraph.pl / speedscope 可直接读取）: "a;b;c" -> 自身耗时(微秒)
+        self._folded: Dict[str, int] = {}
+
+    def configure(
+        self,
+        enabled: Optional[bool] = None,
+        sample_rate: Optional[float] = None,
+        threshold_ms: Optional[float] = None,
+        target_user: Optional[int] = None,
+        target_command: Optional[str] = None,
+    ) -> None:
+        """运行时修改配置，无需重启"""
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        if target_user is not None:
+            self.target_user = target_user or None
+        if target_command is not None:
+            self.target_command = target_command or None
+
+    def status(self) -> str:
+        """当前配置描述"""
+        if not self.enabled:
+            return "性能追踪: 已关闭"
+        lines = [
+            "性能追踪: 已开启",
+            f"采样率: {self.sample_rate:.0%}",
+            f"慢调用阈值: {self.threshold_ms:.0f}ms",
+        ]
+        if self.target_user:
+            lines.append(f"cProfile目标用户: {self.target_user}")
+        if self.target_command:
+            lines.append(f"cProfile目标命令: {self.target_command}")
+        lines.append(f"已记录调用栈: {len(self._folded)} 条")
+        return "\n".join(lines)
+
+    @contextmanager
+    def context(self, user_id: Optional[int] = None, command: Optional[str] = None) -> Iterator[None]:
+        """标记当前线程正在处理的用户和命令；命中目标时对整个处理过程抓取cProfile"""
+        state = self._state
+        prev_user, prev_command = state.user_id, state.command
+        state.user_id, state.command = user_id, command
+
+        profile = None
+        if self.enabled and self._is_target(user_id, command):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # 其他线程已启用了profiler
+                profile = None
+
+        try:
+            with self.span(f"handler:{command}" if command else "task"):
+                yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._dump_profile(profile, user_id, command)
+            state.user_id, state.command = prev_user, prev_command
+
+    def _is_target(self, user_id: Optional[int], command: Optional[str]) -> bool:
+        if not self.target_user and not self.target_command:
+            return False
+        if self.target_user and user_id != self.target_user:
+            return False
+        if self.target_command and command != self.target_command:
+            return False
+        return True
+
+    def _dump_profile(self, profile: cProfile.Profile, user_id: Optional[int], command: Optional[str]) -> None:
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            name = f"{(command or 'task').lstrip('/')}_{user_id}_{int(time.time() * 1000)}.prof"
+            path = os.path.join(self.output_dir, name)
+            profile.dump_stats(path)
+            logging.info(f"cProfile已保存: {path}")
+        except Exception as e:
+            logging.error(f"保存cProfile出错: {str(e)}")
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """记录一段调用的耗时"""
+        if not self.enabled:
+            yield
+            return
+
+        state = self._state
+        if state.depth == 0:
+            state.sampled = random.random() < self.sample_rate
+        state.depth += 1
+        if not state.sampled:
+            try:
+                yield
+            finally:
+                state.depth -= 1
+            return
+
+        state.stack.append(name)
+        child_before = state.child_time
+        state.child_time = 0.0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self_time = elapsed - state.child_time
+            path = ";".join(state.stack)
+            state.stack.pop()
+            state.depth -= 1
+            state.child_time = child_before + elapsed
+
+            with self._lock:
+                self._folded[path] = self._folded.get(path, 0) + int(self_time * 1_000_000)
+
+            elapsed_ms = elapsed * 1000
+            if elapsed_ms >= self.threshold_ms:
+                logging.warning(
+                    f"慢调用 {path}: {elapsed_ms:.1f}ms (用户 {state.user_id}, 命令 {state.command})"
+                )
+
+    def dump_folded(self, path: Optional[str] = None) -> str:
+        """导出折叠栈文件并清空已记录数据，返回文件路径"""
+        with self._lock:
+            folded, self._folded = self._folded, {}
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = path or os.path.join(self.output_dir, f"spans_{int(time.time())}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, micros in sorted(folded.items()):
+                f.write(f"{stack} {micros}\n")
+        return path
+
+
+PROFILER = Profiler()
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """装饰器：将函数调用记录为span，关闭追踪时几乎无开销"""
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,59 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """令牌桶限流器（线程安全）"""
+
+    def __init__(self, rate: float, capacity: float):
+        # rate: 每秒补充的令牌数, capacity: 桶容量（允许的突发量）
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """尝试取出令牌，不阻塞"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """距离可取出令牌还需等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                return 0.0
+            if self.rate <= 0:
+                return float("inf")
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """阻塞取出令牌，超时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            wait = self.wait_time(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(max(wait, 0.001))
+
+    def refund(self, tokens: float = 1) -> None:
+        """退还未使用的令牌"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
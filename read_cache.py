@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Flight:
+    """正在进行的一次加载，其他相同请求等待其结果"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ReadCache:
+    """查询结果的短时缓存：新鲜期内直接返回，相同请求并发时只向上游请求一次"""
+
+    def __init__(self, ttl: float = 5.0, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # 键为元组，第一项通常是账号，便于按账号失效
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._flights: Dict[Tuple, _Flight] = {}
+        # 每次失效递增，加载期间发生失效时结果不写入缓存
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        key: Tuple[Hashable, ...],
+        loader: Callable[[], Any],
+        cache_if: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """读取缓存，未命中时调用loader；cache_if返回False的结果（如查询失败）不缓存"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                leader = False
+                self.hits += 1
+            else:
+                leader = True
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if (
+                    flight.error is None
+                    and generation == self._generation
+                    and (cache_if is None or cache_if(flight.result))
+                ):
+                    self._entries[key] = (time.monotonic(), flight.result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self, *prefix: Hashable) -> None:
+        """删除以prefix开头的所有键，不提供prefix时清空"""
+        with self._lock:
+            self._generation += 1
+            n = len(prefix)
+            for key in [k for k in self._entries if k[:n] == prefix]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
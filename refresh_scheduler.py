@@ -0,0 +1,240 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from autodl_client import AutoDLClient
+from models import Instance
+from notifier import Notifier
+from ratelimit import TokenBucket
+
+# 任务类型
+_REFRESH = "refresh"
+_RESCAN = "rescan"
+
+
+class RefreshScheduler:
+    """维护所有用户关机实例的释放时间堆，只在释放前的安全窗口内刷新即将到期的实例"""
+
+    def __init__(
+        self,
+        client_factory: Callable[[int], Dict[str, AutoDLClient]],
+        notifier: Optional[Notifier] = None,
+        margin: float = 2 * 3600,
+        rescan_interval: float = 6 * 3600,
+        retry_delay: float = 300,
+        boot_wait: float = 5,
+        rate: float = 0.2,
+        burst: int = 3,
+        workers: int = 4,
+    ):
+        # client_factory: 用户ID -> 该用户所有账号的 {用户名: 客户端}
+        # margin: 距释放还剩多少秒时刷新; rescan_interval: 定期重新拉取实例列表的间隔
+        self.client_factory = client_factory
+        self.notifier = notifier
+        self.margin = margin
+        self.rescan_interval = rescan_interval
+        self.retry_delay = retry_delay
+        self.boot_wait = boot_wait
+        self.bucket = TokenBucket(rate, burst)
+
+        # (执行时间, 序号, 类型, 用户ID, 实例UUID)
+        self._heap: List[Tuple[float, int, str, int, str]] = []
+        # 每个键当前有效的执行时间，堆中与之不符的条目视为已作废
+        self._due: Dict[Tuple[str, int, str], float] = {}
+        self._deadlines: Dict[Tuple[int, str], float] = {}
+        # (用户ID, 实例UUID) -> 实例所属账号的用户名
+        self._owners: Dict[Tuple[int, str], str] = {}
+        self._users: set = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refresh")
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 跟踪的用户与实例 ----
+
+    def add_user(self, user_id: int) -> None:
+        """开始为用户自动刷新，在后台拉取所有账号的实例列表"""
+        with self._cond:
+            self._users.add(user_id)
+        self._push(_RESCAN, user_id, "", time.time())
+
+    def remove_user(self, user_id: int) -> None:
+        with self._cond:
+            self._users.discard(user_id)
+            for key in [k for k in self._due if k[1] == user_id]:
+                del self._due[key]
+            for key in [k for k in self._deadlines if k[0] == user_id]:
+                del self._deadlines[key]
+                self._owners.pop(key, None)
+            self._cond.notify()
+
+    def track(self, user_id: int, instances: List[Instance], account: str) -> None:
+        """用某个账号最新的实例列表更新用户的释放时间（可由查询类命令顺带调用）"""
+        with self._cond:
+            if user_id not in self._users:
+                return
+            now = time.time()
+            seen = set()
+            for instance in instances:
+                release_at = instance.release_at()
+                if release_at is None:
+                    continue
+                seen.add(instance.uuid)
+                deadline = release_at.timestamp()
+                self._deadlines[(user_id, instance.uuid)] = deadline
+                self._owners[(user_id, instance.uuid)] = account
+                due = deadline - self.margin
+                existing = self._due.get((_REFRESH, user_id, instance.uuid))
+                if due <= now and existing is not None and existing > now:
+                    # 已安排重试或刚刷新过（列表中的关机时间可能尚未更新），保留原计划
+                    continue
+                self._push_locked(_REFRESH, user_id, instance.uuid, due)
+
+            # 该账号已开机或已释放的实例不再跟踪
+            for key in [k for k in self._deadlines if k[0] == user_id and k[1] not in seen
+                        and self._owners.get(k) == account]:
+                self._untrack_locked(key)
+
+            self._push_locked(_RESCAN, user_id, "", time.time() + self.rescan_interval)
+
+    def _forget_accounts(self, user_id: int, accounts: Set[str]) -> None:
+        """不再跟踪已删除账号的实例"""
+        with self._cond:
+            for key in [k for k, owner in self._owners.items() if k[0] == user_id and owner not in accounts]:
+                self._untrack_locked(key)
+
+    def _untrack_locked(self, key: Tuple[int, str]) -> None:
+        self._deadlines.pop(key, None)
+        self._owners.pop(key, None)
+        self._due.pop((_REFRESH, key[0], key[1]), None)
+
+    def pending(self, user_id: int) -> List[Tuple[str, float]]:
+        """用户被跟踪实例的 (UUID, 释放时间戳)，按时间排序"""
+        with self._cond:
+            items = [(uuid, deadline) for (uid, uuid), deadline in self._deadlines.items() if uid == user_id]
+        return sorted(items, key=lambda item: item[1])
+
+    # ---- 调度 ----
+
+    def _push(self, kind: str, user_id: int, uuid: str, due: float) -> None:
+        with self._cond:
+            self._push_locked(kind, user_id, uuid, due)
+
+    def _push_locked(self, kind: str, user_id: int, uuid: str, due: float) -> None:
+        if user_id not in self._users:
+            return
+        key = (kind, user_id, uuid)
+        if self._due.get(key) == due:
+            return
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), kind, user_id, uuid))
+        self._cond.notify()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="refresh-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._executor.shutdown(wait=False)
+
+    def _next_due(self) -> Optional[Tuple[str, int, str]]:
+        """等待并取出下一个到期任务"""
+        with self._cond:
+            while not self._stop.is_set():
+                # 丢弃已作废的条目
+                while self._heap:
+                    due, _, kind, user_id, uuid = self._heap[0]
+                    if self._due.get((kind, user_id, uuid)) == due:
+                        break
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                due, _, kind, user_id, uuid = self._heap[0]
+                wait = due - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                heapq.heappop(self._heap)
+                del self._due[(kind, user_id, uuid)]
+                return kind, user_id, uuid
+        return None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            task = self._next_due()
+            if task is None:
+                return
+            # 全局限流，避免刷新流量集中爆发
+            while not self._stop.is_set() and not self.bucket.acquire(timeout=1.0):
+                pass
+            self._executor.submit(self._execute, *task)
+
+    def _execute(self, kind: str, user_id: int, uuid: str) -> None:
+        try:
+            clients = self.client_factory(user_id)
+            if not clients:
+                self.remove_user(user_id)
+                return
+            self._forget_accounts(user_id, set(clients))
+
+            if kind == _REFRESH:
+                with self._cond:
+                    client = clients.get(self._owners.get((user_id, uuid), ""))
+                if client is not None:
+                    self._refresh(client, user_id, uuid)
+
+            # 重新拉取所有账号的实例列表（get_instances 会翻完所有页）
+            failed = False
+            for account, client in clients.items():
+                instances = client.get_instances()
+                if instances is None:
+                    failed = True
+                else:
+                    # 空列表说明该账号的实例都已释放，也要清掉旧的释放时间
+                    self.track(user_id, instances, account)
+            if failed:
+                self._push(_RESCAN, user_id, "", time.time() + self.retry_delay)
+        except Exception as e:
+            logging.error(f"自动刷新出错: {str(e)}", extra={"user_id": user_id, "uuid": uuid})
+            self._push(_RESCAN, user_id, "", time.time() + self.retry_delay)
+
+    def _refresh(self, client: AutoDLClient, user_id: int, uuid: str) -> None:
+        # 无卡模式开机后立即关机，重置释放时间
+        if not client.power_on(uuid, use_cpu=True):
+            self._notify(user_id, f"自动刷新实例 {uuid} 失败: 启动失败，稍后重试", f"auto_refresh_fail:{uuid}")
+            with self._cond:
+                deadline = self._deadlines.get((user_id, uuid))
+            if deadline is not None and time.time() + self.retry_delay < deadline:
+                self._push(_REFRESH, user_id, uuid, time.time() + self.retry_delay)
+            return
+
+        time.sleep(self.boot_wait)
+
+        if not client.power_off(uuid):
+            self._notify(user_id, f"自动刷新实例 {uuid} 后关机失败，请手动关闭", f"auto_refresh_off:{uuid}")
+            return
+
+        # 防止接口返回旧的关机时间导致立即重复刷新
+        self._push(_REFRESH, user_id, uuid, time.time() + self.retry_delay)
+        logging.info("自动刷新实例时长成功", extra={"user_id": user_id, "uuid": uuid})
+        self._notify(user_id, f"实例 {uuid} 即将释放，已自动刷新时长")
+
+    def _notify(self, user_id: int, message: str, dedup_key: Optional[str] = None) -> None:
+        if self.notifier is not None:
+            self.notifier.notify(user_id, message, dedup_key)
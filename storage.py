@@ -1,9 +1,19 @@
 import os
 import json
+import logging
 import sqlite3
-from typing import Dict, Any, Optional
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
 
-from models import AutoDLConfig
+from profiling import traced
+
+if TYPE_CHECKING:
+    # 只用于类型注解，实际在解析或创建配置时才导入（避免启动时加载pydantic）
+    from models import AutoDLConfig
+
+def _flags(config: "AutoDLConfig") -> tuple:
+    """配置中需要建索引的状态：(抢卡任务运行中, 自动刷新时长)"""
+    grab_running = bool(config.grab_config and config.grab_config.is_running)
+    return int(grab_running), int(bool(config.auto_refresh))
 
 class UserStorage:
     def __init__(self, db_path: str = "users.db"):
@@ -21,14 +31,30 @@ class UserStorage:
             user_id INTEGER PRIMARY KEY,
             username TEXT,
             password TEXT,
-            config TEXT
+            config TEXT,
+            grab_running INTEGER NOT NULL DEFAULT 0,
+            auto_refresh INTEGER NOT NULL DEFAULT 0
         )
         ''')
         
+        # 旧数据库补充状态列，并按配置内容回填一次
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+        if "grab_running" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN grab_running INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("UPDATE users SET grab_running = 1 WHERE config LIKE '%\"is_running\":true%'")
+        if "auto_refresh" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN auto_refresh INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("UPDATE users SET auto_refresh = 1 WHERE config LIKE '%\"auto_refresh\":true%'")
+        
+        # 启动时只按索引读取少数需要恢复的用户，耗时不随用户总数增长
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_grab_running ON users(user_id) WHERE grab_running = 1")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_auto_refresh ON users(user_id) WHERE auto_refresh = 1")
+        
         conn.commit()
         conn.close()
     
-    def save_user(self, user_id: int, config: AutoDLConfig) -> bool:
+    @traced("storage.save_user")
+    def save_user(self, user_id: int, config: "AutoDLConfig") -> bool:
         """保存用户配置"""
         try:
             conn = sqlite3.connect(self.db_path)
@@ -37,19 +63,48 @@ class UserStorage:
             config_json = config.model_dump_json()
             
             cursor.execute(
-                "INSERT OR REPLACE INTO users (user_id, username, password, config) VALUES (?, ?, ?, ?)",
-                (user_id, config.username, config.password, config_json)
+                "INSERT OR REPLACE INTO users (user_id, username, password, config, grab_running, auto_refresh) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, config.username, config.password, config_json, *_flags(config))
             )
             
             conn.commit()
             conn.close()
             return True
         except Exception as e:
-            print(f"保存用户配置失败: {e}")
+            logging.error(f"保存用户配置失败: {e}", extra={"user_id": user_id})
             return False
     
-    def load_user(self, user_id: int) -> Optional[AutoDLConfig]:
+    @traced("storage.save_users")
+    def save_users(self, configs: Dict[int, "AutoDLConfig"]) -> bool:
+        """在一个事务中批量保存用户配置"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            rows = [
+                (user_id, config.username, config.password, config.model_dump_json(), *_flags(config))
+                for user_id, config in configs.items()
+            ]
+            
+            cursor.executemany(
+                "INSERT OR REPLACE INTO users (user_id, username, password, config, grab_running, auto_refresh) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            logging.error(f"批量保存用户配置失败: {e}")
+            return False
+    
+    @traced("storage.load_user")
+    def load_user(self, user_id: int) -> Optional["AutoDLConfig"]:
         """加载用户配置"""
+        from models import AutoDLConfig
+        
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
@@ -63,11 +118,14 @@ class UserStorage:
                 return AutoDLConfig.model_validate_json(result[0])
             return AutoDLConfig()
         except Exception as e:
-            print(f"加载用户配置失败: {e}")
+            logging.error(f"加载用户配置失败: {e}", extra={"user_id": user_id})
             return AutoDLConfig()
     
-    def load_all_users(self) -> Dict[int, AutoDLConfig]:
+    @traced("storage.load_all_users")
+    def load_all_users(self) -> Dict[int, "AutoDLConfig"]:
         """加载所有用户配置"""
+        from models import AutoDLConfig
+        
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
@@ -83,5 +141,66 @@ class UserStorage:
             
             return user_configs
         except Exception as e:
-            print(f"加载所有用户配置失败: {e}")
-            return {}
\ No newline at end of file
+            logging.error(f"加载所有用户配置失败: {e}")
+            return {}
+    
+    def _load_flagged(self, column: str) -> Dict[int, "AutoDLConfig"]:
+        """按状态列（有索引）预先过滤，只解析命中的配置"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute(f"SELECT user_id, config FROM users WHERE {column} = 1")
+        results = cursor.fetchall()
+        
+        conn.close()
+        
+        if not results:
+            return {}
+        # 没有命中的配置时不导入pydantic
+        from models import AutoDLConfig
+        return {
+            user_id: AutoDLConfig.model_validate_json(config_json)
+            for user_id, config_json in results
+        }
+    
+    @traced("storage.load_running_users")
+    def load_running_users(self) -> Dict[int, "AutoDLConfig"]:
+        """只加载有运行中抢卡任务的用户配置"""
+        try:
+            return {
+                user_id: config
+                for user_id, config in self._load_flagged("grab_running").items()
+                if config.grab_config and config.grab_config.is_running
+            }
+        except Exception as e:
+            logging.error(f"加载运行中的用户配置失败: {e}")
+            return {}
+    
+    @traced("storage.load_auto_refresh_users")
+    def load_auto_refresh_users(self) -> Dict[int, "AutoDLConfig"]:
+        """只加载开启了自动刷新时长的用户配置"""
+        try:
+            return {
+                user_id: config
+                for user_id, config in self._load_flagged("auto_refresh").items()
+                if config.auto_refresh
+            }
+        except Exception as e:
+            logging.error(f"加载自动刷新用户配置失败: {e}")
+            return {}
+    
+    @traced("storage.load_auto_refresh_user_ids")
+    def load_auto_refresh_user_ids(self) -> List[int]:
+        """开启了自动刷新时长的用户ID，不解析配置"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT user_id FROM users WHERE auto_refresh = 1")
+            results = cursor.fetchall()
+            
+            conn.close()
+            return [row[0] for row in results]
+        except Exception as e:
+            logging.error(f"加载自动刷新用户失败: {e}")
+            return []
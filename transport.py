@@ -0,0 +1,239 @@
+# AutoDLClient 的HTTP传输层
+#
+# 所有客户端共用一个会话：连接池有上限，并发请求排队复用少量长连接，避免每次轮询重新握手TLS。
+# 可选HTTP/2（需要安装 httpx[http2]），并发请求在同一连接上多路复用。
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from metrics import DNS_LOOKUPS_TOTAL, HTTP_CONNECTIONS_TOTAL
+
+# 连接池已满时等待空闲连接的最长秒数
+POOL_TIMEOUT = 15.0
+
+
+def _keepalive_options(idle: int = 30, interval: int = 10, count: int = 3) -> List[Tuple[int, int, int]]:
+    """TCP保活选项，及时发现被中间设备静默断开的空闲连接"""
+    options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    elif hasattr(socket, "TCP_KEEPALIVE"):
+        # macOS
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval))
+    if hasattr(socket, "TCP_KEEPCNT"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count))
+    return options
+
+
+class DnsCache:
+    """缓存连接池访问的主机的解析结果；解析失败时继续使用过期结果"""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        """主机的IP地址列表（保持解析结果的顺序）"""
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            DNS_LOOKUPS_TOTAL.inc("hit")
+            return list(entry[1])
+
+        try:
+            infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            if entry is None:
+                raise
+            DNS_LOOKUPS_TOTAL.inc("stale")
+            return list(entry[1])
+
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        DNS_LOOKUPS_TOTAL.inc("miss")
+        with self._lock:
+            self._entries[key] = (time.monotonic(), addresses)
+        return list(addresses)
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+# 当前线程的请求是否新建了连接
+_conn_state = threading.local()
+
+
+class _CachedDnsMixin:
+    """建立TCP连接时用所属连接池的DNS缓存解析主机名；SNI和证书校验仍使用原主机名"""
+
+    dns_cache: Optional[DnsCache] = None
+
+    def _new_conn(self):
+        host = self._dns_host
+        if self.dns_cache is None or _is_ip(host):
+            return super()._new_conn()
+        try:
+            addresses = self.dns_cache.resolve(host, self.port)
+        except socket.gaierror:
+            # 交给 urllib3 解析并抛出它自己的错误
+            return super()._new_conn()
+
+        # 只在建立套接字期间替换解析用的主机名，依次尝试各个地址
+        for i, address in enumerate(addresses):
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except (NewConnectionError, ConnectTimeoutError):
+                if i == len(addresses) - 1:
+                    raise
+            finally:
+                self._dns_host = host
+        return super()._new_conn()
+
+
+class _CachedDnsHTTPConnection(_CachedDnsMixin, HTTPConnection):
+    pass
+
+
+class _CachedDnsHTTPSConnection(_CachedDnsMixin, HTTPSConnection):
+    pass
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDnsHTTPConnection
+    dns_cache: Optional[DnsCache] = None
+
+    def _new_conn(self):
+        _conn_state.opened = True
+        conn = super()._new_conn()
+        conn.dns_cache = self.dns_cache
+        return conn
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(POOL_TIMEOUT if timeout is None else timeout)
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDnsHTTPSConnection
+    dns_cache: Optional[DnsCache] = None
+
+    def _new_conn(self):
+        _conn_state.opened = True
+        conn = super()._new_conn()
+        conn.dns_cache = self.dns_cache
+        return conn
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(POOL_TIMEOUT if timeout is None else timeout)
+
+
+class PooledAdapter(HTTPAdapter):
+    """有上限的连接池：超过pool_size的并发请求等待空闲连接，而不是新建后丢弃"""
+
+    def __init__(self, pool_size: int = 16, keepalive: bool = True, dns_ttl: float = 300.0):
+        self._socket_options = _keepalive_options() if keepalive else None
+        # DNS缓存只属于这个适配器，不影响进程内其他代码的域名解析
+        self.dns_cache = DnsCache(dns_ttl) if dns_ttl > 0 else None
+        super().__init__(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self._socket_options:
+            pool_kwargs["socket_options"] = self._socket_options
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("_HTTPConnectionPool", (_CountingHTTPConnectionPool,), {"dns_cache": self.dns_cache}),
+            "https": type("_HTTPSConnectionPool", (_CountingHTTPSConnectionPool,), {"dns_cache": self.dns_cache}),
+        }
+
+    def send(self, request, **kwargs):
+        _conn_state.opened = False
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            HTTP_CONNECTIONS_TOTAL.inc("http1", "opened" if _conn_state.opened else "reused")
+
+
+class PooledSession(requests.Session):
+    """可被多个账号的客户端共用的 requests 会话"""
+
+    def __init__(self, pool_size: int = 16, keepalive: bool = True, dns_ttl: float = 300.0):
+        super().__init__()
+        adapter = PooledAdapter(pool_size, keepalive, dns_ttl)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        # 认证使用请求头中的token，不保存cookie，避免不同账号之间串用
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+
+class HTTP2Session:
+    """基于httpx的会话，并发请求在同一连接上多路复用；提供 AutoDLClient 用到的 request() 和 headers"""
+
+    def __init__(self, pool_size: int = 4, keepalive: bool = True, keepalive_expiry: float = 60.0):
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._httpx = httpx
+        self._client = httpx.Client(transport=httpx.HTTPTransport(
+            http2=True,
+            limits=limits,
+            socket_options=_keepalive_options() if keepalive else None,
+        ))
+        self._client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.headers = self._client.headers
+
+    def request(self, method: str, url: str, json=None, headers=None, timeout=None):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = self._httpx.Timeout(read, connect=connect, pool=POOL_TIMEOUT)
+
+        opened = []
+
+        def trace(event: str, info) -> None:
+            if event == "connection.connect_tcp.started":
+                opened.append(True)
+
+        try:
+            return self._client.request(
+                method, url, json=json, headers=headers, timeout=timeout, extensions={"trace": trace}
+            )
+        finally:
+            HTTP_CONNECTIONS_TOTAL.inc("http2", "opened" if opened else "reused")
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def create_transport(pool_size: int = 16, keepalive: bool = True, dns_ttl: float = 300.0, http2: bool = False):
+    """创建 AutoDLClient 使用的会话；未安装 httpx[http2] 时退回HTTP/1.1"""
+    # dns_ttl 只对HTTP/1.1连接池生效（0表示不缓存）；HTTP/2多路复用下很少新建连接，不缓存DNS
+    if http2:
+        try:
+            return HTTP2Session(pool_size, keepalive)
+        except ImportError:
+            logging.warning("未安装 httpx[http2]，使用HTTP/1.1连接池")
+    return PooledSession(pool_size, keepalive, dns_ttl)
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from message_sender import DEFAULT_MAX_LENGTH, split_message
+
+if TYPE_CHECKING:
+    from models import Instance
+
+SEPARATOR = "----------------"
+
+
+def snapshot_fingerprint(instances: List["Instance"]) -> int:
+    """实例列表中影响展示内容的字段的摘要（仅在本进程内有效）"""
+    return hash(tuple(
+        (
+            instance.uuid,
+            instance.region_name,
+            instance.machine_alias,
+            instance.snapshot_gpu_alias_name,
+            instance.gpu_idle_num,
+            instance.gpu_all_num,
+            instance.status,
+            instance.stopped_at.get("time") if instance.stopped_at else None,
+        )
+        for instance in instances
+    ))
+
+
+def _remaining_text(instance: "Instance", now: datetime) -> Optional[str]:
+    release_time = instance.release_at()
+    if release_time is None or release_time <= now:
+        return None
+    remaining = int((release_time - now).total_seconds())
+    return f"还剩{remaining // 3600}小时{remaining % 3600 // 60}分钟"
+
+
+def _block(index: int, lines: List[str]) -> str:
+    # 实例之间用分隔线隔开，分隔线放在后一段开头，切分时不会单独成条
+    text = "\n".join(lines) + "\n"
+    return f"{SEPARATOR}\n{text}" if index > 0 else text
+
+
+def gpu_status_blocks(instances: List["Instance"], now: datetime) -> Iterator[str]:
+    """/gpuvalid 的输出，每个实例一段"""
+    yield "GPU状态:\n\n"
+    for i, instance in enumerate(instances):
+        lines = [
+            f"机器: {instance.region_name}-{instance.machine_alias}",
+            f"显卡: {instance.snapshot_gpu_alias_name}",
+            f"UUID: {instance.uuid}",
+            f"GPU数量: {instance.gpu_idle_num}/{instance.gpu_all_num}",
+        ]
+        remaining = _remaining_text(instance, now)
+        if remaining:
+            lines.append(f"释放时间: {remaining}")
+        yield _block(i, lines)
+
+
+def instance_list_blocks(instances: List["Instance"], now: datetime) -> Iterator[str]:
+    """/instances 的输出"""
+    yield "实例列表:\n\n"
+    for i, instance in enumerate(instances):
+        yield _block(i, [
+            f"{i+1}. {instance.region_name}-{instance.machine_alias}",
+            f"显卡: {instance.snapshot_gpu_alias_name}",
+            f"UUID: {instance.uuid}",
+            f"GPU: {instance.gpu_idle_num}/{instance.gpu_all_num}",
+        ])
+
+
+def gpu_summary_blocks(instances: List["Instance"], now: datetime) -> Iterator[str]:
+    """内容函数 check_autodl_gpu 的输出"""
+    yield "🖥️ 您的AutoDL实例情况：\n\n"
+    available_gpus = 0
+    for i, instance in enumerate(instances):
+        if instance.gpu_idle_num > 0:
+            available_gpus += 1
+        yield _block(i, [
+            f"📊 {instance.region_name}-{instance.machine_alias}",
+            f"🔌 显卡: {instance.snapshot_gpu_alias_name}",
+            f"🆔 UUID: {instance.uuid}",
+            f"🎮 GPU状态: {instance.gpu_idle_num}/{instance.gpu_all_num} 可用",
+        ])
+
+    # 添加总结信息
+    if available_gpus > 0:
+        yield f"\n✅ 总结: 您有 {available_gpus} 个实例有可用GPU"
+    else:
+        yield "\n❌ 总结: 目前没有可用的GPU资源"
+
+
+# 视图名 -> (生成函数, 内容是否随时间变化)
+VIEWS: Dict[str, Tuple[Callable[[List["Instance"], datetime], Iterator[str]], bool]] = {
+    "gpuvalid": (gpu_status_blocks, True),
+    "instances": (instance_list_blocks, False),
+    "gpu_summary": (gpu_summary_blocks, False),
+}
+
+
+def chunk_blocks(blocks: Iterable[str], max_length: int = DEFAULT_MAX_LENGTH) -> Iterator[str]:
+    """把段落流拼成不超过max_length的消息，攒满一条就产出，不构造完整文本"""
+    parts: List[str] = []
+    size = 0
+    for block in blocks:
+        if parts and size + len(block) > max_length:
+            yield "".join(parts).rstrip("\n")
+            parts, size = [], 0
+        if len(block) > max_length:
+            # 单段超长时单独切分
+            pieces = split_message(block, max_length)
+            yield from pieces[:-1]
+            block = pieces[-1]
+        parts.append(block)
+        size += len(block)
+    if parts:
+        yield "".join(parts).rstrip("\n")
+
+
+class ViewCache:
+    """按实例快照指纹缓存渲染好的消息分段"""
+
+    def __init__(self, max_size: int = 256, max_length: int = DEFAULT_MAX_LENGTH):
+        self.max_size = max_size
+        self.max_length = max_length
+        self._entries: "OrderedDict[Tuple[str, int, int], List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, view: str, instances: List["Instance"], now: Optional[float] = None) -> Iterator[str]:
+        """逐条产出消息；命中缓存时直接返回已渲染的分段"""
+        build, time_dependent = VIEWS[view]
+        now = time.time() if now is None else now
+        # 剩余时间按分钟显示，随时间变化的视图每分钟重新渲染
+        key = (view, snapshot_fingerprint(instances), int(now // 60) if time_dependent else 0)
+
+        with self._lock:
+            chunks = self._entries.get(key)
+            if chunks is not None:
+                self._entries.move_to_end(key)
+        if chunks is not None:
+            yield from chunks
+            return
+
+        chunks = []
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        for chunk in chunk_blocks(build(instances, moment), self.max_length):
+            chunks.append(chunk)
+            yield chunk
+
+        with self._lock:
+            self._entries[key] = chunks
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)